@@ -74,8 +74,12 @@ raw2hex( unsigned char *str, size_t len, char *out )
 static inline int
 byte2bin(char a, char *out)
 {
-	// The python strips leading zeroes
+	// The python strips leading zeroes, but format(0, 'b') is still '0'
     int z, m = 0, k = 0;
+    if( a == 0 ) {
+    	*out = '0';
+    	return 1;
+    }
     for (z = 0; z < 8; z++)
     {
     	char tmp = !!((a << z) & 0x80);
@@ -214,6 +218,113 @@ int native_bismuth_miner( const char *address_hex, const char *db_block_hash_hex
 	return 0;
 }
 
+static const char *
+bin_search( const char *haystack, size_t haystack_len, const char *needle, size_t needle_len )
+{
+	if( needle_len == 0 )
+		return haystack;
+	if( needle_len > haystack_len )
+		return NULL;
+	const char *end = haystack + (haystack_len - needle_len);
+	for( const char *pos = haystack; pos <= end; pos++ )
+	{
+		if( *pos == *needle && ! memcmp(pos, needle, needle_len) )
+			return pos;
+	}
+	return NULL;
+}
+
+
+/*
+ * Bits of the share hash and the block hash, as the Python `_bin_convert`
+ * would produce them. The needle buffer is malloc'd, caller must free it.
+ */
+static char *
+share2bin( const char *address, size_t address_len, const char *nonce, size_t nonce_len,
+           const char *db_block_hash, size_t db_block_hash_len,
+           char *haystack, size_t *haystack_len, size_t *needle_len )
+{
+	SHA256_CTX ctx;
+	unsigned char hash_raw[SHA224_DIGEST_LENGTH];
+
+	SHA224_Init(&ctx);
+	SHA224_Update(&ctx, address, address_len);
+	SHA224_Update(&ctx, nonce, nonce_len);
+	SHA224_Update(&ctx, db_block_hash, db_block_hash_len);
+	SHA224_Final(hash_raw, &ctx);
+	*haystack_len = raw2hexbin(hash_raw, sizeof(hash_raw), haystack);
+
+	char *needle = malloc((db_block_hash_len * 8) + 1);
+	if( needle == NULL )
+		return NULL;
+	*needle_len = raw2bin((unsigned char *)db_block_hash, db_block_hash_len, needle);
+	return needle;
+}
+
+
+/*
+ * Same result as `needle[0:diff_len] in haystack` in Python
+ * Returns 1 if found, 0 if not found, -1 on error
+ */
+int native_bismuth_verify( const char *address, size_t address_len, const char *nonce, size_t nonce_len,
+                           const char *db_block_hash, size_t db_block_hash_len, long diff_len )
+{
+	char haystack[SHA224_DIGEST_HEXBINLENGTH + 1];
+	size_t haystack_len, needle_len;
+	char *needle = share2bin(address, address_len, nonce, nonce_len, db_block_hash, db_block_hash_len,
+	                         haystack, &haystack_len, &needle_len);
+	if( needle == NULL )
+		return -1;
+
+	// Python slice semantics for the needle prefix
+	if( diff_len < 0 ) {
+		diff_len += needle_len;
+		if( diff_len < 0 )
+			diff_len = 0;
+	}
+	if( (size_t)diff_len > needle_len )
+		diff_len = needle_len;
+
+	int found = bin_search(haystack, haystack_len, needle, diff_len) != NULL;
+	free(needle);
+	return found;
+}
+
+
+/*
+ * Longest prefix of the block hash bits found in the share hash bits, in
+ * range(1, len(needle) - 1), like the Python `difficulty`.
+ * Returns -1 if there is no such prefix, -2 on error
+ */
+long native_bismuth_difficulty( const char *address, size_t address_len, const char *nonce, size_t nonce_len,
+                                const char *db_block_hash, size_t db_block_hash_len )
+{
+	char haystack[SHA224_DIGEST_HEXBINLENGTH + 1];
+	size_t haystack_len, needle_len;
+	char *needle = share2bin(address, address_len, nonce, nonce_len, db_block_hash, db_block_hash_len,
+	                         haystack, &haystack_len, &needle_len);
+	if( needle == NULL )
+		return -2;
+
+	// Every prefix of a matching prefix also matches, binary search the longest
+	long lowest = 1, highest = (long)needle_len - 2;
+	if( highest < lowest || ! bin_search(haystack, haystack_len, needle, lowest) ) {
+		free(needle);
+		return -1;
+	}
+	while( lowest < highest )
+	{
+		long middle = (lowest + highest + 1) / 2;
+		if( bin_search(haystack, haystack_len, needle, middle) )
+			lowest = middle;
+		else
+			highest = middle - 1;
+	}
+	free(needle);
+	return lowest;
+}
+
+
 #ifdef BISMUTH_MAIN
 
 
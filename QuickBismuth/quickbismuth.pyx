@@ -3,7 +3,7 @@ import os
 import argparse
 import time
 import socket
-import hashlib
+import select
 import sys
 import logging as LOG
 import threading
@@ -17,7 +17,11 @@ def thread_id():
 
 
 cdef extern:
-    int native_bismuth_miner( char *address_hex, char *db_block_hash_hex, int diff_len, int max_N, char *output_success, size_t *output_cyclecount )
+    int native_bismuth_miner( char *address_hex, char *db_block_hash_hex, int diff_len, int max_N, char *output_success, size_t *output_cyclecount ) nogil
+    int native_bismuth_verify( const char *address, size_t address_len, const char *nonce, size_t nonce_len,
+                               const char *db_block_hash, size_t db_block_hash_len, long diff_len ) nogil
+    long native_bismuth_difficulty( const char *address, size_t address_len, const char *nonce, size_t nonce_len,
+                                    const char *db_block_hash, size_t db_block_hash_len ) nogil
     const char *native_bismuth_version()
 
 __version__ = native_bismuth_version()
@@ -25,6 +29,10 @@ __version__ = native_bismuth_version()
 
 CONNECT_TIMEOUT = 5
 POOL_PORT = 5657
+# Longest frame taken from the pool, larger lengths are a broken stream
+MAX_FRAME = 1024 * 1024
+# Nonces per `bismuth_mine` call, threads check for a new job in between
+MINE_CHUNK = 50000
 
 
 MinerJob = namedtuple('MinerJob', ('diff', 'address', 'hash'))
@@ -32,12 +40,15 @@ MinerThreadResult = namedtuple('MinerThreadResult', ('job', 'cyclecount', 'block
 
 
 class MinerProtocol(object):
-    __slots__ = ('_sock', '_sockaddr', 'rewards')
+    __slots__ = ('_sock', '_sockaddr', 'rewards', 'push', '_rbuf', '_rpos')
 
     def __init__(self, sock, rewards=None):
         self._sock = sock
         self._sockaddr = sock.getpeername()
         self.rewards = rewards
+        self.push = False
+        self._rbuf = bytearray()
+        self._rpos = 0
         self._on_connect()
 
     def close(self):
@@ -46,20 +57,45 @@ class MinerProtocol(object):
             self._sock = None
 
     def _on_connect(self):
-        # Send our version identifier
-        self._send('version', __version__, str(self.rewards))
+        # Send our version identifier, asking for new jobs to be pushed
+        # Older pools ignore the extra part and reply 'ok'
+        self._send('version', __version__ + '.push', str(self.rewards))
         result = self._recv()
-        if result != 'ok':
+        if result not in ('ok', 'ok.push'):
             raise socket.error("Protocol mismatch: %r" % (result,))
-        LOG.info('[*] Peer %r - Connected', self._sockaddr)
+        self.push = result == 'ok.push'
+        LOG.info('[*] Peer %r - Connected, push=%r', self._sockaddr, self.push)
         return True
 
+    def _job(self):
+        return MinerJob(float(self._recv()), str(self._recv()), str(self._recv()))
+
     def _getwork(self):
         diff = self._recv()
+        while diff == 'miner_job':
+            # Pushed before our request was answered, the reply is newer
+            self._job()
+            diff = self._recv()
         if diff == 'wait':
             return None
         return MinerJob(float(diff), str(self._recv()), str(self._recv()))
 
+    def poll(self):
+        """
+        Return a job pushed by the pool since the last call, or None
+        """
+        job = None
+        while self.push:
+            if len(self._rbuf) == self._rpos:
+                readable, _, _ = select.select([self._sock], [], [], 0)
+                if not readable:
+                    break
+            frame = self._recv()
+            if frame != 'miner_job':
+                raise socket.error("Unexpected frame: %r" % (frame,))
+            job = self._job()
+        return job
+
     def fetch(self, job=None):
         if job is not None:
             return self.exch(job)
@@ -73,26 +109,32 @@ class MinerProtocol(object):
         return self._getwork()
 
     def _send(self, *args):
+        frames = []
         for data in args:
             data = str(data)
-            self._sock.sendall((str(len(data))).zfill(10))
-            self._sock.sendall(data)
+            frames.append(str(len(data)).zfill(10))
+            frames.append(data)
+        self._sock.sendall(''.join(frames))
+
+    def _read(self, size):
+        buf = self._rbuf
+        while len(buf) - self._rpos < size:
+            if self._rpos:
+                del buf[:self._rpos]
+                self._rpos = 0
+            chunk = self._sock.recv(4096)
+            if not chunk:
+                raise socket.error("Socket connection broken")
+            buf += chunk
+        start = self._rpos
+        self._rpos = start + size
+        return bytes(buf[start:self._rpos])
 
     def _recv(self, datalen=10):
-        data = self._sock.recv(datalen)
-        if not data:
-            raise socket.error('No data')
-        data = int(data)
-        chunks = []
-        bytes_recvd = 0
-        while bytes_recvd < data:
-            chunk = self._sock.recv(min(data - bytes_recvd, 2000))
-            if chunk == b'':
-                raise socket.error("Socket connection broken")
-            chunks.append(chunk)
-            bytes_recvd = bytes_recvd + len(chunk)
-        segments = b''.join(chunks)
-        return segments
+        prefix = self._read(datalen)
+        if not prefix.isdigit() or int(prefix) > MAX_FRAME:
+            raise socket.error("Invalid frame length: %r" % (prefix,))
+        return self._read(int(prefix))
 
 
 def parse_args():
@@ -129,6 +171,13 @@ class MinerThreadPool(object):
         self.cond.wait(timeout)
         self.cond.release()
 
+    def set_job(self, new_job):
+        self.lock()
+        try:
+            self.job = new_job
+        finally:
+            self.unlock()
+
     def sync(self, new_job=None, timeout=5):
         LOG.debug('Acquiring sync condition')
         self.wait(timeout)
@@ -168,8 +217,13 @@ class MinerThreadPool(object):
                 continue
             self.unlock()
 
-            mine_args = (job.diff, job.address, job.hash, 500000, os.urandom(32))
-            cyclecount, block_key = bismuth_mine(*mine_args)
+            # Mine in chunks, dropping the rest of the batch as soon as
+            # a new job is set, so no work is wasted on a stale block
+            cyclecount, block_key = 0, None
+            while cyclecount < 500000 and block_key is None and self.job is job:
+                mine_args = (job.diff, job.address, job.hash, MINE_CHUNK, os.urandom(32))
+                chunk_cycles, block_key = bismuth_mine(*mine_args)
+                cyclecount += chunk_cycles
             print("Finished", cyclecount)
 
             self.lock()
@@ -215,6 +269,8 @@ def main(args):
     miner_proto = MinerProtocol(sock, opts.rewards)
     miner_threads = MinerThreadPool(opts.threads)
     miner_threads.start()
+    # With push enabled wake up often to switch jobs as soon as they arrive
+    sync_timeout = 0.5 if miner_proto.push else 5
 
     try:
         job = None
@@ -232,8 +288,8 @@ def main(args):
                 last_update = now
 
             # Sync the thread pool status, retrieve results, update it with new job
-            need_fetch = job is None        
-            old_job, results_list = miner_threads.sync(job)
+            need_fetch = job is None
+            old_job, results_list = miner_threads.sync(job, sync_timeout)
 
             # Loop through results, submitting results and updating counters
             for result_job, result_cycles, result_key in results_list:
@@ -261,6 +317,17 @@ def main(args):
                 except Exception:
                     LOG.exception('[!] Failed to fetch work')
                     break
+
+            # Switch the threads over to a pushed job straight away
+            try:
+                pushed = miner_proto.poll()
+            except Exception:
+                LOG.exception('[!] Failed to read pushed job')
+                break
+            if pushed:
+                LOG.debug(' -  Pushed job: %r', pushed)
+                job = pushed
+                miner_threads.set_job(job)
     except KeyboardInterrupt:
         LOG.warning("Ctrl+C caught, graceful seppuku in honor of keyboard gods")
 
@@ -268,34 +335,35 @@ def main(args):
     return 0
 
 
-cdef _bin_convert(string):
-    return ''.join(format(ord(x), 'b') for x in string)
-
-
-def bismuth_difficulty(address, nonce, db_block_hash):
-    needle = _bin_convert(db_block_hash)
-    input = address + nonce + db_block_hash
-    haystack = _bin_convert(hashlib.sha224(input).hexdigest())
-    return max([N for N in range(1, len(needle) - 1) if needle[:N] in haystack])
-
-
-def bismuth_verify(address, nonce, db_block_hash, diff_len):
-    mining_search_bin = _bin_convert(db_block_hash)[0:diff_len]
-    mining_input = address + nonce + db_block_hash
-    mining_hash = hashlib.sha224(mining_input).hexdigest()
-    mining_bin = _bin_convert(mining_hash)
-    """
-    print "---"
-    print "VERIFY PYTHON:"
-    print "\tNonce:", nonce
-    print "\tDB Block hash:", db_block_hash
-    print "\tMining input:", mining_input
-    print "\tMining hash:", mining_hash  
-    print "\tHaystack:", mining_bin
-    print "\tNeedle:", mining_search_bin
-    print "---"
-    """
-    if mining_search_bin in mining_bin:
+def bismuth_difficulty(bytes address, bytes nonce, bytes db_block_hash):
+    cdef const char *c_address = address
+    cdef const char *c_nonce = nonce
+    cdef const char *c_block_hash = db_block_hash
+    cdef size_t address_len = len(address), nonce_len = len(nonce), block_hash_len = len(db_block_hash)
+    cdef long result
+    with nogil:
+        result = native_bismuth_difficulty(c_address, address_len, c_nonce, nonce_len,
+                                           c_block_hash, block_hash_len)
+    if result == -2:
+        raise MemoryError()
+    if result < 0:
+        raise ValueError('No prefix of %r found in hash' % (db_block_hash,))
+    return result
+
+
+def bismuth_verify(bytes address, bytes nonce, bytes db_block_hash, diff_len):
+    cdef const char *c_address = address
+    cdef const char *c_nonce = nonce
+    cdef const char *c_block_hash = db_block_hash
+    cdef size_t address_len = len(address), nonce_len = len(nonce), block_hash_len = len(db_block_hash)
+    cdef long c_diff_len = int(diff_len)
+    cdef int result
+    with nogil:
+        result = native_bismuth_verify(c_address, address_len, c_nonce, nonce_len,
+                                       c_block_hash, block_hash_len, c_diff_len)
+    if result < 0:
+        raise MemoryError()
+    if result:
         return True
 
 
@@ -304,8 +372,14 @@ def bismuth_mine(diff, address, db_block_hash, N=500000, seed=None):
     cdef char found_nonce[33]
     cdef char *seed_str = seed
     cdef size_t cyclecount = 0
+    cdef char *c_address = address
+    cdef char *c_block_hash = db_block_hash
+    cdef int max_N = int(N)
+    cdef int found
     memcpy(found_nonce, <void*>seed_str, 32)
-    if native_bismuth_miner(address, db_block_hash, diff_len, int(N), found_nonce, &cyclecount):
+    with nogil:
+        found = native_bismuth_miner(c_address, c_block_hash, diff_len, max_N, found_nonce, &cyclecount)
+    if found:
         if bismuth_verify(address, found_nonce, db_block_hash, diff_len):
             return cyclecount, found_nonce
     return cyclecount, None
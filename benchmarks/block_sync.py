@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Parsing and hashing block sync payloads with `ast.literal_eval`, against
+the streaming parser in `pooledbismuth.literal`. Reports the whole time
+per payload and the longest stretch without yielding to other greenlets.
+
+Payloads are read from a file, one repr'd block list per line as a node
+sends them, or made up like those of a busy node.
+
+    PYTHONPATH=. python benchmarks/block_sync.py [payloads file | blocks per payload] [transactions per block]
+"""
+from __future__ import print_function
+import os
+import ast
+import sys
+import time
+import random
+
+from Crypto.PublicKey import RSA
+
+from pooledbismuth.common import Identity
+from pooledbismuth.literal import iter_list
+from pooledbismuth.pool import PeerManager
+
+sys.path.insert(0, os.path.dirname(__file__))
+from peer_blocks import make_chain, make_peer  # noqa: E402
+
+
+def make_payloads(count, per_payload, per_block):
+    blocks = [ast.literal_eval(text)[0] for text in make_chain(count * per_payload, per_block, time.time())]
+    return [str(blocks[N:N + per_payload]) for N in range(0, len(blocks), per_payload)]
+
+
+def timed_blocks(block_list, stalls):
+    """
+    Each block of `block_list`, noting the time taken to get to it
+    """
+    begin = time.time()
+    for transaction_list in block_list:
+        stalls.append(time.time() - begin)
+        yield transaction_list
+        begin = time.time()
+
+
+def measure(manager, payloads, parse):
+    peer = make_peer(manager, 0, False)
+    stalls = list()
+    begin = time.time()
+    for text in payloads:
+        # literal_eval parses the lot before the first block is hashed
+        started = time.time()
+        block_list = parse(text)
+        stalls.append(time.time() - started)
+        peer._add_blocks(timed_blocks(block_list, stalls))
+    return peer.blockhash, time.time() - begin, max(stalls)
+
+
+def main(args):
+    random.seed(1)
+    if args and os.path.exists(args[0]):
+        with open(args[0]) as handle:
+            payloads = [line.strip() for line in handle if line.strip()]
+        source = args[0]
+    else:
+        per_payload = int(args[0]) if args else 120
+        per_block = int(args[1]) if len(args) > 1 else 5
+        payloads = make_payloads(10, per_payload, per_block)
+        source = "10 payloads of %d blocks of %d transactions" % (per_payload, per_block)
+    size = sum([len(text) for text in payloads])
+    print("%s, %.1f MB" % (source, size / 1e6))
+    manager = PeerManager(Identity(keydata=RSA.generate(1024).exportKey()))
+    results = dict()
+    for name, parse in (('literal_eval', ast.literal_eval), ('iter_list', iter_list)):
+        blockhash, elapsed, stall = results[name] = measure(manager, payloads, parse)
+        print("%-13s %7.1f ms/payload   %6.1f MB/s   longest stall %6.2f ms" % (
+            name, elapsed / len(payloads) * 1e3, size / elapsed / 1e6, stall * 1e3))
+    assert len(set([result[0] for result in results.values()])) == 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+PeerManager.consensus() with many synched peers: recounting every block of
+every peer on each read, against the incrementally maintained index. Also
+the top row alone, read on every miner_fetch, after each new block.
+
+    PYTHONPATH=. python benchmarks/consensus_tally.py [peers]
+"""
+from __future__ import print_function
+import sys
+import time
+import random
+import hashlib
+from collections import defaultdict
+
+from Crypto.PublicKey import RSA
+
+from pooledbismuth.common import ConsensusBlock, Identity, IpPort
+from pooledbismuth.pool import BismuthClient, PeerManager
+
+
+class FakeSocket(object):
+    def close(self):
+        pass
+
+
+def legacy_consensus(manager):
+    """Counting part of PeerManager.consensus() before the index"""
+    total_peers = 0
+    blocks = list()
+    for peer in manager.peers.values():
+        if not peer.synched:
+            continue
+        total_peers += 1
+        blocks.extend(peer.blocks)
+    counts = defaultdict(int)
+    heights = dict()
+    timestamps = dict()
+    for block in blocks:
+        heights[block.hash] = block.height
+        counts[block.hash] += 1
+        timestamps[block.hash] = block.stamp
+    result = list()
+    for block_hash, num in counts.items():
+        consensus_pct = (num / float(total_peers)) * 100.0
+        result.append((ConsensusBlock(int(heights[block_hash]), block_hash, timestamps[block_hash]), num, consensus_pct))
+    return sorted(result, lambda x, y: int(y[0].height - x[0].height))
+
+
+def make_chain(store, length, now):
+    chain = list()
+    block_hash = '0' * 56
+    for height in range(length):
+        stamp = now - (length - height) * 60
+        txns = [('%.2f' % (stamp - N,), 'a' * 56, 'b' * 56, '1.0') for N in range(5)]
+        block_hash = hashlib.sha224(str(txns) + block_hash).hexdigest()
+        chain.append(store.add(100000 + height, block_hash, txns))
+    return chain
+
+
+def make_peer(manager, N, chain):
+    client = BismuthClient.__new__(BismuthClient)
+    client.sockaddr = IpPort('10.0.%d.%d' % (N // 256, N % 256), 5658)
+    client.sock = FakeSocket()
+    client.manager = manager
+    client.blocks = manager.store.ring(chain)
+    client._window = None
+    client.connected_at = time.time()
+    client.blockheight = client.their_blockheight = chain[-1].height
+    client.blockhash = client.their_blockhash = chain[-1].hash
+    manager.peers[client.sockaddr] = client
+    client._vote()
+    return client
+
+
+def timed(func, rounds):
+    begin = time.time()
+    for _ in range(rounds):
+        func()
+    return ((time.time() - begin) / rounds) * 1000000
+
+
+def main(args):
+    npeers = int(args[0]) if args else 500
+    manager = PeerManager(Identity(keydata=RSA.generate(1024).exportKey()))
+    chain = make_chain(manager.store, 120, time.time())
+    peers = [make_peer(manager, N, chain) for N in range(npeers)]
+
+    assert [row[:2] for row in legacy_consensus(manager)] == [row[:2] for row in manager.index.rows()]
+
+    def new_block():
+        # A new block arrives at one peer, as _cmd_blocksfnd would store it
+        peer = random.choice(peers)
+        last = peer.blocks[-1]
+        peer.blocks.append(manager.store.intern(last.height + 1, '%056x' % (random.getrandbits(224),), time.time()))
+        peer.blockheight = peer.their_blockheight = peer.blocks[-1].height
+        peer.blockhash = peer.their_blockhash = peer.blocks[-1].hash
+        peer._vote()
+
+    print("peers\t%d" % (npeers,))
+    print("legacy read\t%.1f usec" % (timed(lambda: legacy_consensus(manager), 20),))
+    print("index read\t%.1f usec" % (timed(manager.consensus, 2000),))
+    print("index update\t%.1f usec" % (timed(new_block, 2000),))
+    print("update + read\t%.1f usec" % (timed(lambda: (new_block(), manager.consensus()), 200),))
+    # What each miner_fetch reads
+    print("update + top\t%.1f usec" % (timed(lambda: (new_block(), manager.top()), 2000),))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
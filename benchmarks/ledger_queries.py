@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Ledger queries on a synthetic ledger with the node's original schema, which
+has no index on block_height, against the same queries through the side
+index, and with an index added to the ledger itself.
+
+    PYTHONPATH=. python benchmarks/ledger_queries.py [transactions] [per_block]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import tempfile
+
+from pooledbismuth.ledger import Ledger
+
+
+def make_ledger(path, transactions, per_block):
+    ledgerdb = sqlite3.connect(path)
+    ledgerdb.execute("""
+        CREATE TABLE transactions (
+            block_height INTEGER, timestamp TEXT, address TEXT, recipient TEXT, amount TEXT,
+            signature TEXT, public_key TEXT, block_hash TEXT, fee TEXT, reward TEXT,
+            keep TEXT, openfield TEXT)
+    """)
+    rows = list()
+    for height in range(transactions // per_block):
+        block_hash = '%056x' % (random.getrandbits(224),)
+        miner = '%056x' % (random.getrandbits(224),)
+        for N in range(per_block - 1):
+            rows.append((height, '%d' % (height * 60,), miner, miner[::-1], '1.0', '0.01', '0', block_hash, ''))
+        rows.append((height, '%d' % (height * 60,), miner, miner, '0', '0', '10', block_hash, '%032x' % (height,)))
+    ledgerdb.executemany("""
+        INSERT INTO transactions (block_height, timestamp, address, recipient, amount, fee, reward, block_hash, openfield)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    ledgerdb.commit()
+    return ledgerdb
+
+
+def timed(func, *args):
+    begin = time.time()
+    result = func(*args)
+    return result, (time.time() - begin) * 1000
+
+
+def queries(name, ledger):
+    top, top_time = timed(ledger.top)
+    rewards, rewards_time = timed(ledger.last_rewards, 120)
+    recent, recent_time = timed(lambda: list(ledger.transactions(top - 100)))
+    print("%-12s top %9.2f ms   last 120 rewards %9.2f ms   last 100 blocks %9.2f ms (%d rows)" % (
+        name, top_time, rewards_time, recent_time, len(recent)))
+    return top, rewards, recent
+
+
+def main(args):
+    transactions = int(args[0]) if args else 1000000
+    per_block = int(args[1]) if len(args) > 1 else 10
+    path = tempfile.mkdtemp()
+    try:
+        ledger_path = os.path.join(path, 'ledger.db')
+        ledgerdb = make_ledger(ledger_path, transactions, per_block)
+        print("%d transactions" % (transactions,))
+
+        expected = queries("no index", Ledger(ledger_path))
+        indexed = Ledger(ledger_path, os.path.join(path, 'index.db'))
+        _, build_time = timed(indexed.refresh)
+        _, refresh_time = timed(indexed.refresh)
+        print("side index built in %.2fs, refreshed in %.2f ms" % (build_time / 1000, refresh_time))
+        assert queries("side index", indexed) == expected
+
+        ledgerdb.execute("CREATE INDEX block_height_index ON transactions (block_height)")
+        ledgerdb.commit()
+        assert queries("node index", Ledger(ledger_path)) == expected
+    finally:
+        shutil.rmtree(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+Load generator for the miner front-ends.
+
+Start a pool front-end with a fixed network difficulty and no peers:
+
+    PYTHONPATH=. python benchmarks/miner_load.py serve --backend event
+
+Then open simulated miners against it, each fetching a job every few
+seconds, and report server memory per connection and fetch latency:
+
+    PYTHONPATH=. python benchmarks/miner_load.py load --miners 50000 --pid <serve pid>
+"""
+from __future__ import print_function
+from gevent import monkey
+monkey.patch_all()
+
+import os
+import sys
+import time
+import random
+import socket
+import argparse
+import resource
+
+import gevent
+from Crypto.PublicKey import RSA
+
+from pooledbismuth.common import ConsensusBlock, Identity, IpPort, POOL_PORT
+from pooledbismuth.pool import PeerManager, Miners, EventMiners, ResultsManager
+
+
+class BenchPeers(PeerManager):
+    """No network peers, the difficulty is fixed"""
+    def difficulty(self):
+        return 40.0
+
+
+def serve(opts):
+    ResultsManager.open_journal()
+    ResultsManager.on_consensus(ConsensusBlock(1, '%056x' % (random.getrandbits(224),), time.time()))
+    miners_class = EventMiners if opts.backend == 'event' else Miners
+    peers = BenchPeers(Identity(keydata=RSA.generate(1024).exportKey()))
+    miners = miners_class(peers, opts.listen, opts.miners)
+    print("Serving %s backend on %s, pid %d" % (opts.backend, opts.listen, os.getpid()))
+    try:
+        while True:
+            gevent.sleep(60)
+    except KeyboardInterrupt:
+        miners.stop()
+        ResultsManager.close_journal()
+    return 0
+
+
+def rss_kb(pid):
+    with open('/proc/%d/status' % (pid,)) as handle:
+        for line in handle:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+def send(sock, *args):
+    sock.sendall(''.join([str(len(data)).zfill(10) + data for data in map(str, args)]))
+
+
+def recv(sock):
+    size = int(recv_exact(sock, 10))
+    return recv_exact(sock, size)
+
+
+def recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise socket.error("Socket connection broken")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+
+def fetch(sock):
+    begin = time.time()
+    send(sock, 'miner_fetch')
+    if recv(sock) != 'wait':
+        recv(sock), recv(sock)
+    return time.time() - begin
+
+
+def miner(peer, interval, deadline, latencies, sockets):
+    sock = socket.create_connection(peer)
+    sockets.append(sock)
+    send(sock, 'version', 'morty.load', '%056x' % (random.getrandbits(224),))
+    assert recv(sock) == 'ok'
+    fetch(sock)
+    while True:
+        gevent.sleep(random.uniform(0, interval * 2))
+        if time.time() > deadline:
+            break
+        latencies.append(fetch(sock))
+
+
+def load(opts):
+    host, port = opts.connect.split(':')
+    peer = IpPort(host, int(port))
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, opts.miners + 1024), hard))
+
+    rss_before = rss_kb(opts.pid) if opts.pid else None
+    latencies = []
+    sockets = []
+    deadline = time.time() + opts.duration
+    greenlets = []
+    for N in range(opts.miners):
+        greenlets.append(gevent.spawn(miner, peer, opts.interval, deadline, latencies, sockets))
+        if N % 500 == 0:
+            gevent.sleep(0.05)
+    while len(sockets) < opts.miners and time.time() < deadline:
+        gevent.sleep(0.5)
+    connected = len(sockets)
+    rss_after = rss_kb(opts.pid) if opts.pid else None
+
+    gevent.joinall(greenlets)
+    failed = len([G for G in greenlets if not G.successful()])
+    latencies.sort()
+    print("connected\t%d (%d failed)" % (connected, failed))
+    if rss_before is not None and connected:
+        print("server rss\t%d KB -> %d KB (%.2f KB/conn)" % (
+              rss_before, rss_after, (rss_after - rss_before) / float(connected)))
+    if latencies:
+        for name, pct in (('p50', 0.5), ('p99', 0.99), ('max', 1.0)):
+            index = min(len(latencies) - 1, int(len(latencies) * pct))
+            print("fetch %s\t%.2f ms" % (name, latencies[index] * 1000))
+    print("fetches\t%d" % (len(latencies),))
+    return 0
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Miner front-end load generator')
+    commands = parser.add_subparsers(dest='command')
+    cmd_serve = commands.add_parser('serve')
+    cmd_serve.add_argument('--backend', choices=('gevent', 'event'), default='gevent')
+    cmd_serve.add_argument('--listen', default='127.0.0.1:' + str(POOL_PORT))
+    cmd_serve.add_argument('--miners', type=int, default=100000, help="Maximum number of connections")
+    cmd_load = commands.add_parser('load')
+    cmd_load.add_argument('--connect', default='127.0.0.1:' + str(POOL_PORT))
+    cmd_load.add_argument('--miners', type=int, default=50000)
+    cmd_load.add_argument('--interval', type=float, default=5.0, help="Average seconds between fetches")
+    cmd_load.add_argument('--duration', type=float, default=60.0)
+    cmd_load.add_argument('--pid', type=int, help="Server process to measure memory of")
+    opts = parser.parse_args(args)
+    if opts.command == 'serve':
+        return serve(opts)
+    return load(opts)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Memory and speed of the seen-nonce index for one block, against a set of
+the nonce strings and a set of 64-bit digests. Each runs in a forked
+process, so memory is measured from a clean start.
+
+    PYTHONPATH=. python benchmarks/nonce_index.py [shares] [lookups]
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+
+from pooledbismuth.nonces import NonceIndex
+
+
+def rss():
+    with open('/proc/self/statm') as handle:
+        return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def nonces(first, last):
+    # Not range, which is a list in Python 2
+    N = first
+    while N < last:
+        yield '%032x' % (N * 2654435761,)
+        N += 1
+
+
+class DigestSet(object):
+    """
+    Python set of the same keyed 64-bit digests as `NonceIndex`
+    """
+    def __init__(self):
+        self.index = NonceIndex()
+        self.seen = set()
+
+    def add(self, nonce):
+        digest = self.index.digest(nonce)
+        if digest in self.seen:
+            return False
+        self.seen.add(digest)
+        return True
+
+    def __contains__(self, nonce):
+        return self.index.digest(nonce) in self.seen
+
+
+class StringSet(object):
+    def __init__(self):
+        self.seen = set()
+
+    def add(self, nonce):
+        if nonce in self.seen:
+            return False
+        self.seen.add(nonce)
+        return True
+
+    def __contains__(self, nonce):
+        return nonce in self.seen
+
+
+def measure(factory, shares, lookups):
+    before = rss()
+    index = factory()
+    begin = time.time()
+    for nonce in nonces(0, shares):
+        index.add(nonce)
+    added = time.time() - begin
+    memory = rss() - before
+    tables = index.memory() if isinstance(index, NonceIndex) else None
+    step = max(shares // lookups, 1)
+    hits = [nonce for N, nonce in enumerate(nonces(0, shares)) if N % step == 0][:lookups]
+    misses = list(nonces(shares, shares + len(hits)))
+    begin = time.time()
+    found = sum([1 for nonce in hits if nonce in index])
+    hit_time = time.time() - begin
+    begin = time.time()
+    found += sum([1 for nonce in misses if nonce in index])
+    miss_time = time.time() - begin
+    assert found == len(hits)
+    return dict(memory=memory, tables=tables, add=added / shares * 1e6, hit=hit_time / len(hits) * 1e6,
+                miss=miss_time / len(misses) * 1e6)
+
+
+def forked(factory, shares, lookups):
+    read, write = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read)
+        with os.fdopen(write, 'w') as handle:
+            handle.write(json.dumps(measure(factory, shares, lookups)))
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as handle:
+        data = handle.read()
+    os.waitpid(pid, 0)
+    return json.loads(data)
+
+
+def main(args):
+    shares = int(args[0]) if args else 10000000
+    lookups = int(args[1]) if len(args) > 1 else 1000000
+    print("%d shares, %d lookups each of seen and new nonces" % (shares, lookups))
+    for name, factory in (('NonceIndex', NonceIndex), ('set(digest)', DigestSet), ('set(nonce)', StringSet)):
+        result = forked(factory, shares, lookups)
+        print("%-12s %8.1f MB %6.1f bytes/share   add %5.2f us   seen %5.2f us   new %5.2f us" % (
+            name, result['memory'] / 1e6, result['memory'] / float(shares),
+            result['add'], result['hit'], result['miss']))
+        if result['tables']:
+            print("%-12s %8.1f MB in the tables" % ('', result['tables'] / 1e6))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
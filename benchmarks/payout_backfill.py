@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Rebuilding the pool database from a synthetic ledger, with the serial
+payout loop against the parallel backfill.
+
+    PYTHONPATH=. python benchmarks/payout_backfill.py [transactions] [processes...]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import resource
+import sqlite3
+import tempfile
+import multiprocessing
+
+from pooledbismuth.journal import ShareJournal, JournalReader
+from pooledbismuth.ledger import Ledger
+from pooledbismuth.payout import PayoutEngine, FIRST_HEIGHT
+
+from payout_engine import POOL, add_blocks
+
+
+def cpu_time(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def rebuild(path, processes=None):
+    dbpath = os.path.join(path, 'pool.db')
+    if os.path.exists(dbpath):
+        os.unlink(dbpath)
+    pooldb = sqlite3.connect(dbpath)
+    pooldb.text_factory = str
+    ledger = Ledger(os.path.join(path, 'ledger.db'))
+    journal = JournalReader(os.path.join(path, 'journal'))
+    begin = time.time()
+    parent, children = cpu_time(resource.RUSAGE_SELF), cpu_time(resource.RUSAGE_CHILDREN)
+    engine = PayoutEngine(pooldb, ledger, POOL, journal)
+    if processes is None:
+        total = engine.run()
+    else:
+        total = engine.backfill(os.path.join(path, 'journal'), processes)
+    elapsed = time.time() - begin
+    cpu = cpu_time(resource.RUSAGE_SELF) - parent, cpu_time(resource.RUSAGE_CHILDREN) - children
+    tables = [pooldb.execute("SELECT * FROM %s ORDER BY 1, 2" % (table,)).fetchall()
+              for table in ('blocks', 'workproof', 'checkpoint')]
+    journal.close()
+    ledger.close()
+    pooldb.close()
+    return total, elapsed, cpu, tables
+
+
+def main(args):
+    transactions = int(args[0]) if args else 300000
+    counts = [int(arg) for arg in args[1:]] or sorted(set([1, 2, 4, multiprocessing.cpu_count()]))
+    per_block = 10
+    path = tempfile.mkdtemp()
+    try:
+        ledgerdb = sqlite3.connect(os.path.join(path, 'ledger.db'))
+        ledgerdb.execute("""
+            CREATE TABLE transactions (
+                block_height INTEGER, timestamp TEXT, address TEXT, recipient TEXT, amount TEXT,
+                signature TEXT, public_key TEXT, block_hash TEXT, fee TEXT, reward TEXT,
+                keep TEXT, openfield TEXT)
+        """)
+        ledgerdb.execute("CREATE INDEX block_height_index ON transactions (block_height)")
+        journal = ShareJournal(os.path.join(path, 'journal'))
+        add_blocks(ledgerdb, journal, FIRST_HEIGHT + 1, transactions // per_block, per_block)
+        journal.close()
+        print("%d transactions, %d CPUs" % (transactions, multiprocessing.cpu_count()))
+
+        # The ordered pass in this process caps the speedup, whatever the CPU count
+        total, serial, cpu, expected = rebuild(path)
+        print("serial          %8d rows %8.2fs              cpu %6.2fs" % (total, serial, cpu[0]))
+        for processes in counts:
+            total, elapsed, cpu, tables = rebuild(path, processes)
+            assert tables == expected
+            print("backfill -j %-3d %8d rows %8.2fs %5.2fx  cpu %6.2fs ordered, %6.2fs workers" % (
+                processes, total, elapsed, serial / elapsed, cpu[0], cpu[1]))
+    finally:
+        shutil.rmtree(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
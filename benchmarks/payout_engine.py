@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Payout runs over a synthetic ledger: processing everything from scratch,
+which is what every run used to cost, against resuming from the checkpoint
+after a few more blocks arrive.
+
+    PYTHONPATH=. python benchmarks/payout_engine.py [transactions] [per_block]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import tempfile
+
+from pooledbismuth.journal import ShareJournal, JournalReader
+from pooledbismuth.ledger import Ledger
+from pooledbismuth.payout import PayoutEngine, FIRST_HEIGHT
+
+
+POOL = '%056x' % (random.getrandbits(224),)
+MINERS = ['%056x' % (random.getrandbits(224),) for _ in range(50)]
+WALLETS = ['%056x' % (random.getrandbits(224),) for _ in range(1000)]
+
+
+def random_hash():
+    return '%056x' % (random.getrandbits(224),)
+
+
+def add_blocks(ledgerdb, journal, first, count, per_block):
+    """
+    `count` blocks of `per_block` transactions each, with a coinbase row
+    and a few pool shares for every block
+    """
+    rows = list()
+    stamp = 1495404043.8 + first * 60
+    for height in range(first, first + count):
+        block_hash = random_hash()
+        journal.begin_block(block_hash)
+        for N in range(10):
+            journal.append(random.choice(MINERS + [None]), random.randint(37, 45), '%032x' % (random.getrandbits(128),))
+        miner = POOL if random.random() < 0.05 else random.choice(WALLETS)
+        rows.append((height, '%.2f' % (stamp,), miner, miner, '0', '10', '0', block_hash, '%032x' % (random.getrandbits(128),)))
+        for N in range(per_block - 1):
+            sender, recipient = random.choice(WALLETS + [POOL]), random.choice(WALLETS + [POOL])
+            rows.append((height, '%.2f' % (stamp,), sender, recipient, '%.8f' % (random.random(),),
+                         '0', '0.01', block_hash, ''))
+        stamp += 60
+    ledgerdb.executemany("""
+        INSERT INTO transactions (block_height, timestamp, address, recipient, amount, reward, fee, block_hash, openfield)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    ledgerdb.commit()
+
+
+def timed_run(path, batch_size=10000):
+    pooldb = sqlite3.connect(os.path.join(path, 'pool.db'))
+    pooldb.text_factory = str
+    ledger = Ledger(os.path.join(path, 'ledger.db'))
+    journal = JournalReader(os.path.join(path, 'journal'))
+    begin = time.time()
+    engine = PayoutEngine(pooldb, ledger, POOL, journal, batch_size)
+    total = engine.run()
+    elapsed = time.time() - begin
+    journal.close()
+    ledger.close()
+    pooldb.close()
+    return total, elapsed
+
+
+def main(args):
+    transactions = int(args[0]) if args else 1000000
+    per_block = int(args[1]) if len(args) > 1 else 10
+    blocks = transactions // per_block
+    path = tempfile.mkdtemp()
+    try:
+        ledgerdb = sqlite3.connect(os.path.join(path, 'ledger.db'))
+        ledgerdb.execute("""
+            CREATE TABLE transactions (
+                block_height INTEGER, timestamp TEXT, address TEXT, recipient TEXT, amount TEXT,
+                signature TEXT, public_key TEXT, block_hash TEXT, fee TEXT, reward TEXT,
+                keep TEXT, openfield TEXT)
+        """)
+        ledgerdb.execute("CREATE INDEX block_height_index ON transactions (block_height)")
+        journal = ShareJournal(os.path.join(path, 'journal'))
+        begin = time.time()
+        add_blocks(ledgerdb, journal, FIRST_HEIGHT + 1, blocks, per_block)
+        journal.close()
+        print("%d transactions in %d blocks, generated in %.1fs" % (transactions, blocks, time.time() - begin))
+
+        total, elapsed = timed_run(path)
+        print("full run        %8d rows %8.2fs" % (total, elapsed))
+
+        total, elapsed = timed_run(path)
+        print("nothing new     %8d rows %8.2fs" % (total, elapsed))
+
+        journal = ShareJournal(os.path.join(path, 'journal'))
+        add_blocks(ledgerdb, journal, FIRST_HEIGHT + 1 + blocks, 100, per_block)
+        journal.close()
+        total, elapsed = timed_run(path)
+        print("100 new blocks  %8d rows %8.2fs" % (total, elapsed))
+    finally:
+        shutil.rmtree(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Memory held for the blocks of many synched peers: each peer keeping its
+own parsed transaction lists, against the shared block store. Each runs
+in a forked process, so memory is measured from a clean start.
+
+    PYTHONPATH=. python benchmarks/peer_blocks.py [peers] [transactions per block]
+"""
+from __future__ import print_function
+import os
+import ast
+import sys
+import json
+import time
+import random
+import hashlib
+
+from Crypto.PublicKey import RSA
+
+from pooledbismuth.common import Identity, IpPort
+from pooledbismuth.pool import BismuthClient, PeerManager
+
+
+def rss():
+    with open('/proc/self/statm') as handle:
+        return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def random_text(size):
+    return ''.join(random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/')
+                   for _ in range(size))
+
+
+def make_chain(length, per_block, now):
+    """
+    Each block as a peer sends it, the repr of its transaction list
+    """
+    chain = list()
+    for height in range(length):
+        stamp = now - (length - height) * 60
+        txns = [('%.2f' % (stamp - N,), '%056x' % (random.getrandbits(224),), '%056x' % (random.getrandbits(224),),
+                 '%.8f' % (random.random(),), random_text(344), random_text(600), '0', '')
+                for N in range(per_block)]
+        chain.append(str([txns]))
+    return chain
+
+
+def legacy_add(client, block_list):
+    """
+    BismuthClient._cmd_blocksfnd before the block store
+    """
+    for transaction_list in block_list:
+        client.blockhash = hashlib.sha224(str(transaction_list) + client.blockhash).hexdigest()
+        client.blockheight += 1
+        stamp = max([float(X[0]) for X in transaction_list]) if len(transaction_list) else None
+        client.blocks.append((client.blockheight, client.blockhash, transaction_list, stamp))
+    if len(client.blocks) > 120:
+        client.blocks = client.blocks[-120:]
+
+
+def make_peer(manager, N, legacy):
+    client = BismuthClient.__new__(BismuthClient)
+    client.sockaddr = IpPort('10.0.%d.%d' % (N // 256, N % 256), 5658)
+    client.sock = None
+    client.manager = manager
+    client.blocks = list() if legacy else manager.store.ring()
+    client._window = None
+    client.connected_at = time.time()
+    client.blockheight = client.their_blockheight = 0
+    client.blockhash = client.their_blockhash = '0' * 56
+    return client
+
+
+def measure(manager, chain, npeers, legacy):
+    before = rss()
+    peers = [make_peer(manager, N, legacy) for N in range(npeers)]
+    begin = time.time()
+    for peer in peers:
+        for text in chain:
+            block_list = ast.literal_eval(text)
+            if legacy:
+                legacy_add(peer, block_list)
+            else:
+                peer._add_blocks(block_list)
+    elapsed = time.time() - begin
+    assert len(set(peer.blockhash for peer in peers)) == 1
+    return dict(memory=rss() - before, elapsed=elapsed, stored=len(manager.store))
+
+
+def forked(*args):
+    read, write = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read)
+        with os.fdopen(write, 'w') as handle:
+            handle.write(json.dumps(measure(*args)))
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as handle:
+        data = handle.read()
+    os.waitpid(pid, 0)
+    return json.loads(data)
+
+
+def main(args):
+    npeers = int(args[0]) if args else 200
+    per_block = int(args[1]) if len(args) > 1 else 5
+    manager = PeerManager(Identity(keydata=RSA.generate(1024).exportKey()))
+    chain = make_chain(120, per_block, time.time())
+    print("%d peers, 120 blocks of %d transactions" % (npeers, per_block))
+    for name, legacy in (('per peer', True), ('shared', False)):
+        result = forked(manager, chain, npeers, legacy)
+        print("%-10s %8.1f MB %9.1f KB/peer   %d blocks stored   parse+store %.2fs" % (
+            name, result['memory'] / 1e6, result['memory'] / 1e3 / npeers, result['stored'], result['elapsed']))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
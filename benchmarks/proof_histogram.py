@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Share histograms from the journal, with the Python loop against NumPy, for
+one busy block and for a backfill of many small blocks in a single call.
+
+    PYTHONPATH=. python benchmarks/proof_histogram.py [shares] [blocks]
+"""
+from __future__ import print_function
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+from pooledbismuth.journal import ShareJournal, JournalReader
+from pooledbismuth.payout import proof_histogram, proof_histograms, journal_columns
+
+
+POOL = '%056x' % (random.getrandbits(224),)
+ADDRESSES = ['%056x' % (random.getrandbits(224),) for _ in range(500)] + [None]
+
+
+def write_blocks(path, count, nblocks):
+    journal = ShareJournal(path)
+    hashes = ['%056x' % (random.getrandbits(224),) for _ in range(nblocks)]
+    for block_hash in hashes:
+        journal.begin_block(block_hash)
+        for N in range(count // nblocks):
+            journal.append(random.choice(ADDRESSES), random.randint(37, 60), '%032x' % (random.getrandbits(128),))
+    journal.close()
+    return hashes
+
+
+def python(reader, hashes):
+    return [proof_histogram(reader.block(block_hash), POOL) for block_hash in hashes]
+
+
+def vectorized(reader, hashes):
+    return proof_histograms([journal_columns(reader, block_hash) for block_hash in hashes],
+                            reader.addresses, POOL)
+
+
+def compare(name, count, nblocks):
+    path = tempfile.mkdtemp()
+    try:
+        hashes = write_blocks(path, count, nblocks)
+        reader = JournalReader(path)
+        elapsed = dict()
+        results = dict()
+        for func in (python, vectorized):
+            begin = time.time()
+            results[func] = func(reader, hashes)
+            elapsed[func] = time.time() - begin
+        reader.close()
+    finally:
+        shutil.rmtree(path)
+    assert results[python] == results[vectorized]
+    print("%-12s python %7.3fs  numpy %7.3fs  %5.1fx  (%d shares)" % (
+        name, elapsed[python], elapsed[vectorized], elapsed[python] / elapsed[vectorized], count))
+
+
+def main(args):
+    count = int(args[0]) if args else 300000
+    nblocks = int(args[1]) if len(args) > 1 else 1000
+    compare("one block", count, 1)
+    compare("%d blocks" % (nblocks,), count, nblocks)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Syscalls and latency per miner_exch round-trip, for the previous unbuffered
+framing and the buffered ProtocolBase, over a loopback TCP connection.
+
+    PYTHONPATH=. python benchmarks/protocol_frames.py [round_trips]
+"""
+from __future__ import print_function
+import sys
+import time
+import socket
+import threading
+
+from pooledbismuth.common import ProtocolBase
+
+
+class CountingSocket(object):
+    """Counts every send/recv call made on the wrapped socket"""
+    def __init__(self, sock):
+        self._sock = sock
+        self.syscalls = 0
+
+    def getpeername(self):
+        return self._sock.getpeername()
+
+    def sendall(self, data):
+        self.syscalls += 1
+        return self._sock.sendall(data)
+
+    def recv(self, size):
+        self.syscalls += 1
+        return self._sock.recv(size)
+
+
+class UnbufferedProtocol(ProtocolBase):
+    """The framing as it was before buffering"""
+    def _send(self, *args):
+        for data in args:
+            data = str(data)
+            self.sock.sendall((str(len(data))).zfill(10))
+            self.sock.sendall(data)
+
+    def _recv(self, datalen=10):
+        data = self.sock.recv(datalen)
+        if not data:
+            raise socket.error("Socket connection broken")
+        data = int(data)
+        chunks = []
+        bytes_recd = 0
+        while bytes_recd < data:
+            chunk = self.sock.recv(min(data - bytes_recd, 2048))
+            if chunk == b'':
+                raise socket.error("Socket connection broken")
+            chunks.append(chunk)
+            bytes_recd = bytes_recd + len(chunk)
+        return b''.join(chunks)
+
+
+def connected_pair():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    for sock in (client, server):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return client, server
+
+
+def pool_side(proto, round_trips):
+    for _ in range(round_trips):
+        proto._recv()
+        proto._recv(), proto._recv(), proto._recv()
+        proto._send(40, 'a' * 56, 'b' * 56)
+
+
+def run(protocol_class, round_trips):
+    client_sock, server_sock = connected_pair()
+    client = protocol_class(CountingSocket(client_sock), None)
+    server = protocol_class(CountingSocket(server_sock), None)
+    thread = threading.Thread(target=pool_side, args=(server, round_trips))
+    thread.start()
+    begin = time.time()
+    for _ in range(round_trips):
+        client._send('miner_exch', 40, 'b' * 56, 'c' * 32)
+        client._recv(), client._recv(), client._recv()
+    duration = time.time() - begin
+    thread.join()
+    client_sock.close()
+    server_sock.close()
+    syscalls = client.sock.syscalls + server.sock.syscalls
+    return syscalls / float(round_trips), (duration / round_trips) * 1000000
+
+
+def main(args):
+    round_trips = int(args[0]) if args else 20000
+    print("protocol\tsyscalls/msg\tusec/msg")
+    for protocol_class in (UnbufferedProtocol, ProtocolBase):
+        syscalls, latency = run(protocol_class, round_trips)
+        print("%s\t%.1f\t%.1f" % (protocol_class.__name__, syscalls, latency))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
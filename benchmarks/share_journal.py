@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Logging accepted shares: one JSON line per share into a file per block,
+moved into data/done/ when the block changes, against the binary journal.
+Then reading one block back, best of 5, with the journal reader opened
+once as the payout engine does.
+
+    PYTHONPATH=. python benchmarks/share_journal.py [shares] [blocks]
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+
+from pooledbismuth.journal import ShareJournal, JournalReader
+
+
+def make_shares(count, blocks):
+    addresses = ['%056x' % (random.getrandbits(224),) for _ in range(200)]
+    hashes = ['%056x' % (random.getrandbits(224),) for _ in range(blocks)]
+    per_block = count // blocks
+    return [(block_hash, [(random.choice(addresses), random.randint(37, 60), '%032x' % (random.getrandbits(128),))
+                          for _ in range(per_block)])
+            for block_hash in hashes]
+
+
+def legacy(path, blocks):
+    os.makedirs(os.path.join(path, 'audit'))
+    os.makedirs(os.path.join(path, 'done'))
+    for block_hash, shares in blocks:
+        filename = os.path.join(path, 'audit', '%s.block' % (block_hash,))
+        handle = open(filename, 'a')
+        for address, diff, nonce in shares:
+            handle.write(json.dumps([time.time(), address, diff, nonce]) + "\n")
+        handle.close()
+        os.rename(filename, os.path.join(path, 'done', '%s.block' % (block_hash,)))
+
+
+def legacy_open(path):
+    return path
+
+
+def legacy_read(path, block_hash):
+    with open(os.path.join(path, 'done', '%s.block' % (block_hash,))) as handle:
+        return [json.loads(line) for line in handle]
+
+
+def journal(path, blocks):
+    journal = ShareJournal(path)
+    for block_hash, shares in blocks:
+        journal.begin_block(block_hash)
+        for address, diff, nonce in shares:
+            journal.append(address, diff, nonce)
+    journal.close()
+
+
+def journal_read(reader, block_hash):
+    return reader.block(block_hash)
+
+
+def count_files(path):
+    return sum([len(files) for _, _, files in os.walk(path)])
+
+
+def main(args):
+    count = int(args[0]) if args else 200000
+    nblocks = int(args[1]) if len(args) > 1 else 100
+    blocks = make_shares(count, nblocks)
+    middle = blocks[nblocks // 2][0]
+    print("%d shares over %d blocks" % (count, nblocks))
+    for name, write, opener, read in (('legacy', legacy, legacy_open, legacy_read),
+                                      ('journal', journal, JournalReader, journal_read)):
+        path = tempfile.mkdtemp()
+        source = None
+        try:
+            begin = time.time()
+            write(os.path.join(path, 'data'), blocks)
+            elapsed = time.time() - begin
+            source = opener(os.path.join(path, 'data'))
+            read_time = None
+            for _ in range(5):
+                begin = time.time()
+                proofs = read(source, middle)
+                read_time = min(time.time() - begin, read_time or float('inf'))
+            print("%-8s %9.0f shares/sec %5d files, read block %6.2f ms (%d shares)" % (
+                name, count / elapsed, count_files(path), read_time * 1000, len(proofs)))
+        finally:
+            if isinstance(source, JournalReader):
+                source.close()
+            shutil.rmtree(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
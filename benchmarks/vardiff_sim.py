@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Replays synthetic miners of different hashrates against the vardiff
+controllers. Reports how long each takes to get within one bit of the ideal
+diff, how much of the second half it stays there, and the share rate over
+the second half (1.0 = one share per goal) with its standard deviation.
+
+Shares arrive as a Poisson process, a share at diff D taking
+`expected_work(D) / hashrate` seconds on average. Miners also fetch every `poll` seconds, as QuickBismuth
+does between batches, which is when quiet miners get retargeted. The pool's
+cap at the highest share + 1 is left out, it applies to both equally.
+
+    PYTHONPATH=. python benchmarks/vardiff_sim.py [duration] [network_diff]
+"""
+from __future__ import print_function
+import sys
+import math
+import random
+
+from pooledbismuth.hashrate import expected_work, work_difficulty
+from pooledbismuth.vardiff import VARDIFF
+
+
+def simulate(controller, rate, duration, network_diff, poll=5.0):
+    shares = list()
+    changes = [(0.0, controller.retarget(network_diff, 0.0))]
+    now = 0.0
+    next_poll = poll
+    while now < duration:
+        found = now + random.expovariate(rate / expected_work(int(controller.diff)))
+        if found < next_poll:
+            now = found
+            shares.append(now)
+            controller.on_share(controller.diff, now)
+        else:
+            now = next_poll
+            next_poll += poll
+        diff = controller.retarget(network_diff, now)
+        if diff != changes[-1][1]:
+            changes.append((now, diff))
+    return shares, changes
+
+
+def converged(changes, ideal):
+    """First time the diff got within 1 bit of ideal, or None"""
+    for stamp, diff in changes:
+        if abs(int(diff) - ideal) <= 1:
+            return stamp
+
+
+def settled(changes, ideal, begin, end):
+    """Fraction of the time between begin and end spent within 1 bit of ideal"""
+    within = 0.0
+    for N, (stamp, diff) in enumerate(changes):
+        until = changes[N + 1][0] if N + 1 < len(changes) else end
+        span = min(until, end) - max(stamp, begin)
+        if span > 0 and abs(int(diff) - ideal) <= 1:
+            within += span
+    return within / (end - begin)
+
+
+def share_rate(shares, begin, end, goal, window):
+    """Mean and standard deviation of shares per goal, over each window"""
+    counts = [0] * int((end - begin) // window)
+    for stamp in shares:
+        slot = int((stamp - begin) // window)
+        if 0 <= slot < len(counts):
+            counts[slot] += 1
+    rates = [count * float(goal) / window for count in counts]
+    mean = sum(rates) / len(rates)
+    var = sum([(X - mean) ** 2 for X in rates]) / len(rates)
+    return mean, math.sqrt(var)
+
+
+def main(args):
+    duration = float(args[0]) if args else 3600.0
+    network_diff = float(args[1]) if len(args) > 1 else 40.0
+    random.seed(1)
+    print("duration %ds, network diff %d, rate in shares per goal" % (duration, network_diff))
+    print("%-8s %6s %6s %10s %8s %8s %8s %8s" % ('engine', 'rate', 'ideal', 'converge', 'settled',
+                                                 'diff', 'shares', 'stddev'))
+    for rate in (1e3, 1e4, 1e5, 1e6, 1e7, 1e8):
+        for name in ('legacy', 'ewma'):
+            controller = VARDIFF[name]()
+            ideal = work_difficulty(rate * controller.goal)
+            shares, changes = simulate(controller, rate, duration, network_diff)
+            when = converged(changes, ideal)
+            within = settled(changes, ideal, duration / 2, duration)
+            mean, stddev = share_rate(shares, duration / 2, duration, controller.goal, controller.goal * 10)
+            print("%-8s %6.0e %6.1f %10s %7.0f%% %8.1f %8.2f %8.2f" % (
+                name, rate, ideal, 'never' if when is None else '%.0fs' % (when,),
+                within * 100, changes[-1][1], mean, stddev))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Shares/sec verified by BatchVerifier, for an increasing number of worker
+processes, with many concurrent miner greenlets submitting shares.
+
+    PYTHONPATH=. python benchmarks/verify_throughput.py [max_workers]
+"""
+from __future__ import print_function
+from gevent import monkey
+monkey.patch_all()
+
+import sys
+import time
+import random
+import multiprocessing
+
+import gevent
+
+from pooledbismuth import bismuth
+from pooledbismuth.common import MinerResult
+from pooledbismuth.verifier import BatchVerifier
+
+
+MINERS = 500
+SHARES_PER_MINER = 200
+
+
+def random_hex(nbytes):
+    return '%0*x' % (nbytes * 2, random.getrandbits(nbytes * 8))
+
+
+def make_shares(block_hash):
+    address = random_hex(28)
+    return [MinerResult(random.randint(8, 40), address, block_hash, random_hex(16))
+            for _ in range(SHARES_PER_MINER)]
+
+
+def run(verify, shares_list):
+    def miner(shares):
+        for result in shares:
+            verify(result)
+    begin = time.time()
+    gevent.joinall([gevent.spawn(miner, shares) for shares in shares_list])
+    return (MINERS * SHARES_PER_MINER) / (time.time() - begin)
+
+
+def main(args):
+    max_workers = int(args[0]) if args else multiprocessing.cpu_count()
+    block_hash = random_hex(28)
+    shares_list = [make_shares(block_hash) for _ in range(MINERS)]
+
+    def inline(result):
+        # Yield like a miner greenlet would between socket reads
+        gevent.sleep(0)
+        return bismuth.verify(result.address, result.nonce, result.block, result.diff)
+
+    print("workers\tshares/sec")
+    print("inline\t%.0f" % (run(inline, shares_list),))
+    workers = 1
+    while workers <= max_workers:
+        verifier = BatchVerifier(workers)
+        try:
+            print("%d\t%.0f" % (workers, run(verifier.verify, shares_list)))
+        finally:
+            verifier.stop()
+        workers *= 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -18,9 +18,31 @@ def parse_args():
                         const=LOG.DEBUG, default=LOG.WARNING,
                         help="Log debugging messages")
     parser.add_argument('--keyfile', default='.bismuth.key', help="Load/save file for miner secret identity", metavar='PATH')
-    parser.add_argument('--max-miners', help="Maximum number of miner connections", default=1000, metavar='M')
+    parser.add_argument('--max-miners', help="Maximum number of miner connections", default=1000, type=int, metavar='M')
+    parser.add_argument('--verify-workers', dest='verify_workers', type=int, default=0, metavar='N',
+                        help="Verify shares in N worker processes (0 = inline)")
+    parser.add_argument('--miner-workers', dest='miner_workers', type=int, default=0, metavar='N',
+                        help="Serve miners from N processes sharing the port with SO_REUSEPORT (0 = this process)")
+    parser.add_argument('--miners-backend', dest='miners_backend', choices=('gevent', 'event'), default='gevent',
+                        help="Miner front-end: greenlet per connection, or hub read callbacks")
+    parser.add_argument('--vardiff', choices=('ewma', 'legacy'), default='ewma',
+                        help="Miner difficulty controller")
+    parser.add_argument('--journal-batch', dest='journal_batch', type=int, default=512, metavar='N',
+                        help="Write accepted shares to the journal in groups of up to N")
+    parser.add_argument('--journal-interval', dest='journal_interval', type=float, default=0.5, metavar='SECS',
+                        help="Longest time a share waits before the journal is written")
+    parser.add_argument('--journal-queue', dest='journal_queue', type=int, default=100000, metavar='N',
+                        help="Shares queued for the journal writer before miners have to wait")
     parser.add_argument('-p', '--peers', help="Load/save file for found peers", default='peers.txt', metavar='PATH')
+    parser.add_argument('--peer-scores', dest='peer_scores', default='data/peer-scores.json', metavar='PATH',
+                        help="Load/save file for peer scores, kept across restarts")
+    parser.add_argument('--peer-target', dest='peer_target', type=int, default=10, metavar='N',
+                        help="Connections kept open to the best scoring peers")
     parser.add_argument('-l', '--ledger', help="Bismuth ledger database path", default='../Bismuth/static/ledger.db', metavar='PATH')
+    parser.add_argument('--ledger-index', dest='ledger_index', default='data/ledger-index.db', metavar='PATH',
+                        help="Side index for ledgers without one on block height")
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help="Write network.json, with difficulty and hashrate, to this directory on each new consensus")
     parser.add_argument('-m', '--miners-listen', dest='miners_listen', metavar="LISTEN",
                         default='0.0.0.0:' + str(POOL_PORT), help="Listener port for miners")
     cfg = parser.parse_args()
@@ -8,8 +8,13 @@ from random import shuffle
 
 import gevent
 
-from .common import Identity, IpPort, Abuse, load_consensus
-from .pool import PeerManager, Miners, ResultsManager
+from .common import Identity, Abuse, load_consensus
+from .pool import PeerManager, Miners, EventMiners, ResultsManager
+from .peerbook import PeerBook
+from .verifier import BatchVerifier
+from .workers import MinerWorkers
+from .vardiff import VARDIFF
+from .snapshot import write_network
 
 
 def read_peers(peers_file):
@@ -26,25 +31,48 @@ class PooledBismuth(object):
     def __init__(self, cfg):
         self.cfg = cfg
         self._stop = False
-        self._bootstrap_peers = read_peers(cfg.peers)
-        self._bootstrap_thread = None
+        self._peers_thread = None
         self.identity = Identity(cfg.keyfile)
-        self.peers = PeerManager(self.identity)
-        self.miners = Miners(self.peers, cfg.miners_listen, cfg.max_miners) if cfg.miners_listen else None
-        for consensus in load_consensus(cfg.ledger):
+        book = PeerBook(cfg.peer_scores, cfg.peer_target)
+        book.discover(read_peers(cfg.peers))
+        self.peers = PeerManager(self.identity, book)
+        self.verifier = None
+        self.miners = None
+        if cfg.miners_listen and cfg.miner_workers:
+            # Worker processes are forked now, before any greenlets run
+            self.miners = MinerWorkers(self.peers, cfg.miners_listen, cfg.miner_workers,
+                                       cfg.max_miners, cfg.miners_backend, vardiff=VARDIFF[cfg.vardiff])
+        elif cfg.miners_listen:
+            self.verifier = BatchVerifier(cfg.verify_workers) if cfg.verify_workers else None
+            miners_class = EventMiners if cfg.miners_backend == 'event' else Miners
+            self.miners = miners_class(self.peers, cfg.miners_listen, cfg.max_miners, self.verifier,
+                                       vardiff=VARDIFF[cfg.vardiff])
+        # After forking any miner workers, the journal writer is a thread
+        ResultsManager.open_journal(batch_size=cfg.journal_batch, flush_interval=cfg.journal_interval,
+                                    max_queue=cfg.journal_queue)
+        for consensus in load_consensus(cfg.ledger, cfg.ledger_index):
             ResultsManager.on_consensus(consensus)
 
-    def _add_bootstrap_peers(self):
+    def _maintain_peers(self):
         """
-        Gradually reintroduce a random set of 10 peers every 4 seconds
+        Keep connected to the best scoring peers, checking every 4 seconds
         """
-        bootstrap_peers = self._bootstrap_peers
         while not self._stop:
-            shuffle(bootstrap_peers)
-            for sockaddr in bootstrap_peers[:10]:
-                self.peers.add(IpPort(*sockaddr))
-                time.sleep(0.2)
-            time.sleep(2.0)
+            self.peers.maintain()
+            time.sleep(4.0)
+
+    def _on_consensus(self, consensus):
+        gevent.spawn(self._snapshot_network, consensus)
+
+    def _snapshot_network(self, block):
+        """
+        Write the network snapshot for a new consensus block
+        """
+        try:
+            write_network(self.cfg.snapshot, block, self.peers.difficulty(),
+                          self.miners.status() if self.miners else None)
+        except Exception:
+            LOG.exception('Snapshot %r - failed to write network stats', self.cfg.snapshot)
 
     def _tick_function(self):
         while True:
@@ -52,15 +80,23 @@ class PooledBismuth(object):
             time.sleep(1)
 
     def start(self):
-        if not self._bootstrap_thread:
-            self._bootstrap_thread = gevent.spawn(self._add_bootstrap_peers)
+        if not self._peers_thread:
+            self._peers_thread = gevent.spawn(self._maintain_peers)
+        if self.cfg.snapshot and self._on_consensus not in ResultsManager.LISTENERS:
+            ResultsManager.listen(self._on_consensus)
+            # The consensus loaded from the ledger came before listening
+            if ResultsManager.BLOCK is not None:
+                self._on_consensus(ResultsManager.BLOCK)
 
     def stop(self):
         self._stop = True
-        if self._bootstrap_thread:
-            self._bootstrap_thread.join()
-        self.miners.stop()
+        if self._peers_thread:
+            self._peers_thread.join()
+        ResultsManager.unlisten(self._on_consensus)
+        if self.miners:
+            self.miners.stop()
         self.peers.stop()
+        ResultsManager.close_journal()
 
 
 def monitor(app):
@@ -81,7 +117,13 @@ def monitor(app):
         if len(peers.peers):
             print("\nClients")
             for peer, client in peers.peers.items():
-                print(" %r %r" % (peer, client.status()))
+                print(" %r %r (score %.1f)" % (peer, client.status(), peers.book.get(peer).score()))
+        if ResultsManager.JOURNAL:
+            print("\nJournal:", ResultsManager.JOURNAL.status())
+        if app.miners:
+            print("\nMiners:", app.miners.status())
+            for address, rate in app.miners.hashrate.top(10):
+                print(" %s %.0f H/s" % (address, rate))
         difficulty = peers.difficulty()
         if difficulty:
             print("\nDifficulty:", difficulty)
@@ -9,15 +9,100 @@ except ImportError:
     quickbismuth = None
 
 
+# Bits for every character, as `format(ord(x), 'b')` would produce them.
+# Leading zeros are stripped per character, so the width varies (6 bits for
+# '0'-'9', 7 bits for 'a'-'f')
+_CHAR_BITS = dict((chr(N), format(N, 'b')) for N in range(256))
+
+# Bits for both lower-case hex characters of every raw digest byte
+_BYTE_BITS = [_CHAR_BITS[pair[0]] + _CHAR_BITS[pair[1]]
+              for pair in ('%02x' % (N,) for N in range(256))]
+
+
 def _bin_convert(string):
-    return ''.join(format(ord(x), 'b') for x in string)
+    return ''.join([_CHAR_BITS.get(x) or format(ord(x), 'b') for x in string])
+
+
+class SearchTable(object):
+    """
+    Precomputed needle bits for one block hash, plus the needle prefix for
+    every diff length shares have been submitted at
+    """
+    __slots__ = ('block_hash', 'needle', '_prefixes')
+
+    def __init__(self, block_hash):
+        self.block_hash = block_hash
+        self.needle = _bin_convert(block_hash)
+        self._prefixes = dict()
+
+    def prefix(self, diff_len):
+        prefix = self._prefixes.get(diff_len)
+        if prefix is None:
+            if not 0 <= diff_len <= len(self.needle):
+                return self.needle[0:diff_len]
+            prefix = self._prefixes[diff_len] = self.needle[0:diff_len]
+        return prefix
+
+
+class NeedleCache(object):
+    """
+    Search tables keyed by block hash. Thousands of shares arrive for each
+    consensus block, so the table is only built once per block.
+    """
+    def __init__(self, size=64):
+        self.size = size
+        self.tables = dict()
+
+    def get(self, block_hash):
+        table = self.tables.get(block_hash)
+        if table is None:
+            # Training jobs use random hashes, don't let them pile up
+            if len(self.tables) >= self.size:
+                self.tables.clear()
+            table = self.tables[block_hash] = SearchTable(block_hash)
+        return table
+
+    def reset(self, block_hash=None):
+        """
+        Drop all tables, except the one for `block_hash`, called when the
+        consensus block changes
+        """
+        table = self.tables.get(block_hash)
+        self.tables = dict()
+        if block_hash is not None:
+            self.tables[block_hash] = table or SearchTable(block_hash)
+
+
+NEEDLES = NeedleCache()
+
+
+def _haystack(address, nonce, db_block_hash):
+    """
+    Equivalent of `_bin_convert(sha224(...).hexdigest())`, packed directly
+    from the raw digest bytes with one table lookup per byte
+    """
+    digest = hashlib.sha224(address + nonce + db_block_hash).digest()
+    return ''.join([_BYTE_BITS[N] for N in bytearray(digest)])
 
 
 def difficulty(address, nonce, db_block_hash):
-    needle = _bin_convert(db_block_hash)
-    input = address + nonce + db_block_hash
-    haystack = _bin_convert(hashlib.sha224(input).hexdigest())
-    return max([N for N in range(1, len(needle) - 1) if needle[:N] in haystack])
+    if quickbismuth:
+        return quickbismuth.bismuth_difficulty(address, nonce, db_block_hash)
+
+    needle = NEEDLES.get(db_block_hash).needle
+    haystack = _haystack(address, nonce, db_block_hash)
+    # Every prefix of a matching prefix also matches, so binary search
+    # for the longest one in range(1, len(needle) - 1)
+    lowest, highest = 1, len(needle) - 2
+    if highest < lowest or needle[:lowest] not in haystack:
+        raise ValueError('No prefix of %r found in hash' % (db_block_hash,))
+    while lowest < highest:
+        middle = (lowest + highest + 1) // 2
+        if needle[:middle] in haystack:
+            lowest = middle
+        else:
+            highest = middle - 1
+    return lowest
 
 
 def verify(address, nonce, db_block_hash, diff_len):
@@ -25,9 +110,16 @@ def verify(address, nonce, db_block_hash, diff_len):
         return quickbismuth.bismuth_verify(address, nonce, db_block_hash, diff_len)
 
     diff_len = int(diff_len)
-    mining_search_bin = _bin_convert(db_block_hash)[0:diff_len]
-    mining_input = address + nonce + db_block_hash
-    mining_hash = hashlib.sha224(mining_input).hexdigest()
-    mining_bin = _bin_convert(mining_hash)
+    mining_search_bin = NEEDLES.get(db_block_hash).prefix(diff_len)
+    mining_bin = _haystack(address, nonce, db_block_hash)
     if mining_search_bin in mining_bin:
         return True
+
+
+def verify_batch(results):
+    """
+    Verify a list of `(diff, address, block, nonce)` results, e.g. `MinerResult`,
+    returning a list of booleans in the same order
+    """
+    return [bool(verify(address, nonce, block, diff))
+            for diff, address, block, nonce in results]
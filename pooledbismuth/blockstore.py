@@ -0,0 +1,154 @@
+from __future__ import print_function
+import time
+import weakref
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+
+from .common import ConsensusBlock, decay_diff
+
+
+# Blocks each peer keeps, enough for 30 minutes of difficulty history
+PEER_BLOCKS = 120
+
+
+class Block(object):
+    """
+    What is kept of a block once its transactions are checked: height,
+    hash, and the timestamps of its first and newest transactions, parsed
+    once. `consensus` is the `ConsensusBlock` peers holding it vote for,
+    `seen` when the first peer told us of it.
+    """
+    __slots__ = ('height', 'hash', 'first', 'stamp', 'consensus', 'seen', '__weakref__')
+
+    def __init__(self, height, block_hash, stamp, first=None):
+        self.height = height
+        self.hash = block_hash
+        self.stamp = stamp
+        self.first = stamp if first is None else first
+        self.consensus = ConsensusBlock(int(height), block_hash, stamp)
+        self.seen = time.time()
+
+    def __repr__(self):
+        return "Block(%r, %r, %r)" % (self.height, self.hash, self.stamp)
+
+
+class BlockStore(object):
+    """
+    One `Block` for each hash, shared by every peer which has it. A block
+    is forgotten once no peer holds it any more.
+    """
+    def __init__(self):
+        self.blocks = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def intern(self, height, block_hash, stamp, first=None):
+        block = self.blocks.get(block_hash)
+        if block is None:
+            block = self.blocks[block_hash] = Block(height, block_hash, stamp, first)
+        return block
+
+    def add(self, height, block_hash, transactions):
+        """
+        Block for a transaction list straight from a peer, which needn't
+        be kept once this returns
+        """
+        block = self.blocks.get(block_hash)
+        if block is not None:
+            return block
+        stamps = [float(txn[0]) for txn in transactions]
+        if not stamps:
+            return self.intern(height, block_hash, None)
+        return self.intern(height, block_hash, max(stamps), stamps[0])
+
+    def ring(self, blocks=()):
+        """
+        Ring buffer of the last `PEER_BLOCKS` blocks for a peer
+        """
+        return deque(blocks, PEER_BLOCKS)
+
+
+def block_mark(block):
+    """
+    64 bits of the block hash, XORed together to tell runs of blocks apart
+    """
+    return int(block.hash[:16], 16)
+
+
+class DifficultyWindow(object):
+    """
+    Everything `calc_diff` looks at for one peer's blocks: their first
+    transaction timestamps, sorted, and the newest timestamp of the tip.
+
+    The 30 minute block count is cached until a block ages out of it,
+    the drop over time is worked out from it on each reading.
+    """
+    __slots__ = ('key', 'stamps', 'latest', '_count', '_since', '_until', '__weakref__')
+
+    def __init__(self, key, stamps, latest):
+        self.key = key
+        self.stamps = stamps
+        self.latest = latest
+        self._count = None
+        self._since = self._until = None
+
+    def count(self, now):
+        """
+        Blocks in the 30 minutes before `now`
+        """
+        half_hour_ago = now - (60*30)
+        if self._count is None or not (self._since <= half_hour_ago < self._until):
+            N = bisect_right(self.stamps, half_hour_ago)
+            self._count = len(self.stamps) - N
+            # The same count until the next stamp ages out
+            self._since = self.stamps[N - 1] if N else float('-inf')
+            self._until = self.stamps[N] if N < len(self.stamps) else float('inf')
+        return self._count
+
+    def difficulty(self, now):
+        return decay_diff(self.count(now), now, self.latest)
+
+
+class DifficultyTracker(object):
+    """
+    One `DifficultyWindow` for each distinct run of blocks, shared by the
+    peers holding them. Runs are told apart by their tip, their length
+    and the XOR of their `block_mark`s, which `advance` updates as blocks
+    come and go.
+    """
+    def __init__(self):
+        self.windows = weakref.WeakValueDictionary()
+
+    def window(self, blocks):
+        mark = 0
+        for block in blocks:
+            mark ^= block_mark(block)
+        key = (blocks[-1].hash, len(blocks), mark)
+        window = self.windows.get(key)
+        if window is None:
+            stamps = sorted([block.first for block in blocks if block.first is not None])
+            window = self.windows[key] = DifficultyWindow(key, stamps, blocks[-1].stamp)
+        return window
+
+    def advance(self, window, block, evicted=None):
+        """
+        `window` once `block` is appended and `evicted` drops off the
+        other end
+        """
+        _, size, mark = window.key
+        mark ^= block_mark(block)
+        if evicted is not None:
+            mark ^= block_mark(evicted)
+        else:
+            size += 1
+        key = (block.hash, size, mark)
+        found = self.windows.get(key)
+        if found is None:
+            stamps = list(window.stamps)
+            if evicted is not None and evicted.first is not None:
+                del stamps[bisect_left(stamps, evicted.first)]
+            if block.first is not None:
+                insort(stamps, block.first)
+            found = self.windows[key] = DifficultyWindow(key, stamps, block.stamp)
+        return found
@@ -1,18 +1,27 @@
 from __future__ import print_function
 
 import os
+import json
 import time
 import socket
+import struct
 import base64
 import hashlib
+import tempfile
 import logging as LOG
-import sqlite3
 from collections import namedtuple, defaultdict
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 from Crypto import Random
 from Crypto.Signature import PKCS1_v1_5
 from Crypto.PublicKey import RSA
 
+from .ledger import open_ledger
+
 
 PROTO_VERSION = "mainnnet0009"
 MINER_VERSION_ROOT = "morty"
@@ -24,6 +33,9 @@ POOL_PORT = 5657
 STRIKE_TIME = 60
 STRIKE_COUNT = 3
 CONNECT_TIMEOUT = 5
+RECV_BUFSIZE = 16384
+# Longest frame taken from a connection, larger lengths are a broken stream
+MAX_FRAME = 1024 * 1024
 
 MINER_TUNE_GOAL = 10
 MINER_TUNE_HISTORY = 10
@@ -37,22 +49,11 @@ ConsensusBlock = namedtuple('ConsensusBlock', ('height', 'hash', 'stamp'))
 IpPort = namedtuple('IpPort', ('ip', 'port'))
 
 
-def load_consensus(ledger_path):
-    ledgerdb = sqlite3.connect(ledger_path)  # open to select the last tx to create a new hash from
-    ledgerdb.text_factory = str
-    ledgercon = ledgerdb.cursor()
-    ledgercon.execute("""
-        SELECT * FROM transactions
-        WHERE reward > 0
-        ORDER BY block_height DESC
-        LIMIT 120
-    """)  # , (myid.public_key_hashed,))
-    results_list = ledgercon.fetchall()
-
-    return reversed([
-        ConsensusBlock(int(result[0]), result[7], float(result[1]))
-        for result in results_list
-    ])
+def load_consensus(ledger_path, index_path=None):
+    return [
+        ConsensusBlock(int(row.block_height), row.block_hash, float(row.timestamp))
+        for row in open_ledger(ledger_path, index_path).last_rewards(120)
+    ]
 
 
 class Abuse(object):
@@ -136,49 +137,175 @@ class Identity(object):
         return base64.b64encode(self.signer.sign(data))
 
 
+def encode_frames(*args):
+    """
+    Each field as a 10 digit ASCII length followed by the data
+    """
+    frames = list()
+    for data in args:
+        data = str(data)
+        frames.append(str(len(data)).zfill(10))
+        frames.append(data)
+    return ''.join(frames)
+
+
+class JobTemplate(object):
+    """
+    Pre-encoded `miner_fetch` replies for one consensus block, one for each
+    integer difficulty miners are working at
+    """
+    __slots__ = ('address', 'block_hash', '_frames')
+
+    def __init__(self, address, block_hash):
+        self.address = address
+        self.block_hash = block_hash
+        self._frames = dict()
+
+    def frames(self, diff):
+        data = self._frames.get(diff)
+        if data is None:
+            data = self._frames[diff] = encode_frames(diff, self.address, self.block_hash)
+        return data
+
+
+def frame_size(prefix, limit=MAX_FRAME):
+    """
+    Length from the 10 digit prefix of a frame, raises ValueError unless
+    it is all digits and at most `limit`
+    """
+    if not prefix.isdigit():
+        raise ValueError('Invalid frame length %r' % (prefix,))
+    size = int(prefix)
+    if size > limit:
+        raise ValueError('Frame of %d bytes, over %d' % (size, limit))
+    return size
+
+
 class ProtocolBase(object):
+    """
+    Length-prefixed framing: each field is a 10 digit ASCII length followed
+    by the data. Received data is buffered per connection, so several
+    frames arriving together cost one `recv`.
+    """
+    MAX_FRAME = MAX_FRAME
+
     def __init__(self, sock, manager):
         self.sockaddr = IpPort(*sock.getpeername())
         self.sock = sock
         self.manager = manager
+        self._rbuf = bytearray()
+        self._rpos = 0
 
     def _send(self, *args):
-        for data in args:
-            data = str(data)
-            self.sock.sendall((str(len(data))).zfill(10))
-            self.sock.sendall(data)
-            LOG.debug('%r - sent: %r', self, data)
+        # Coalesce all fields into a single write
+        LOG.debug('%r - sent: %r', self, args)
+        self.sock.sendall(encode_frames(*args))
+
+    def _send_frames(self, data):
+        """Send fields already encoded with `encode_frames`"""
+        self.sock.sendall(data)
+
+    def _pending(self):
+        """Is there received data waiting in the buffer?"""
+        return len(self._rbuf) > self._rpos
+
+    def _read(self, size):
+        buf = self._rbuf
+        while len(buf) - self._rpos < size:
+            if self._rpos:
+                del buf[:self._rpos]
+                self._rpos = 0
+            chunk = self.sock.recv(RECV_BUFSIZE)
+            if not chunk:
+                raise socket.error("Socket connection broken")
+            buf += chunk
+        start = self._rpos
+        self._rpos = start + size
+        return bytes(buf[start:self._rpos])
 
     def _recv(self, datalen=10):
-        data = self.sock.recv(datalen)
-        if not data:
-            raise socket.error("Socket connection broken")
-        data = int(data)
-
-        chunks = []
-        bytes_recd = 0
-        while bytes_recd < data:
-            chunk = self.sock.recv(min(data - bytes_recd, 2048))
-            if chunk == b'':
-                raise socket.error("Socket connection broken")
-            chunks.append(chunk)
-            bytes_recd = bytes_recd + len(chunk)
-        segments = b''.join(chunks)
+        segments = self._read(frame_size(self._read(datalen), self.MAX_FRAME))
         LOG.debug('%r - received: %r', self, segments)
         return segments
 
 
-def calc_diff(block_history, time_now, db_timestamp_last):
+def _recv_exact(sock, size):
+    chunks = list()
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError()
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_message(sock, obj):
+    """
+    Send a pickled object to one of our own processes, prefixed by its length
+    """
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    sock.sendall(struct.pack('!I', len(data)) + data)
+
+
+def recv_message(sock):
+    """
+    Receive an object sent with `send_message`, raises EOFError when closed
+    """
+    size = struct.unpack('!I', _recv_exact(sock, 4))[0]
+    return pickle.loads(_recv_exact(sock, size))
+
+
+def write_json(path, obj):
+    """
+    Replace `path` with `obj` as JSON in a single rename, so readers never
+    see a partly written file. Returns False, without writing, if the file
+    already holds the same JSON.
+    """
+    data = json.dumps(obj, sort_keys=True, separators=(',', ':'))
+    try:
+        with open(path) as handle:
+            if handle.read() == data:
+                return False
+    except IOError:
+        pass
+    directory = os.path.dirname(path) or '.'
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    handle, temp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(handle, 'w') as out:
+            out.write(data)
+        # mkstemp only lets the owner read
+        os.chmod(temp, 0o644)
+        os.rename(temp, path)
+    except Exception:
+        os.unlink(temp)
+        raise
+    return True
+
+
+def stamp_hour(stamp):
+    return int(float(stamp)) // 3600 * 3600
+
+
+def calc_diff(block_stamps, time_now, db_timestamp_last):
+    """
+    Network difficulty from the first transaction timestamp of recent blocks
+    """
     half_hour_ago = time_now - (60*30)
     blocks_per_30 = 0
-    for row in block_history:
-        if row[2] is not None:
-            stamp = float(row[2][0][0])
-        else:
-            stamp = row[3]
-        if stamp > half_hour_ago:
+    for stamp in block_stamps:
+        if stamp is not None and stamp > half_hour_ago:
             blocks_per_30 += 1
+    return decay_diff(blocks_per_30, time_now, db_timestamp_last)
+
 
+def decay_diff(blocks_per_30, time_now, db_timestamp_last):
+    """
+    Network difficulty for `blocks_per_30` blocks in the last 30 minutes,
+    dropping once the newest block gets old
+    """
     if not blocks_per_30:
         return None
 
@@ -0,0 +1,129 @@
+from __future__ import print_function
+import math
+import time
+
+
+# Hex characters convert to 6 ('0'-'9') or 7 ('a'-'f') bits, 6.375 on average,
+# but only carry 4 bits of entropy, so every bit of difficulty is worth less
+# than a doubling of work
+BITS_PER_CHAR = (10 * 6 + 6 * 7) / 16.0
+WORK_PER_BIT = 4 / BITS_PER_CHAR
+
+# log2 of the number of places in the haystack a needle prefix can match,
+# fitted from sampled hashes between diff 14 and 34
+MATCH_POSITIONS = 7.0
+
+
+def expected_work(diff):
+    """
+    Average number of hashes needed to find a share of difficulty `diff`
+    """
+    return max(2.0 ** (diff * WORK_PER_BIT - MATCH_POSITIONS), 1.0)
+
+
+def work_difficulty(work):
+    """
+    Inverse of `expected_work`, the difficulty which takes `work` hashes
+    """
+    return (math.log(max(work, 1.0), 2) + MATCH_POSITIONS) / WORK_PER_BIT
+
+
+class RateWindow(object):
+    """
+    Work done over the last `window` seconds, in a ring of `buckets` slots
+    """
+    __slots__ = ('window', 'width', 'slots', 'stamps', 'started')
+
+    def __init__(self, window=600, buckets=60, now=None):
+        self.window = window
+        self.width = window / float(buckets)
+        self.slots = [0.0] * buckets
+        self.stamps = [None] * buckets
+        self.started = time.time() if now is None else now
+
+    def add(self, work, now=None):
+        if now is None:
+            now = time.time()
+        stamp = int(now // self.width)
+        N = stamp % len(self.slots)
+        if self.stamps[N] != stamp:
+            self.stamps[N] = stamp
+            self.slots[N] = 0.0
+        self.slots[N] += work
+
+    def rate(self, now=None):
+        """Hashes per second"""
+        if now is None:
+            now = time.time()
+        current = int(now // self.width)
+        oldest = current - len(self.slots)
+        total = sum([work for stamp, work in zip(self.stamps, self.slots)
+                     if stamp is not None and stamp > oldest])
+        # The current slot is only partly over
+        span = (len(self.slots) - 1) * self.width + (now - current * self.width)
+        span = min(span, now - self.started)
+        if span <= 0:
+            return 0.0
+        return total / span
+
+
+class HashrateEstimator(object):
+    """
+    Sliding window hashrate per miner connection, per reward address and
+    for the whole pool, from the difficulty of accepted shares
+    """
+    def __init__(self, window=600, buckets=60):
+        self.window = window
+        self.buckets = buckets
+        self.pool = None
+        self.miners = dict()
+        self.addresses = dict()
+
+    def _window(self, windows, key, now):
+        rates = windows.get(key)
+        if rates is None:
+            rates = windows[key] = RateWindow(self.window, self.buckets, now)
+        return rates
+
+    def on_share(self, miner, address, diff, now=None):
+        """
+        Credit an accepted share at job difficulty `diff`. Either of
+        `miner` or `address` may be None
+        """
+        if now is None:
+            now = time.time()
+        work = expected_work(int(diff))
+        if self.pool is None:
+            self.pool = RateWindow(self.window, self.buckets, now)
+        self.pool.add(work, now)
+        if miner is not None:
+            self._window(self.miners, miner, now).add(work, now)
+        if address is not None:
+            self._window(self.addresses, address, now).add(work, now)
+
+    def forget(self, miner):
+        self.miners.pop(miner, None)
+
+    def rate(self, miner=None, address=None, now=None):
+        if miner is not None:
+            rates = self.miners.get(miner)
+        elif address is not None:
+            rates = self.addresses.get(address)
+        else:
+            rates = self.pool
+        return rates.rate(now) if rates else 0.0
+
+    def top(self, count=10, now=None):
+        """Reward addresses with the highest hashrate, as (address, rate)"""
+        # Addresses which went quiet a whole window ago are dropped
+        rates = list()
+        for address, window in list(self.addresses.items()):
+            rate = window.rate(now)
+            if not rate and window.started < (time.time() if now is None else now) - self.window:
+                del self.addresses[address]
+                continue
+            rates.append((address, rate))
+        return sorted(rates, key=lambda row: row[1], reverse=True)[:count]
+
+    def status(self, now=None):
+        return dict(hashrate=self.rate(now=now), addresses=len(self.addresses))
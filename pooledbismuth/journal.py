@@ -0,0 +1,376 @@
+from __future__ import print_function
+import os
+import mmap
+import time
+import errno
+import fcntl
+import struct
+import traceback
+import logging as LOG
+from collections import deque, defaultdict
+
+import gevent
+from gevent import monkey
+from gevent.event import Event
+
+
+# timestamp, address id, diff, nonce (NUL padded)
+RECORD = struct.Struct('<dIH32s')
+# block hash, number of the first record mined on it
+INDEX = struct.Struct('<56sQ')
+
+NONCE_SIZE = 32
+NO_ADDRESS = 0xFFFFFFFF
+
+
+class ShareJournal(object):
+    """
+    Append-only journal of accepted shares, in one directory:
+
+     - `shares`: fixed size records, see `RECORD`
+     - `blocks`: one `INDEX` entry each time the consensus block changes,
+       the block's shares run up to the next entry
+     - `addresses`: reward addresses, one per line, the line is the id
+
+    Records are buffered and written as a group, every `commit_size` shares
+    or `commit_interval` seconds, whichever comes first, and when the
+    block changes.
+    """
+    def __init__(self, path, commit_size=512, commit_interval=0.5, fsync=False):
+        self.path = path
+        self.commit_size = commit_size
+        self.commit_interval = commit_interval
+        self.fsync = fsync
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.address_ids = dict()
+        with open(os.path.join(path, 'addresses'), 'a+') as handle:
+            handle.seek(0)
+            for N, address in enumerate(handle):
+                self.address_ids[address.strip()] = N
+        self._shares = open(os.path.join(path, 'shares'), 'ab')
+        self._blocks = open(os.path.join(path, 'blocks'), 'ab')
+        self._addresses = open(os.path.join(path, 'addresses'), 'a')
+        self._shares.seek(0, os.SEEK_END)
+        self.count = self._shares.tell() // RECORD.size
+        # Drop a partly written record, left by a crash
+        self._shares.truncate(self.count * RECORD.size)
+        self.block = None
+        self._pending = list()
+        self._committed = time.time()
+
+    def _address_id(self, address):
+        if address is None:
+            return NO_ADDRESS
+        address_id = self.address_ids.get(address)
+        if address_id is None:
+            address_id = self.address_ids[address] = len(self.address_ids)
+            self._addresses.write(address + "\n")
+            self._addresses.flush()
+        return address_id
+
+    def begin_block(self, block_hash):
+        """
+        Following shares are for `block_hash`
+        """
+        self.commit()
+        self._blocks.write(INDEX.pack(block_hash, self.count))
+        self._sync(self._blocks)
+        self.block = block_hash
+
+    def append(self, address, diff, nonce, now=None):
+        if now is None:
+            now = time.time()
+        self._pending.append(RECORD.pack(now, self._address_id(address), int(diff), nonce))
+        if len(self._pending) >= self.commit_size or now - self._committed >= self.commit_interval:
+            self.commit(now)
+
+    def tick(self, now=None):
+        """
+        Commit if shares have been waiting longer than `commit_interval`
+        """
+        if now is None:
+            now = time.time()
+        if self._pending and now - self._committed >= self.commit_interval:
+            self.commit(now)
+
+    def due(self, now=None):
+        """
+        Seconds until the pending shares are due to be committed, or None
+        if there are none
+        """
+        if not self._pending:
+            return None
+        if now is None:
+            now = time.time()
+        return max(self._committed + self.commit_interval - now, 0)
+
+    def commit(self, now=None):
+        """
+        Write every pending record in one go
+        """
+        self._committed = time.time() if now is None else now
+        if not self._pending:
+            return
+        self._shares.write(b''.join(self._pending))
+        self._sync(self._shares)
+        self.count += len(self._pending)
+        self._pending = list()
+
+    def _sync(self, handle):
+        handle.flush()
+        if self.fsync:
+            os.fsync(handle.fileno())
+
+    def close(self):
+        self.commit()
+        for handle in (self._shares, self._blocks, self._addresses):
+            handle.close()
+
+
+class JournalWriter(object):
+    """
+    Owns a `ShareJournal` in a dedicated OS thread, so accepting a share or
+    changing block only appends to an in-memory queue.
+
+    The writer sleeps until woken through a pipe, or until pending shares
+    are due to be committed. The queue holds at most `max_queue` items,
+    after which callers wait until the writer signals the hub that it has
+    caught up. How often and for how long they waited is reported by
+    `status()`.
+    """
+    def __init__(self, path, batch_size=512, flush_interval=0.5, max_queue=100000, fsync=False):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.fsync = fsync
+        self.queue = deque()
+        self.high_water = 0
+        self.stalls = 0
+        self.stall_time = 0.0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.alive = True
+        self._stopping = False
+        # Set by the writer before it sleeps, by callers before they wait
+        self._idle = False
+        self._full = False
+        self._space = Event()
+        # Writer failures, logged from the hub rather than the writer thread
+        self._failures = deque()
+        # Wakes the hub from the writer thread
+        self._notify = gevent.get_hub().loop.async_()
+        self._notify.ref = False
+        self._notify.start(self._on_notify)
+        self._wake_read, self._wake_write = os.pipe()
+        fcntl.fcntl(self._wake_write, fcntl.F_SETFL, os.O_NONBLOCK)
+        # Real threads, locks and select, even when monkey patched
+        start_new_thread, allocate_lock = monkey.get_original('thread', ['start_new_thread', 'allocate_lock'])
+        self._select = monkey.get_original('select', 'select')
+        self._done = allocate_lock()
+        self._done.acquire()
+        start_new_thread(self._run, ())
+
+    def begin_block(self, block_hash):
+        self._put((block_hash,))
+
+    def append(self, block_hash, address, diff, nonce):
+        """
+        Queue a share, it is only written if `block_hash` is still the
+        journal's block when the writer gets to it
+        """
+        self._put((block_hash, address, diff, nonce, time.time()))
+
+    def _put(self, item):
+        if not self.alive:
+            self.dropped += 1
+            return
+        if len(self.queue) >= self.max_queue and not self._stopping:
+            self.stalls += 1
+            began = time.time()
+            while len(self.queue) >= self.max_queue and self.alive and not self._stopping:
+                self._space.clear()
+                self._full = True
+                if len(self.queue) >= self.max_queue:
+                    # Only keeps the hub running while someone waits
+                    self._notify.ref = True
+                    try:
+                        self._space.wait()
+                    finally:
+                        self._notify.ref = False
+            self.stall_time += time.time() - began
+            if not self.alive:
+                self.dropped += 1
+                return
+        self.queue.append(item)
+        self.high_water = max(self.high_water, len(self.queue))
+        self._wake()
+
+    def _wake(self):
+        if self._idle:
+            self._idle = False
+            try:
+                os.write(self._wake_write, b'x')
+            except OSError as ex:
+                # Already has a wake-up waiting
+                if ex.errno != errno.EAGAIN:
+                    raise
+
+    def _on_notify(self):
+        while self._failures:
+            message, details = self._failures.popleft()
+            LOG.error('Journal %r - %s\n%s', self.path, message, details)
+        self._space.set()
+
+    def _failed(self, message):
+        self.errors += 1
+        self._failures.append((message, traceback.format_exc()))
+        self._notify.send()
+
+    def status(self):
+        return dict(queued=len(self.queue), high_water=self.high_water, stalls=self.stalls,
+                    stall_time=self.stall_time, written=self.written, dropped=self.dropped,
+                    errors=self.errors)
+
+    def _write(self, journal, item):
+        if len(item) == 1:
+            journal.begin_block(item[0])
+        elif item[0] != journal.block:
+            # Accepted just as the block changed
+            self.dropped += 1
+        else:
+            block_hash, address, diff, nonce, stamp = item
+            journal.append(address, diff, nonce, now=stamp)
+            self.written += 1
+
+    def _sleep(self, journal):
+        """
+        Wait for more items, or until pending shares are due
+        """
+        self._idle = True
+        # Anything queued before _idle was set would not have woken us
+        if self.queue or self._stopping:
+            self._idle = False
+            return
+        if self._select([self._wake_read], [], [], journal.due())[0]:
+            os.read(self._wake_read, 4096)
+        self._idle = False
+
+    def _run(self):
+        journal = None
+        try:
+            journal = ShareJournal(self.path, self.batch_size, self.flush_interval, self.fsync)
+            while True:
+                try:
+                    item = self.queue.popleft()
+                except IndexError:
+                    if self._stopping:
+                        break
+                    journal.tick()
+                    self._sleep(journal)
+                    continue
+                if self._full and len(self.queue) < self.max_queue:
+                    self._full = False
+                    self._notify.send()
+                try:
+                    self._write(journal, item)
+                except Exception:
+                    self._failed('failed to write %r' % (item,))
+        except Exception:
+            self._failed('writer failed')
+        finally:
+            self.alive = False
+            try:
+                if journal is not None:
+                    journal.close()
+            finally:
+                # Callers waiting for space give up on a dead writer
+                self._notify.send()
+                self._done.release()
+
+    def stop(self):
+        """
+        Write everything still queued, then close the journal
+        """
+        self._stopping = True
+        self._idle = True
+        self._wake()
+        self._done.acquire()
+        self._done.release()
+        self._on_notify()
+        self._notify.stop()
+        self._notify.close()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+
+class JournalReader(object):
+    """
+    Read-only view of a `ShareJournal`, with the shares file mapped in
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'addresses')) as handle:
+            self.addresses = [address.strip() for address in handle]
+        with open(os.path.join(path, 'blocks'), 'rb') as handle:
+            data = handle.read()
+        fields = struct.unpack_from('<' + '56sQ' * (len(data) // INDEX.size), data)
+        self.index = list(zip(fields[0::2], fields[1::2]))
+        # Index entries for each block hash
+        self.entries = defaultdict(list)
+        for N, (block_hash, _) in enumerate(self.index):
+            self.entries[block_hash].append(N)
+        self._handle = open(os.path.join(path, 'shares'), 'rb')
+        size = os.fstat(self._handle.fileno()).st_size
+        self.count = size // RECORD.size
+        self._map = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._handle.close()
+
+    def ranges(self, block_hash):
+        """
+        (first, last) record numbers of each stretch mined on `block_hash`,
+        there is more than one if the consensus flipped back to it
+        """
+        for N in self.entries.get(block_hash, ()):
+            first = self.index[N][1]
+            last = self.index[N + 1][1] if N + 1 < len(self.index) else self.count
+            yield first, min(last, self.count)
+
+    def record(self, N):
+        stamp, address_id, diff, nonce = RECORD.unpack_from(self._map, N * RECORD.size)
+        address = None if address_id == NO_ADDRESS else self.addresses[address_id]
+        return [stamp, address, diff, nonce.rstrip(b'\0')]
+
+    def raw(self, block_hash):
+        """
+        Packed `RECORD`s for a block, or None if the journal never saw it
+        """
+        parts = None
+        for first, last in self.ranges(block_hash):
+            if parts is None:
+                parts = list()
+            if last > first:
+                parts.append(self._map[first * RECORD.size:last * RECORD.size])
+        return None if parts is None else b''.join(parts)
+
+    def block(self, block_hash):
+        """
+        Shares for a block as `[stamp, address, diff, nonce]` lists, or None
+        if the journal never saw the block
+        """
+        data = self.raw(block_hash)
+        if data is None:
+            LOG.debug('Journal %r - no shares for %r', self.path, block_hash)
+            return None
+        count = len(data) // RECORD.size
+        # The block's records unpacked in one go, rather than one by one
+        fields = struct.unpack('<' + 'dIH32s' * count, data)
+        addresses = self.addresses
+        return [[stamp, None if address_id == NO_ADDRESS else addresses[address_id], diff, nonce.rstrip(b'\0')]
+                for stamp, address_id, diff, nonce in zip(fields[0::4], fields[1::4], fields[2::4], fields[3::4])]
@@ -0,0 +1,270 @@
+from __future__ import print_function
+import os
+import sqlite3
+import logging as LOG
+from collections import namedtuple
+
+try:
+    from urllib import pathname2url
+except ImportError:
+    from urllib.request import pathname2url
+
+
+Transaction = namedtuple('Transaction', ('block_height', 'timestamp', 'address', 'recipient', 'amount',
+                                         'fee', 'reward', 'block_hash', 'openfield'))
+
+COLUMNS = ', '.join(Transaction._fields)
+
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Side index for ledgers without one on block_height. It relies on the node
+# appending rows in height order, so rowid order is height order.
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    block_height INTEGER NOT NULL PRIMARY KEY,
+    first_row INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS rewards (
+    row INTEGER NOT NULL PRIMARY KEY,
+    block_height INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS indexed (
+    id INTEGER NOT NULL PRIMARY KEY CHECK (id = 0),
+    last_row INTEGER NOT NULL,
+    block_height INTEGER NOT NULL,
+    block_hash TEXT NOT NULL
+);
+"""
+
+LEDGERS = dict()
+
+
+def open_ledger(path, index_path=None):
+    """
+    Shared `Ledger` for `path`, brought up to date
+    """
+    ledger = LEDGERS.get(path)
+    if ledger is None:
+        ledger = LEDGERS[path] = Ledger(path, index_path)
+    ledger.refresh()
+    return ledger
+
+
+class Ledger(object):
+    """
+    Read-only access to a Bismuth node's ledger database.
+
+    The ledger is opened with a `mode=ro` URI, which follows the node's
+    writes including in WAL mode, or `immutable` for a copy nothing writes
+    to, and with memory mapped reads. The connection is kept for reuse,
+    so its prepared statements are cached too. Everything here runs in
+    greenlets of one thread, or in forked processes.
+
+    When the node's schema has no index on `block_height`, and an
+    `index_path` is given, height lookups go through a side database
+    built from the ledger's rowids, see `refresh`.
+    """
+    def __init__(self, path, index_path=None, immutable=False, mmap_size=MMAP_SIZE):
+        self.path = path
+        self.index_path = index_path
+        self.immutable = immutable
+        self.mmap_size = mmap_size
+        self._db = None
+        self._pid = None
+        self.has_index = self._has_height_index()
+        self.index = None
+        if index_path is not None and not self.has_index:
+            if os.path.dirname(index_path) and not os.path.exists(os.path.dirname(index_path)):
+                os.makedirs(os.path.dirname(index_path))
+            self.index = sqlite3.connect(index_path)
+            self.index.executescript(INDEX_SCHEMA)
+
+    def connection(self):
+        """
+        Connection for this process, a forked child opens its own
+        """
+        if self._db is None or self._pid != os.getpid():
+            self._db = self._connect()
+            self._pid = os.getpid()
+        return self._db
+
+    def _connect(self):
+        mode = 'immutable=1' if self.immutable else 'mode=ro'
+        try:
+            db = sqlite3.connect('file:%s?%s' % (pathname2url(os.path.abspath(self.path)), mode), uri=True)
+        except TypeError:
+            # Python 2 can't open URIs
+            db = sqlite3.connect(self.path)
+            db.execute("PRAGMA query_only = ON")
+        db.text_factory = str
+        db.execute("PRAGMA mmap_size = %d" % (self.mmap_size,))
+        return db
+
+    def close(self):
+        if self._db is not None and self._pid == os.getpid():
+            self._db.close()
+        self._db = None
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+    def _has_height_index(self):
+        db = self.connection()
+        for index in db.execute("PRAGMA index_list(transactions)").fetchall():
+            columns = db.execute("PRAGMA index_info(%s)" % (index[1],)).fetchall()
+            if columns and columns[0][2] == 'block_height':
+                return True
+        return False
+
+    def _indexed(self):
+        """
+        Last row and height in the side index, or None
+        """
+        if self.index is None:
+            return None
+        return self.index.execute("SELECT last_row, block_height FROM indexed WHERE id = 0").fetchone()
+
+    def refresh(self, batch_size=10000):
+        """
+        Add ledger rows written since the last refresh to the side index.
+        The index is rebuilt if the ledger was rolled back, and dropped if
+        rows turn out not to be in height order.
+        """
+        if self.index is None:
+            return
+        db = self.connection()
+        index = self.index
+        last_row, height, block_hash = 0, None, None
+        row = index.execute("SELECT last_row, block_height, block_hash FROM indexed WHERE id = 0").fetchone()
+        if row is not None:
+            current = db.execute("SELECT block_hash FROM transactions WHERE rowid = ?", (row[0],)).fetchone()
+            if current is None or current[0] != row[2]:
+                LOG.warning('Ledger %r - rolled back, rebuilding index %r', self.path, self.index_path)
+                index.execute("DELETE FROM blocks")
+                index.execute("DELETE FROM rewards")
+                index.execute("DELETE FROM indexed")
+            else:
+                last_row, height, block_hash = row
+        cursor = db.execute("""
+            SELECT rowid, block_height, block_hash, reward > 0 FROM transactions
+            WHERE rowid > ? ORDER BY rowid
+        """, (last_row,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            blocks = list()
+            rewards = list()
+            for rowid, row_height, row_hash, rewarded in rows:
+                if height is not None and row_height < height:
+                    LOG.warning('Ledger %r - rows out of height order at %d, not using index %r',
+                                self.path, rowid, self.index_path)
+                    index.rollback()
+                    index.close()
+                    self.index = None
+                    return
+                if row_height != height:
+                    blocks.append((row_height, rowid))
+                if rewarded:
+                    rewards.append((rowid, row_height))
+                last_row, height, block_hash = rowid, row_height, row_hash
+            index.executemany("REPLACE INTO blocks VALUES (?, ?)", blocks)
+            index.executemany("REPLACE INTO rewards VALUES (?, ?)", rewards)
+            index.execute("REPLACE INTO indexed VALUES (0, ?, ?, ?)", (last_row, height, block_hash))
+            index.commit()
+        index.commit()
+
+    def _first_row(self, height):
+        """
+        First rowid above `height`, or past the indexed rows
+        """
+        row = self.index.execute("""
+            SELECT first_row FROM blocks WHERE block_height > ? ORDER BY block_height LIMIT 1
+        """, (height,)).fetchone()
+        if row is not None:
+            return row[0]
+        indexed = self._indexed()
+        return indexed[0] + 1 if indexed is not None else 0
+
+    def top(self):
+        """
+        Highest block in the ledger
+        """
+        indexed = self._indexed()
+        if indexed is None:
+            return self.connection().execute("SELECT MAX(block_height) FROM transactions").fetchone()[0]
+        # Plus rows written since the index was refreshed
+        tail = self.connection().execute("""
+            SELECT MAX(block_height) FROM transactions WHERE rowid > ?
+        """, (indexed[0],)).fetchone()[0]
+        return indexed[1] if tail is None else max(indexed[1], tail)
+
+    def _stream(self, cursor, batch_size):
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield Transaction._make(row)
+
+    def transactions(self, since, until=None, batch_size=10000):
+        """
+        Every transaction above height `since`, up to `until`, in ledger order
+        """
+        if until is None:
+            until = self.top()
+        if self.index is not None:
+            cursor = self.connection().execute("""
+                SELECT %s FROM transactions
+                WHERE rowid >= ? AND block_height > ? AND block_height <= ? ORDER BY rowid
+            """ % (COLUMNS,), (self._first_row(since), since, until))
+        else:
+            cursor = self.connection().execute("""
+                SELECT %s FROM transactions WHERE block_height > ? AND block_height <= ?
+                ORDER BY block_height, rowid
+            """ % (COLUMNS,), (since, until))
+        return self._stream(cursor, batch_size)
+
+    def rewards(self, since, batch_size=10000):
+        """
+        Transactions paying a block reward above height `since`, in order
+        """
+        if self.index is not None:
+            cursor = self.connection().execute("""
+                SELECT %s FROM transactions
+                WHERE rowid >= ? AND block_height > ? AND reward > 0 ORDER BY rowid
+            """ % (COLUMNS,), (self._first_row(since), since))
+        else:
+            cursor = self.connection().execute("""
+                SELECT %s FROM transactions WHERE block_height > ? AND reward > 0
+                ORDER BY block_height, rowid
+            """ % (COLUMNS,), (since,))
+        return self._stream(cursor, batch_size)
+
+    def last_rewards(self, count):
+        """
+        The last `count` transactions paying a block reward, oldest first
+        """
+        db = self.connection()
+        indexed = self._indexed()
+        if indexed is None:
+            rows = db.execute("""
+                SELECT %s FROM transactions WHERE reward > 0
+                ORDER BY block_height DESC, rowid DESC LIMIT ?
+            """ % (COLUMNS,), (count,)).fetchall()
+        else:
+            # Unindexed rows first, then the index for the rest
+            rows = db.execute("""
+                SELECT %s FROM transactions WHERE rowid > ? AND reward > 0 ORDER BY rowid DESC LIMIT ?
+            """ % (COLUMNS,), (indexed[0], count)).fetchall()
+            if len(rows) < count:
+                rowids = [row[0] for row in self.index.execute("""
+                    SELECT row FROM rewards ORDER BY row DESC LIMIT ?
+                """, (count - len(rows),))]
+                placeholders = ','.join(['?'] * len(rowids))
+                rows += db.execute("""
+                    SELECT %s FROM transactions WHERE rowid IN (%s) ORDER BY rowid DESC
+                """ % (COLUMNS, placeholders), rowids).fetchall()
+        return [Transaction._make(row) for row in reversed(rows)]
@@ -0,0 +1,130 @@
+from __future__ import print_function
+import re
+import ast
+
+
+# One token of a literal, with the whitespace around it
+TOKEN = re.compile(r"""\s*(?:
+    (?P<open>[\[(])\s*
+  | (?P<close>[\])])
+  | (?P<comma>,)\s*
+  | (?P<string>[uUbBrR]{0,2}(?:'[^'\\\n]*(?:\\.[^'\\\n]*)*'|"[^"\\\n]*(?:\\.[^"\\\n]*)*"))
+  | (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?[lL]?)
+  | (?P<name>None|True|False)
+)""", re.X)
+PLAIN_INT = re.compile(r"-?(?:0|[1-9]\d*)$")
+LIST_START = re.compile(r"\s*\[")
+NAMES = {'None': None, 'True': True, 'False': False}
+
+
+def _scalar(kind, token):
+    if kind == 'string':
+        if token[0] in '\'"' and '\\' not in token:
+            return token[1:-1]
+        return ast.literal_eval(token)
+    if kind == 'number':
+        if PLAIN_INT.match(token):
+            return int(token)
+        if token[-1] not in 'lL' and ('.' in token or 'e' in token or 'E' in token):
+            return float(token)
+        # Longs, and octal in Python 2
+        return ast.literal_eval(token)
+    return NAMES[token]
+
+
+def _plain_tuple(text, pos):
+    """
+    The tuple of plain quoted strings at `pos`, as in a peer's transaction
+    lists, and where it ends. Found by splitting on the quotes, which is
+    far quicker than a regular expression over long strings. None for
+    anything else, to be tokenized instead.
+    """
+    end = text.find(')', pos) + 1
+    part = text[pos:end]
+    if not end or '\\' in part or '\n' in part:
+        return None
+    pieces = part.split("'")
+    if not len(pieces) % 2 or pieces[0] != '(' or pieces[-1] not in (')', ',)'):
+        return None
+    separators = pieces[2:-1:2]
+    if separators.count(', ') != len(separators):
+        return None
+    if len(pieces) == 3 and pieces[-1] == ')':
+        # Only parentheses
+        return pieces[1], end
+    return tuple(pieces[1::2]), end
+
+
+def iter_list(text):
+    """
+    Each item of the list literal `text` in turn, as `ast.literal_eval`
+    would parse it. Only lists, tuples, strings, numbers, None, True and
+    False are allowed, anything else raises ValueError.
+
+    Items are yielded as soon as they are parsed, so a long list can be
+    worked through a bit at a time.
+    """
+    match = LIST_START.match(text)
+    if match is None:
+        raise ValueError('Not a list literal: %r' % (text[:20],))
+    pos = match.end()
+    # [is tuple, items, commas] for each open tuple or list
+    stack = list()
+    expect_value = True
+    while True:
+        if expect_value and text.startswith("('", pos):
+            found = _plain_tuple(text, pos)
+            if found is not None:
+                value, pos = found
+                if stack:
+                    stack[-1][1].append(value)
+                else:
+                    yield value
+                expect_value = False
+                continue
+        match = TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError('Unexpected %r at %d' % (text[pos:pos + 20], pos))
+        pos = match.end()
+        kind = match.lastgroup
+        token = match.group(kind)
+        if kind == 'comma':
+            if expect_value:
+                raise ValueError('Unexpected comma at %d' % (pos,))
+            if stack:
+                stack[-1][2] += 1
+            expect_value = True
+            continue
+        if kind == 'close':
+            if not stack:
+                if token != ']':
+                    raise ValueError('Unbalanced %r at %d' % (token, pos))
+                break
+            is_tuple, items, commas = stack.pop()
+            if is_tuple != (token == ')'):
+                raise ValueError('Unbalanced %r at %d' % (token, pos))
+            if not is_tuple:
+                value = items
+            elif len(items) == 1 and not commas:
+                # Only parentheses
+                value = items[0]
+            else:
+                value = tuple(items)
+        elif not expect_value:
+            raise ValueError('Missing comma at %d' % (match.start(kind),))
+        elif kind == 'open':
+            stack.append([token == '(', [], 0])
+            continue
+        else:
+            value = _scalar(kind, token)
+        if stack:
+            stack[-1][1].append(value)
+        else:
+            yield value
+        expect_value = False
+    if text[pos:].strip():
+        raise ValueError('Unexpected %r after the list' % (text[pos:pos + 20],))
+
+
+def parse_list(text):
+    return list(iter_list(text))
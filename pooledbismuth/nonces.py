@@ -0,0 +1,102 @@
+from __future__ import print_function
+import os
+import struct
+import hashlib
+from array import array
+
+
+# 64-bit unsigned slots, 'Q' is Python 3 only
+TYPECODE = 'Q' if hasattr(array, 'typecodes') and 'Q' in array.typecodes else 'L'
+# Under 2^63, so Python 2 keeps digests as plain ints rather than longs
+DIGEST_BITS = min(array(TYPECODE).itemsize * 8 - 1, 63)
+DIGEST = struct.Struct('<Q')
+
+# Tables are split on the top digest bits, so growing one only rehashes
+# a small part of the index, and never stalls the miners for long
+PARTITION_BITS = 8
+PARTITION_SHIFT = DIGEST_BITS - PARTITION_BITS
+
+
+class NonceIndex(object):
+    """
+    Nonces seen on the current block, as keyed 63-bit digests in open
+    addressing tables: 8 bytes a slot, kept at most 2/3 full, against
+    roughly 100 bytes a nonce for a set of strings.
+
+    The digest key is random for each index, so nobody can pick a nonce
+    which collides with another miner's. By chance, a collision is one in
+    2^63 / len(index) lookups.
+    """
+    __slots__ = ('_key', '_tables', '_counts', 'count', 'capacity')
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.reset()
+
+    def reset(self):
+        """
+        Forget every nonce, and give the memory back
+        """
+        self._key = os.urandom(16)
+        self._tables = [array(TYPECODE, [0]) * self.capacity for _ in range(1 << PARTITION_BITS)]
+        self._counts = [0] * (1 << PARTITION_BITS)
+        self.count = 0
+
+    def digest(self, nonce):
+        # Zero marks an empty slot
+        return (DIGEST.unpack_from(hashlib.md5(self._key + nonce).digest())[0] >> (64 - DIGEST_BITS)) or 1
+
+    def __contains__(self, nonce):
+        digest = (DIGEST.unpack_from(hashlib.md5(self._key + nonce).digest())[0] >> (64 - DIGEST_BITS)) or 1
+        table = self._tables[digest >> PARTITION_SHIFT]
+        mask = len(table) - 1
+        N = digest & mask
+        slot = table[N]
+        while slot:
+            if slot == digest:
+                return True
+            N = (N + 1) & mask
+            slot = table[N]
+        return False
+
+    def add(self, nonce):
+        """
+        Add `nonce`, returns False if it was already there
+        """
+        digest = (DIGEST.unpack_from(hashlib.md5(self._key + nonce).digest())[0] >> (64 - DIGEST_BITS)) or 1
+        partition = digest >> PARTITION_SHIFT
+        table = self._tables[partition]
+        mask = len(table) - 1
+        N = digest & mask
+        slot = table[N]
+        while slot:
+            if slot == digest:
+                return False
+            N = (N + 1) & mask
+            slot = table[N]
+        table[N] = digest
+        self.count += 1
+        self._counts[partition] += 1
+        if self._counts[partition] * 3 > len(table) * 2:
+            self._grow(partition)
+        return True
+
+    def _grow(self, partition):
+        old = self._tables[partition]
+        table = self._tables[partition] = array(TYPECODE, [0]) * (len(old) * 2)
+        mask = len(table) - 1
+        for digest in old:
+            if digest:
+                N = digest & mask
+                while table[N]:
+                    N = (N + 1) & mask
+                table[N] = digest
+
+    def __len__(self):
+        return self.count
+
+    def memory(self):
+        """
+        Bytes used by the tables
+        """
+        return sum([len(table) for table in self._tables]) * array(TYPECODE).itemsize
@@ -1,59 +1,37 @@
 from __future__ import print_function
+import sys
 import sqlite3
 import os
 import json
-from collections import defaultdict
-
-from .common import Identity
+import itertools
+import time
+import argparse
+import multiprocessing
+import logging as LOG
+from collections import defaultdict, OrderedDict
+
+from .common import Identity, stamp_hour
+from .journal import JournalReader, NO_ADDRESS
+from .ledger import Ledger, open_ledger
+from .snapshot import Snapshot
 from . import bismuth
 
+try:
+    import numpy
+except ImportError:
+    LOG.info('NumPy not found, using slow share histograms')
+    numpy = None
 
-def double_N(value, times):
-    for N in range(0, times):
-        value *= 2
-    return value
-
-
-def load_block(blockno_or_hash):
-    filename = 'data/done/%s.block' % (str(blockno_or_hash),)
-    if not os.path.exists(filename):
-        return None
-    with open(filename, 'rb') as handle:
-        proofs = []
-        for proof in handle:
-            proof = json.loads(proof)
-            proofs.append(proof)
-    return proofs
-
-
-def proof_histogram(proofs, pool_address):
-    # max_height = max([X[2] for X in proofs])
-    min_height = min([X[2] for X in proofs])
-    share_dist = defaultdict(int)
-    work_counts = defaultdict(int)
-    total_shares = 0
-    named_shares = 0
-    for proof in proofs:
-        # Calculate payout relative to highest scoring Proof of Work
-        gap = abs(proof[2] - min_height)
-        share = double_N(1.0, gap)
-        total_shares += share
-        if proof[1] is None:
-            proof[1] = pool_address
-        else:
-            named_shares += share
-        work_counts[proof[1]] += 1
-        share_dist[proof[1]] += share
-    return total_shares, named_shares, share_dist, work_counts, len(proofs)
 
+# Ledger rows before this height were never mined by the pool
+FIRST_HEIGHT = 90000
 
-myid = Identity('.bismuth.key')
 
+if numpy is not None:
+    # Same layout as journal.RECORD
+    RECORD_DTYPE = numpy.dtype([('stamp', '<f8'), ('address', '<u4'), ('diff', '<u2'), ('nonce', 'S32')])
 
-pooldb = sqlite3.connect('data/pool.db')
-pooldb.text_factory = str
-poolcur = pooldb.cursor()
-poolcur.executescript("""
+SCHEMA = """
 CREATE TABLE IF NOT EXISTS workproof (
     block_id INTEGER NOT NULL,
     address_id INTEGER NOT NULL,
@@ -88,98 +66,648 @@ CREATE TABLE IF NOT EXISTS blocks (
     pool_balance INTEGER NOT NULL,
     pool_shmeckles INTEGER NOT NULL
 );
-""")
-
-
-def make_address_ids(poolcur, addresses):
-    placeholders = ','.join(['?'] * len(addresses))
-    sql = "SELECT address, id FROM addresses WHERE address IN (%s)" % (placeholders,)
-    poolcur.execute(sql, addresses)
-    found = dict(poolcur.fetchall())
-    for address in addresses:
-        if address not in found:
-            poolcur.execute("INSERT INTO addresses (address) VALUES (?)", (address,))
-            found[address] = poolcur.lastrowid
-    return found
-
-
-ledgerdb = sqlite3.connect("../Bismuth/static/ledger.db")  # open to select the last tx to create a new hash from
-ledgerdb.text_factory = str
-ledgercon = ledgerdb.cursor()
-ledgercon.execute("""
-    SELECT block_height, reward, openfield, timestamp, address, amount, fee, recipient, block_hash FROM transactions
-    WHERE block_height > 90000
-""")  # , (myid.public_key_hashed,))
-result = ledgercon.fetchall()
-
-
-pool_balance = 0
-pool_shmeckles = 0
-
-prev_block_hash = None
-
-for row in result:
-    address = row[4]
-    blockno = row[0]
-    openfield = row[2]
-    reward = float(row[1])
-    amount = float(row[5])
-    fees = float(row[6])
-    recipient = row[7]
-    block_hash = row[8]
+
+CREATE TABLE IF NOT EXISTS checkpoint (
+    id INTEGER NOT NULL PRIMARY KEY CHECK (id = 0),
+    height INTEGER NOT NULL,
+    block_hash TEXT,
+    pool_balance REAL NOT NULL,
+    pool_shmeckles INTEGER NOT NULL
+);
+
+-- Rolled up workproof, kept up to date with every block credited
+CREATE TABLE IF NOT EXISTS address_hours (
+    address_id INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    blocks INTEGER NOT NULL DEFAULT 0,
+    shares REAL NOT NULL DEFAULT 0,
+    workcount INTEGER NOT NULL DEFAULT 0,
+    shmeckles REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (address_id, hour)
+);
+
+CREATE TABLE IF NOT EXISTS address_totals (
+    address_id INTEGER NOT NULL PRIMARY KEY,
+    blocks INTEGER NOT NULL DEFAULT 0,
+    shares REAL NOT NULL DEFAULT 0,
+    workcount INTEGER NOT NULL DEFAULT 0,
+    shmeckles REAL NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS address_hours_hour ON address_hours (hour);
+CREATE INDEX IF NOT EXISTS blocks_stamp ON blocks (stamp);
+CREATE INDEX IF NOT EXISTS workproof_address ON workproof (address_id);
+"""
+
+
+def double_N(value, times):
+    for N in range(0, times):
+        value *= 2
+    return value
+
+
+def load_block(blockno_or_hash, journal=None):
+    if journal is not None:
+        proofs = journal.block(str(blockno_or_hash))
+        if proofs is not None:
+            return proofs
+    # Blocks from before the share journal
+    filename = 'data/done/%s.block' % (str(blockno_or_hash),)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as handle:
+        proofs = []
+        for proof in handle:
+            proof = json.loads(proof)
+            proofs.append(proof)
+    return proofs
+
+
+def proof_histogram(proofs, pool_address):
+    # max_height = max([X[2] for X in proofs])
+    min_height = min([X[2] for X in proofs])
+    share_dist = defaultdict(int)
+    work_counts = defaultdict(int)
+    total_shares = 0
+    named_shares = 0
+    for proof in proofs:
+        # Calculate payout relative to highest scoring Proof of Work
+        gap = abs(proof[2] - min_height)
+        share = double_N(1.0, gap)
+        total_shares += share
+        if proof[1] is None:
+            proof[1] = pool_address
+        else:
+            named_shares += share
+        work_counts[proof[1]] += 1
+        share_dist[proof[1]] += share
+    return total_shares, named_shares, share_dist, work_counts, len(proofs)
+
+
+class AddressTable(object):
+    """
+    Numbers addresses for `proof_histograms`. It starts out with a share
+    journal's addresses, so the ids in its records can be used as they are.
+    """
+    def __init__(self, addresses=()):
+        self.names = list(addresses)
+        self.ids = dict((address, N) for N, address in enumerate(self.names))
+
+    def id(self, address):
+        if address is None:
+            return NO_ADDRESS
+        address_id = self.ids.get(address)
+        if address_id is None:
+            address_id = self.ids[address] = len(self.names)
+            self.names.append(address)
+        return address_id
+
+    def columns(self, proofs):
+        """
+        Address ids and difficulties of `load_block` style proofs, as arrays
+        """
+        address_ids = numpy.array([self.id(proof[1]) for proof in proofs], dtype=numpy.int64)
+        return address_ids, numpy.array([proof[2] for proof in proofs], dtype=numpy.int64)
+
+
+def journal_columns(journal, block_hash):
+    """
+    Address ids and difficulties of a block's journal records, or None
+    """
+    data = journal.raw(str(block_hash))
+    if data is None:
+        return None
+    records = numpy.frombuffer(data, dtype=RECORD_DTYPE)
+    return records['address'].astype(numpy.int64), records['diff'].astype(numpy.int64)
+
+
+def proof_histograms(blocks, names, pool_address):
+    """
+    `proof_histogram` for many blocks in one go. Each block is a pair of
+    address id and difficulty arrays, the ids index `names` and
+    `NO_ADDRESS` is the pool. Blocks without proofs get None.
+
+    Sums are accumulated in the same order as `proof_histogram`, so the
+    results are identical, not just close.
+    """
+    results = [None] * len(blocks)
+    sizes = numpy.array([len(diffs) for _, diffs in blocks], dtype=numpy.int64)
+    if not sizes.sum():
+        return results
+    address_ids = numpy.concatenate([address_ids for address_ids, _ in blocks])
+    diffs = numpy.concatenate([diffs for _, diffs in blocks])
+    block = numpy.repeat(numpy.arange(len(blocks)), sizes)
+    filled = numpy.flatnonzero(sizes)
+    lowest = numpy.zeros(len(blocks), dtype=numpy.int64)
+    lowest[filled] = numpy.minimum.reduceat(diffs, (numpy.cumsum(sizes) - sizes)[filled])
+    # Relative to the lowest difficulty in each block, like double_N
+    weights = numpy.ldexp(1.0, (diffs - lowest[block]).astype(numpy.intc))
+    named = address_ids != NO_ADDRESS
+    total_shares = numpy.bincount(block, weights, len(blocks)).tolist()
+    named_shares = numpy.bincount(block[named], weights[named], len(blocks)).tolist()
+
+    # Unnamed shares are credited to the pool address
+    names = list(names)
+    if pool_address in names:
+        pool_id = names.index(pool_address)
+    else:
+        pool_id = len(names)
+        names.append(pool_address)
+    address_ids = numpy.where(named, address_ids, pool_id)
+
+    # One bin for each address in each block
+    keys, bins = numpy.unique(block * len(names) + address_ids, return_inverse=True)
+    shares = numpy.bincount(bins, weights).tolist()
+    work_counts = numpy.bincount(bins).tolist()
+    key_names = numpy.array(names, dtype=object)[keys % len(names)].tolist()
+    bounds = numpy.searchsorted(keys // len(names), numpy.arange(len(blocks) + 1)).tolist()
+    for N in filled.tolist():
+        first, last = bounds[N], bounds[N + 1]
+        results[N] = (total_shares[N], named_shares[N],
+                      dict(zip(key_names[first:last], shares[first:last])),
+                      dict(zip(key_names[first:last], work_counts[first:last])),
+                      int(sizes[N]))
+    return results
+
+
+class ShareLoader(object):
+    """
+    Share histograms for blocks, from the share journal or, for blocks
+    from before it, the legacy proof files
+    """
+    def __init__(self, pool_address, journal=None):
+        self.pool_address = pool_address
+        self.journal = journal
+        self.addresses = None
+        if numpy is not None:
+            self.addresses = AddressTable(journal.addresses if journal is not None else ())
+
+    def _columns(self, blockno_or_hash):
+        if self.journal is not None:
+            columns = journal_columns(self.journal, blockno_or_hash)
+            if columns is not None:
+                return columns
+        proofs = load_block(blockno_or_hash)
+        if proofs is None:
+            return None
+        return self.addresses.columns(proofs)
+
+    def histograms(self, blocks):
+        """
+        Histogram, or None, for each `(blockno, prev_block_hash)`. Shares
+        mined on top of the previous block count towards a block.
+        """
+        if numpy is None:
+            histograms = list()
+            for blockno, prev_block_hash in blocks:
+                proofs = (load_block(blockno, self.journal) or []) + (load_block(prev_block_hash, self.journal) or [])
+                histograms.append(proof_histogram(proofs, self.pool_address) if proofs else None)
+            return histograms
+        empty = numpy.array([], dtype=numpy.int64)
+        columns = list()
+        for keys in blocks:
+            parts = [part for part in map(self._columns, keys) if part is not None] or [(empty, empty)]
+            columns.append((numpy.concatenate([part[0] for part in parts]),
+                            numpy.concatenate([part[1] for part in parts])))
+        return proof_histograms(columns, self.addresses.names, self.pool_address)
+
+
+def won_blocks(rows, prev_block_hash):
+    """
+    `(blockno, prev_block_hash)` for each block won in the ledger `rows`
+    """
+    blocks = list()
+    for row in rows:
+        if row.recipient == row.address:
+            blocks.append((row.block_height, prev_block_hash))
+            prev_block_hash = row.block_hash
+    return blocks
+
+
+def balance_change(row, pool_address):
+    """
+    How a ledger row changes the pool balance, None if it doesn't involve
+    the pool
+    """
+    address = row.address
+    recipient = row.recipient
+    reward = float(row.reward)
+    amount = float(row.amount)
+    fees = float(row.fee)
 
     debit = 0
     credit = 0
-    if recipient == myid.address:
+    if recipient == pool_address:
         credit = amount
     else:
         debit = amount
 
-    if recipient == myid.address or address == myid.address:
-        pool_balance += credit - debit - fees + reward
+    if recipient == pool_address or address == pool_address:
+        return credit - debit - fees + reward
+    return None
+
 
-    if recipient != address:
-        continue
+def credit_block(row, histogram, prev_block_hash, pool_address):
+    """
+    Returns the `blocks` row, short of the pool balance and shmeckles, the
+    addresses to number, and `(address, shares, workcount, shmeckles)`
+    for each miner credited with the block won in ledger `row`
+    """
+    address = row.address
+    blockno = row.block_height
+    openfield = row.openfield
+    reward = float(row.reward)
 
-    proofs = load_block(blockno).extend(load_block(prev_block_hash))
     total_shares = 0
     total_work = 0
     named_shares = 0
     share_dist = dict()
-    if proofs:
-        total_shares, named_shares, share_dist, work_counts, total_work = proof_histogram(proofs, myid.address)
-        pool_shmeckles += 1
+    if histogram is not None:
+        total_shares, named_shares, share_dist, work_counts, total_work = histogram
     named_work = 0
-    did_win = myid.address == address
+    did_win = pool_address == address
 
     # Calculate difficulty
     difficulty = None
     if prev_block_hash:
         difficulty = bismuth.difficulty(address, openfield, prev_block_hash)
-    prev_block_hash = block_hash
-
-    # balance = bismuth_balance(ledgercon, blockno, myid.address)
-    # shmecks = total_shmeckles(poolcur, blockno)
 
-    address_ids = make_address_ids(poolcur, share_dist.keys())
-    workproof_rows = list()
-    for address, shares in share_dist.items():
-        if address == myid.address:
+    workproofs = list()
+    for miner, shares in share_dist.items():
+        if miner == pool_address:
             continue
-        address_id = address_ids[address]
         shmeckles = round(shares / named_shares, 6)
-        work_count = work_counts[address]
+        work_count = work_counts[miner]
         named_work += work_count
-        workproof_rows.append((blockno, address_id, shares, work_count, shmeckles))
-
-    poolcur.executemany("REPLACE INTO workproof VALUES (?, ?, ?, ?, ?)", workproof_rows)
-
-    poolcur.execute("""
-    REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (blockno, row[3], int(did_win), total_shares, row[2], reward, row[4], difficulty,
-          total_work, named_work, named_shares, pool_balance, pool_shmeckles))
+        workproofs.append((miner, shares, work_count, shmeckles))
 
     # Openfield cost:
     # float(len(db_openfield)) / 100000
 
-pooldb.commit()
+    block = (blockno, row.timestamp, int(did_win), total_shares, openfield, reward, address, difficulty,
+             total_work, named_work, named_shares)
+    return block, list(share_dist.keys()), workproofs
+
+
+# Ledger and shares of a backfill process
+_BACKFILL = None
+
+
+def _backfill_init(ledger_path, index_path, journal_path, pool_address):
+    global _BACKFILL
+    journal = JournalReader(journal_path) if journal_path else None
+    _BACKFILL = Ledger(ledger_path, index_path), ShareLoader(pool_address, journal)
+
+
+def _backfill_close():
+    global _BACKFILL
+    ledger, shares = _BACKFILL
+    ledger.close()
+    if shares.journal is not None:
+        shares.journal.close()
+    _BACKFILL = None
+
+
+def _backfill_chunk(task):
+    """
+    Credits the blocks in one height range, in a backfill process.
+    Returns `(balance_change, credit)` for each ledger row which has either.
+    """
+    first, last, prev_block_hash = task
+    ledger, shares = _BACKFILL
+    pool_address = shares.pool_address
+    rows = list(ledger.transactions(first, last))
+    histograms = iter(shares.histograms(won_blocks(rows, prev_block_hash)))
+    events = list()
+    for row in rows:
+        change = balance_change(row, pool_address)
+        credit = None
+        if row.recipient == row.address:
+            histogram = next(histograms)
+            credit = (credit_block(row, histogram, prev_block_hash, pool_address),
+                      histogram is not None, row.block_hash)
+            prev_block_hash = row.block_hash
+        if change is not None or credit is not None:
+            events.append((change, credit))
+    return last, len(rows), events
+
+
+class PayoutEngine(object):
+    """
+    Credits pool work for every block in the ledger, resuming from the
+    checkpoint in the pool database.
+
+    Ledger rows are streamed in batches of `batch_size`, each batch is one
+    transaction which also moves the checkpoint. The checkpoint only ever
+    points at the end of a whole block, rows of a block the batch ended in
+    the middle of are processed again by the next batch or run.
+    """
+    def __init__(self, pooldb, ledger, pool_address, journal=None, batch_size=10000):
+        self.pooldb = pooldb
+        self.ledger = ledger
+        self.pool_address = pool_address
+        self.journal = journal
+        self.batch_size = batch_size
+        self.address_ids = dict()
+        self.shares = ShareLoader(pool_address, journal)
+        self._workproofs = dict()
+        self._blocks = OrderedDict()
+        self.pooldb.executescript(SCHEMA)
+        self.height, self.prev_block_hash, self.pool_balance, self.pool_shmeckles = self.checkpoint()
+        if self._stats_missing():
+            self.rebuild_stats()
+
+    def checkpoint(self):
+        row = self.pooldb.execute("""
+            SELECT height, block_hash, pool_balance, pool_shmeckles FROM checkpoint WHERE id = 0
+        """).fetchone()
+        if row is None:
+            return FIRST_HEIGHT, None, 0, 0
+        return row
+
+    def _stats_missing(self):
+        """
+        Workproof from before the rolled up tables existed
+        """
+        return (self.pooldb.execute("SELECT 1 FROM workproof LIMIT 1").fetchone() is not None and
+                self.pooldb.execute("SELECT 1 FROM address_totals LIMIT 1").fetchone() is None)
+
+    def rebuild_stats(self):
+        """
+        Roll up `address_hours` and `address_totals` from all of workproof
+        """
+        self.pooldb.execute("DELETE FROM address_hours")
+        self.pooldb.execute("DELETE FROM address_totals")
+        self.pooldb.execute("""
+            INSERT INTO address_hours
+            SELECT w.address_id, CAST(b.stamp AS INTEGER) / 3600 * 3600 AS hour,
+                   COUNT(*), SUM(w.shares), SUM(w.workcount), SUM(w.shmeckles)
+            FROM workproof w JOIN blocks b ON b.id = w.block_id
+            GROUP BY w.address_id, hour
+        """)
+        self.pooldb.execute("""
+            INSERT INTO address_totals
+            SELECT address_id, SUM(blocks), SUM(shares), SUM(workcount), SUM(shmeckles)
+            FROM address_hours GROUP BY address_id
+        """)
+        self.pooldb.commit()
+
+    def _save_checkpoint(self, state):
+        self.pooldb.execute("REPLACE INTO checkpoint VALUES (0, ?, ?, ?, ?)", state)
+
+    def make_address_ids(self, addresses):
+        missing = [address for address in addresses if address not in self.address_ids]
+        if missing:
+            placeholders = ','.join(['?'] * len(missing))
+            sql = "SELECT address, id FROM addresses WHERE address IN (%s)" % (placeholders,)
+            self.address_ids.update(self.pooldb.execute(sql, missing).fetchall())
+            for address in missing:
+                if address not in self.address_ids:
+                    cursor = self.pooldb.execute("INSERT INTO addresses (address) VALUES (?)", (address,))
+                    self.address_ids[address] = cursor.lastrowid
+        return self.address_ids
+
+    def run(self):
+        """
+        Process every ledger row above the checkpoint, returns the number
+        of rows read
+        """
+        self.ledger.refresh()
+        transactions = self.ledger.transactions(self.height, self.ledger.top(), self.batch_size)
+        total = 0
+        # State as of the end of the last whole block
+        state = (self.height, self.prev_block_hash, self.pool_balance, self.pool_shmeckles)
+        while True:
+            rows = list(itertools.islice(transactions, self.batch_size))
+            if not rows:
+                break
+            histograms = iter(self.shares.histograms(won_blocks(rows, self.prev_block_hash)))
+            for row in rows:
+                if row.block_height != self.height:
+                    state = (self.height, self.prev_block_hash, self.pool_balance, self.pool_shmeckles)
+                    self.height = row.block_height
+                self._process(row, histograms)
+            total += len(rows)
+            self._commit(state)
+            LOG.info('Payout - processed %d rows, up to block %d', total, state[0])
+        # Everything was read, so the last block is whole too
+        self._commit((self.height, self.prev_block_hash, self.pool_balance, self.pool_shmeckles))
+        return total
+
+    def _process(self, row, histograms):
+        change = balance_change(row, self.pool_address)
+        if change is not None:
+            self.pool_balance += change
+        if row.recipient != row.address:
+            return
+        histogram = next(histograms)
+        if histogram is not None:
+            self.pool_shmeckles += 1
+        self._write_block(credit_block(row, histogram, self.prev_block_hash, self.pool_address))
+        self.prev_block_hash = row.block_hash
+
+    def _write_block(self, credit):
+        block, addresses, workproofs = credit
+        address_ids = self.make_address_ids(addresses)
+        self._workproofs[block[0]] = [(block[0], address_ids[address], shares, work_count, shmeckles)
+                                      for address, shares, work_count, shmeckles in workproofs]
+        self._blocks[block[0]] = block + (self.pool_balance, self.pool_shmeckles)
+
+    def _stats_changes(self):
+        """
+        Changes to the rolled up tables from writing the pending blocks,
+        less what was credited before for any of them
+        """
+        changes = defaultdict(lambda: [0, 0, 0, 0])
+        credited = self.pooldb.execute("""
+            SELECT w.block_id, w.address_id, b.stamp, w.shares, w.workcount, w.shmeckles
+            FROM workproof w JOIN blocks b ON b.id = w.block_id
+            WHERE w.block_id BETWEEN ? AND ?
+        """, (min(self._blocks), max(self._blocks)))
+        for block_id, address_id, stamp, shares, work_count, shmeckles in credited:
+            if block_id in self._blocks:
+                change = changes[address_id, stamp_hour(stamp)]
+                change[0] -= 1
+                change[1] -= shares
+                change[2] -= work_count
+                change[3] -= shmeckles
+        for block_id, workproofs in self._workproofs.items():
+            hour = stamp_hour(self._blocks[block_id][1])
+            for _, address_id, shares, work_count, shmeckles in workproofs:
+                change = changes[address_id, hour]
+                change[0] += 1
+                change[1] += shares
+                change[2] += work_count
+                change[3] += shmeckles
+        return changes
+
+    def _update_stats(self, changes):
+        hours = [(address_id, hour) for address_id, hour in changes]
+        self.pooldb.executemany("INSERT OR IGNORE INTO address_hours (address_id, hour) VALUES (?, ?)", hours)
+        self.pooldb.executemany("""
+            UPDATE address_hours SET blocks = blocks + ?, shares = shares + ?, workcount = workcount + ?,
+                                     shmeckles = shmeckles + ?
+            WHERE address_id = ? AND hour = ?
+        """, [tuple(change) + key for key, change in changes.items()])
+        totals = defaultdict(lambda: [0, 0, 0, 0])
+        for (address_id, _), change in changes.items():
+            total = totals[address_id]
+            for N in range(4):
+                total[N] += change[N]
+        self.pooldb.executemany("INSERT OR IGNORE INTO address_totals (address_id) VALUES (?)",
+                                [(address_id,) for address_id in totals])
+        self.pooldb.executemany("""
+            UPDATE address_totals SET blocks = blocks + ?, shares = shares + ?, workcount = workcount + ?,
+                                      shmeckles = shmeckles + ?
+            WHERE address_id = ?
+        """, [tuple(total) + (address_id,) for address_id, total in totals.items()])
+
+    def _commit(self, state):
+        """
+        Write the blocks credited since the last commit, their rolled up
+        statistics and the checkpoint. Blocks credited again, by a run
+        resuming part way through a block, replace what they had before.
+        """
+        if self._blocks:
+            self._update_stats(self._stats_changes())
+            self.pooldb.executemany("DELETE FROM workproof WHERE block_id = ?",
+                                    [(block_id,) for block_id in self._blocks])
+            self.pooldb.executemany("INSERT INTO workproof VALUES (?, ?, ?, ?, ?)",
+                                    [row for rows in self._workproofs.values() for row in rows])
+            self.pooldb.executemany("""
+            REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, list(self._blocks.values()))
+        self._workproofs = dict()
+        self._blocks = OrderedDict()
+        self._save_checkpoint(state)
+        self.pooldb.commit()
+
+    def _chunks(self, top, chunk_blocks):
+        """
+        Height ranges of `chunk_blocks`, with the hash of the last block won
+        before each
+        """
+        chunks = list()
+        first = self.height
+        first_prev = prev_block_hash = self.prev_block_hash
+        cursor = self.ledger.connection().execute("""
+            SELECT block_height, block_hash FROM transactions
+            WHERE block_height > ? AND address = recipient ORDER BY block_height, rowid
+        """, (self.height,))
+        for height, block_hash in cursor:
+            while height > first + chunk_blocks:
+                chunks.append((first, first + chunk_blocks, first_prev))
+                first += chunk_blocks
+                first_prev = prev_block_hash
+            prev_block_hash = block_hash
+        while first < top:
+            chunks.append((first, min(first + chunk_blocks, top), first_prev))
+            first += chunk_blocks
+            first_prev = prev_block_hash
+        return chunks
+
+    def backfill(self, journal_path=None, processes=None, chunk_blocks=1000, progress=None):
+        """
+        Same as `run`, with blocks credited by a pool of `processes`, one
+        range of `chunk_blocks` heights at a time. Don't use a pool once
+        gevent has monkey patched threading, it hangs. Only the running pool
+        balance and shmeckles are added up here, in order, and written
+        with each chunk. `progress` is called after every chunk with the
+        number of chunks done, the number of chunks and rows read so far.
+        """
+        self.ledger.refresh()
+        top = self.ledger.top()
+        if top is None or top <= self.height:
+            return 0
+        chunks = self._chunks(top, chunk_blocks)
+        total = 0
+        initargs = (self.ledger.path, self.ledger.index_path, journal_path, self.pool_address)
+        pool = None
+        if processes == 1:
+            # Chunks are credited in this process, nothing to fork
+            _backfill_init(*initargs)
+            results = (_backfill_chunk(chunk) for chunk in chunks)
+        else:
+            pool = multiprocessing.Pool(processes, _backfill_init, initargs)
+            results = pool.imap(_backfill_chunk, chunks)
+        try:
+            for N, (last, count, events) in enumerate(results):
+                for change, credit in events:
+                    if change is not None:
+                        self.pool_balance += change
+                    if credit is not None:
+                        credit, has_shares, block_hash = credit
+                        self.pool_shmeckles += int(has_shares)
+                        self._write_block(credit)
+                        self.prev_block_hash = block_hash
+                self.height = last
+                total += count
+                self._commit((self.height, self.prev_block_hash, self.pool_balance, self.pool_shmeckles))
+                if progress is not None:
+                    progress(N + 1, len(chunks), total)
+        finally:
+            if pool is None:
+                _backfill_close()
+            else:
+                pool.terminate()
+                pool.join()
+        return total
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='PooledBismuth payout calculator')
+    parser.add_argument('-v', '--verbose', action='store_const',
+                        dest="loglevel", const=LOG.INFO, default=LOG.WARNING,
+                        help="Log informational messages")
+    parser.add_argument('--keyfile', default='.bismuth.key', help="Pool secret identity", metavar='PATH')
+    parser.add_argument('-l', '--ledger', help="Bismuth ledger database path", default='../Bismuth/static/ledger.db', metavar='PATH')
+    parser.add_argument('--ledger-index', dest='ledger_index', default='data/ledger-index.db', metavar='PATH',
+                        help="Side index for ledgers without one on block height")
+    parser.add_argument('--pool-db', dest='pool_db', default='data/pool.db', metavar='PATH', help="Pool database path")
+    parser.add_argument('--journal', default='data/journal', metavar='PATH', help="Share journal directory")
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=10000, metavar='N',
+                        help="Ledger rows per transaction")
+    parser.add_argument('--backfill', action='store_true',
+                        help="Credit blocks in parallel, to rebuild the pool database")
+    parser.add_argument('-j', '--processes', type=int, metavar='N',
+                        help="Backfill processes (default: one per CPU)")
+    parser.add_argument('--chunk-blocks', dest='chunk_blocks', type=int, default=1000, metavar='N',
+                        help="Backfill blocks per chunk")
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help="Write dashboard JSON snapshots to this directory afterwards")
+    parser.add_argument('--snapshot-hours', dest='snapshot_hours', type=int, default=24, metavar='N',
+                        help="Hours of pool statistics in the snapshot")
+    cfg = parser.parse_args()
+    LOG.basicConfig(level=cfg.loglevel)
+    return cfg
+
+
+def main():
+    cfg = parse_args()
+    myid = Identity(cfg.keyfile)
+
+    pooldb = sqlite3.connect(cfg.pool_db)
+    pooldb.text_factory = str
+    ledger = open_ledger(cfg.ledger, cfg.ledger_index)
+    journal = JournalReader(cfg.journal) if os.path.exists(os.path.join(cfg.journal, 'shares')) else None
+
+    engine = PayoutEngine(pooldb, ledger, myid.address, journal, cfg.batch_size)
+    if cfg.backfill:
+        begin = time.time()
+
+        def progress(done, chunks, rows):
+            print("Backfill - %d/%d chunks, up to block %d, %d rows, %.0f rows/s" % (
+                  done, chunks, engine.height, rows, rows / max(time.time() - begin, 0.001)), file=sys.stderr)
+        total = engine.backfill(cfg.journal if journal is not None else None,
+                                cfg.processes, cfg.chunk_blocks, progress)
+    else:
+        total = engine.run()
+    print("Processed %d ledger rows, up to block %d" % (total, engine.height))
+    if cfg.snapshot:
+        written = Snapshot(pooldb, cfg.snapshot, cfg.snapshot_hours).write()
+        print("Wrote %d address shards to %s" % (written, cfg.snapshot))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+from __future__ import print_function
+import os
+import json
+import time
+import logging as LOG
+from random import shuffle
+
+from .common import IpPort, Abuse, write_json
+
+
+# Connections kept open, to the best scoring peers
+PEER_TARGET = 10
+# Most new connections started at once
+CONNECT_BATCH = 4
+# A failing peer is retried after 30 seconds, doubling up to 6 hours
+BACKOFF_BASE = 30
+BACKOFF_MAX = 6 * 3600
+# Connections dropped sooner than this count as failures
+STABLE_TIME = 60
+# Weight of each new measurement in the running averages
+SMOOTHING = 0.2
+# Uptime is worth up to a minute of score, once a peer has been up a day
+UPTIME_CAP = 24 * 3600
+UPTIME_WORTH = 60.0
+# Score lost for each block behind the highest, about one block time
+BEHIND_COST = 60.0
+# Until measured, a peer is assumed to be middling
+PRIOR = dict(latency=1.0, lead=5.0, behind=0.1)
+# Peers heard of from other peers are only remembered up to this many
+MAX_KNOWN = 1000
+# The worst connected peer is swapped for a better one at most this often
+ROTATE_INTERVAL = 300
+SAVE_INTERVAL = 60
+
+
+def ewma(average, value):
+    if average is None:
+        return float(value)
+    return average + SMOOTHING * (value - average)
+
+
+class PeerScore(object):
+    """
+    What is known of one peer across connections: the handshake round
+    trip, how long after the first peer it announces new blocks, how many
+    blocks it runs behind the highest, and how long it stays connected.
+    """
+    FIELDS = ('latency', 'lead', 'behind', 'uptime', 'sessions', 'failures', 'retry_at')
+
+    def __init__(self, latency=None, lead=None, behind=None, uptime=0.0, sessions=0, failures=0, retry_at=0):
+        self.latency = latency
+        self.lead = lead
+        self.behind = behind
+        self.uptime = uptime
+        self.sessions = sessions
+        self.failures = failures
+        self.retry_at = retry_at
+
+    def __repr__(self):
+        return "PeerScore(%s)" % (', '.join(['%s=%r' % (name, getattr(self, name)) for name in self.FIELDS]),)
+
+    def to_dict(self):
+        return dict([(name, getattr(self, name)) for name in self.FIELDS])
+
+    def _measured(self, name):
+        value = getattr(self, name)
+        return PRIOR[name] if value is None else value
+
+    def score(self):
+        """
+        Higher is better, roughly in seconds: the time lost to round trips,
+        late announcements and lagging behind, less a little for uptime
+        """
+        uptime = UPTIME_WORTH * min(self.uptime, UPTIME_CAP) / UPTIME_CAP
+        return (uptime - self._measured('latency') - self._measured('lead')
+                - BEHIND_COST * self._measured('behind'))
+
+
+class PeerBook(object):
+    """
+    Scores of every peer heard of, which `plan` uses to pick connections:
+    enough of the best scoring peers to make `target`, passing over those
+    backed off after failing. Scores are kept in `path` across restarts.
+    """
+    def __init__(self, path=None, target=PEER_TARGET):
+        self.path = path
+        self.target = target
+        self.scores = dict()
+        # Connect time of each connected peer, and peers being connected to
+        self.sessions = dict()
+        self.pending = set()
+        self._rotated = time.time()
+        self._saved = time.time()
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.scores)
+
+    @staticmethod
+    def key(peer):
+        return IpPort(str(peer[0]), int(peer[1]))
+
+    def get(self, peer):
+        peer = self.key(peer)
+        score = self.scores.get(peer)
+        if score is None:
+            score = self.scores[peer] = PeerScore()
+        return score
+
+    def load(self):
+        with open(self.path) as handle:
+            data = json.load(handle)
+        for name, row in data.items():
+            ip, port = name.rsplit(':', 1)
+            self.scores[self.key((ip, port))] = PeerScore(**dict([(str(field), value) for field, value in row.items()]))
+        LOG.info('Peers %r - loaded %d scores', self.path, len(data))
+
+    def save(self, now=None):
+        self._saved = time.time() if now is None else now
+        if self.path:
+            write_json(self.path, dict([('%s:%d' % peer, score.to_dict()) for peer, score in self.scores.items()]))
+
+    def save_due(self, now=None):
+        if now is None:
+            now = time.time()
+        if now - self._saved >= SAVE_INTERVAL:
+            try:
+                self.save(now)
+            except Exception:
+                LOG.exception('Peers %r - failed to save scores', self.path)
+
+    def discover(self, peers):
+        """
+        Remember peers we were told of, up to `MAX_KNOWN`
+        """
+        for peer in peers:
+            if len(self.scores) >= MAX_KNOWN:
+                break
+            self.get(peer)
+
+    def attempt(self, peer):
+        self.pending.add(self.key(peer))
+
+    def connected(self, peer, latency=None, now=None):
+        peer = self.key(peer)
+        score = self.get(peer)
+        self.pending.discard(peer)
+        self.sessions[peer] = time.time() if now is None else now
+        score.sessions += 1
+        if latency is not None:
+            score.latency = ewma(score.latency, latency)
+
+    def closed(self, peer, now=None):
+        """
+        The connection to `peer` has ended, or never got going. Failures
+        and short lived connections back the peer off, twice as long each
+        time in a row.
+        """
+        if now is None:
+            now = time.time()
+        peer = self.key(peer)
+        score = self.get(peer)
+        self.pending.discard(peer)
+        started = self.sessions.pop(peer, None)
+        if started is not None:
+            score.uptime += max(now - started, 0)
+            if now - started >= STABLE_TIME:
+                score.failures = 0
+                score.retry_at = 0
+                return
+        score.failures += 1
+        score.retry_at = now + min(BACKOFF_BASE * 2 ** (score.failures - 1), BACKOFF_MAX)
+
+    def announced(self, peer, delay):
+        """
+        `peer` told us of a new block `delay` seconds after the first peer did
+        """
+        score = self.get(peer)
+        score.lead = ewma(score.lead, max(delay, 0))
+
+    def sample_behind(self, peer, blocks):
+        score = self.get(peer)
+        score.behind = ewma(score.behind, blocks)
+
+    def candidates(self, now=None):
+        """
+        Peers which could be connected to now, best first, peers scoring
+        the same in any order
+        """
+        if now is None:
+            now = time.time()
+        peers = [peer for peer, score in self.scores.items()
+                 if score.retry_at <= now and peer not in self.sessions and peer not in self.pending
+                 and not Abuse.blocked(peer)]
+        shuffle(peers)
+        peers.sort(key=lambda peer: self.scores[peer].score(), reverse=True)
+        return peers
+
+    def plan(self, now=None):
+        """
+        Peers to connect to, and a connected peer to drop or None: enough
+        new peers to make up `target`, or when there are already enough,
+        now and then the worst connected peer for a better one
+        """
+        if now is None:
+            now = time.time()
+        wanted = self.target - len(self.sessions) - len(self.pending)
+        if wanted > 0:
+            return self.candidates(now)[:min(wanted, CONNECT_BATCH)], None
+        if wanted < 0 or now - self._rotated < ROTATE_INTERVAL:
+            return [], None
+        self._rotated = now
+        # Dropping a peer this new would count as a failure
+        settled = [peer for peer, started in self.sessions.items() if now - started >= STABLE_TIME]
+        candidates = self.candidates(now)
+        if not settled or not candidates:
+            return [], None
+        worst = min(settled, key=lambda peer: self.scores[peer].score())
+        if self.scores[candidates[0]].score() <= self.scores[worst].score():
+            return [], None
+        return candidates[:1], worst
@@ -1,49 +1,153 @@
 #!/usr/bin/env python
 from __future__ import print_function
 
-from gevent import monkey, spawn
+from gevent import monkey, spawn, get_hub, Timeout
 monkey.patch_all()
 from gevent.pool import Pool
+from gevent.lock import Semaphore
 from gevent.socket import wait_read
 from gevent.server import StreamServer
 
 import os
 import re
-import ast
 import time
-import json
+import heapq
+import errno
 import string
 import socket
 import hashlib
 import threading
 import logging as LOG
 from random import shuffle
-from collections import defaultdict
+from collections import defaultdict, deque
 
 from Crypto.Hash import SHA
 
-from .common import Abuse, IpPort, ProtocolBase, MinerResult, Identity, calc_diff, ConsensusBlock
-from .common import POOL_PORT, MINER_TUNE_GOAL, MINER_TUNE_HISTORY, MINER_VERSION_ROOT, PROTO_VERSION, CONNECT_TIMEOUT, LOWEST_DIFFICULTY
+from .common import Abuse, IpPort, ProtocolBase, MinerResult, Identity, ConsensusBlock, JobTemplate, encode_frames
+from .common import RECV_BUFSIZE, POOL_PORT, MINER_VERSION_ROOT, PROTO_VERSION, CONNECT_TIMEOUT, LOWEST_DIFFICULTY
+from .common import MAX_FRAME, frame_size
+from .vardiff import EwmaVarDiff
+from .hashrate import HashrateEstimator
+from .journal import JournalWriter, NONCE_SIZE
+from .nonces import NonceIndex
+from .blockstore import BlockStore, DifficultyTracker
+from .literal import iter_list
+from .peerbook import PeerBook
 from . import bismuth
 
 
+def reuseport_listener(bind, backlog=1024):
+    """
+    Listening socket which several processes can bind to at once
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(bind)
+    sock.listen(backlog)
+    sock.setblocking(0)
+    return sock
+
+
 # TODO: when there is no consensus, or we're behind ..
 #   run server.stop_accepting or server.start_accepting
 class Miners(object):
-    def __init__(self, peers, bind=None, max_conns=5000):
+    def __init__(self, peers, bind=None, max_conns=5000, verifier=None, results=None, reuse_port=False,
+                 vardiff=EwmaVarDiff):
         if bind is None:
             bind = ('127.0.0.1', POOL_PORT)
         elif isinstance(bind, str):
             bind = bind.split(':')
             bind[1] = int(bind[1])
         self.peers = peers
+        self.verifier = verifier
+        self.results = results if results is not None else ResultsManager
+        self.vardiff = vardiff
+        self.hashrate = HashrateEstimator()
+        self.max_conns = max_conns
+        self._job = None
+        self.subscribers = set()
+        self.accepted = 0
+        self.stale = 0
+        self.duplicates = 0
         self.pool = Pool(max_conns)
-        self.server = StreamServer(tuple(bind), self._on_connect, spawn=self.pool)
+        listener = reuseport_listener(tuple(bind)) if reuse_port else tuple(bind)
+        self.server = self._listen(listener)
         self.server.start()
+        self.results.listen(self._on_consensus)
+
+    def _listen(self, listener):
+        return StreamServer(listener, self._on_connect, spawn=self.pool)
+
+    def job(self):
+        """
+        Job for the current consensus block, or None if there isn't one.
+        Only rebuilt when the consensus block changes.
+        """
+        top = self.peers.top()
+        if top is None:
+            return None
+        job = self._job
+        if job is None or job.block_hash != top[0].hash:
+            job = self._job = JobTemplate(self.peers.identity.address, top[0].hash)
+        return job
+
+    def connections(self):
+        return len(self.pool)
+
+    def status(self):
+        total = self.accepted + self.stale
+        status = dict(
+            miners=self.connections(),
+            push=len(self.subscribers),
+            accepted=self.accepted,
+            stale=self.stale,
+            stale_rate=(self.stale / float(total)) if total else 0.0,
+            duplicates=self.duplicates,
+        )
+        status.update(self.hashrate.status())
+        return status
+
+    def _on_consensus(self, consensus):
+        spawn(self.push_jobs)
+
+    def push_jobs(self):
+        """
+        Send the current job to every miner which negotiated push, so they
+        stop working on the previous block straight away. Each push has its
+        own greenlet, a miner which stops reading only holds up itself.
+        """
+        job = self.job()
+        if job is None:
+            return
+        for miner in list(self.subscribers):
+            spawn(self._push, miner, job)
+
+    def _push(self, miner, job):
+        try:
+            with Timeout(PUSH_TIMEOUT):
+                miner.push(job)
+        except (Exception, Timeout) as ex:
+            LOG.warning('Miner %r - Push failed: %r', miner.sockaddr, ex)
+            miner.close()
+
+    def _duplicate(self, result, miner):
+        self.duplicates += 1
+        Abuse.strike(miner.sockaddr)
+        if Abuse.blocked(miner.sockaddr):
+            miner.close()
+        LOG.warning('Miner %r - Duplicate share %r', miner.sockaddr, result)
+        return False
 
     def on_found(self, result, miner):
+        # Replayed shares are turned away before paying for verification
+        if self.results.is_duplicate(result):
+            return self._duplicate(result, miner)
         # Ensure that the work delivered is exactly what was requested
-        valid = bismuth.verify(result.address, result.nonce, result.block, result.diff)
+        if self.verifier:
+            valid = self.verifier.verify(result)
+        else:
+            valid = bismuth.verify(result.address, result.nonce, result.block, result.diff)
         if not valid:
             Abuse.strike(miner.sockaddr)
             if Abuse.blocked(miner.sockaddr):
@@ -53,11 +157,22 @@ class Miners(object):
         # The miner will not be punished for providing
         # training blocks which don't match the right
         # hash... but they won't be rewarded for the work
-        return ResultsManager.on_result(result, miner)
+        accepted = self.results.on_result(result, miner)
+        if accepted:
+            self.accepted += 1
+        elif self.results.is_duplicate(result):
+            # Copies verified together, the first was accepted
+            return self._duplicate(result, miner)
+        else:
+            self.stale += 1
+        return accepted
 
     def stop(self):
+        self.results.unlisten(self._on_consensus)
         self.server.stop()
         self.pool.kill()
+        if self.verifier:
+            self.verifier.stop()
 
     def _on_connect(self, socket, address):
         peer = IpPort(*address)
@@ -69,59 +184,70 @@ class Miners(object):
         client.run()
 
 
-# Don't allow client to submit same block twice
-# Verify that clients don't submit each others blocks
+# Unprompted job from the pool, followed by the job fields
+PUSH_FRAME = encode_frames('miner_job')
+# Seconds a miner has to take a pushed job before it is dropped
+PUSH_TIMEOUT = 5
+
+
 # Verify that the block difficulty matches or is above that set by this code (the pool)
 class MinerServer(ProtocolBase):
     def __init__(self, sock, manager):
         super(MinerServer, self).__init__(sock, manager)
         self._reward_address = None
-        self._history = []
+        self._vardiff = manager.vardiff()
         self._diff = None
-        self._last_found = None
+        self._push = False
+        self._busy = False
+        # Pushes and replies are written whole, one at a time
+        self._writing = Semaphore()
 
     def __repr__(self):
         return "Miner(%r)" % (self.sockaddr,)
 
+    def _send(self, *args):
+        LOG.debug('%r - sent: %r', self, args)
+        self._send_frames(encode_frames(*args))
+
+    def _send_frames(self, data):
+        with self._writing:
+            if not self.sock:
+                raise socket.error('Miner %r - connection closed' % (self.sockaddr,))
+            self.sock.sendall(data)
+
     def close(self):
+        self.manager.subscribers.discard(self)
+        self.manager.hashrate.forget(self)
         if self.sock:
             self.sock.close()
             self.sock = None
 
+    def push(self, job):
+        """
+        Send a new job unprompted. Miners in the middle of a command are
+        skipped, their reply will carry the new job.
+        """
+        if self._push and self.sock and not self._busy and self._diff is not None:
+            self._send_frames(PUSH_FRAME + job.frames(int(self._diff)))
+
     @property
     def address(self):
         return self._reward_address
 
+    @property
+    def diff(self):
+        """Difficulty the miner is asked to work at, None until tuned"""
+        return self._diff
+
     def _tune(self):
-        # Fine-tune the difficulty so the miner finds at least 1 block every N seconds
-        # Use a rolling history of block find times to get the average difficulty
+        # Retarget the difficulty so the miner finds a share every MINER_TUNE_GOAL seconds
+        # but never ask for more than one above the highest share of this block
         peers_diff = self.manager.peers.difficulty()
         if peers_diff is None:
             print('No peer diff')
             return False
-        hist_time = defaultdict(int)
-        hist_count = defaultdict(int)
-        for diff, duration in self._history:
-            hist_time[diff] += duration
-            hist_count[diff] += 1.0
-        ideal_diff = self._diff if self._diff is not None else 40
-        best_time = 0
-        for diff, total_time in hist_time.items():
-            avg_time = total_time / hist_count[diff]
-            if avg_time > best_time and avg_time < MINER_TUNE_GOAL:
-                best_time = avg_time
-                ideal_diff = diff
-        if best_time > MINER_TUNE_GOAL:
-            ideal_diff -= 1
-        else:
-            if self._last_found > (time.time() - MINER_TUNE_GOAL):
-                ideal_diff += 0.5
-        #
-        our_height = ResultsManager.highest_difficulty()
-        self._diff = min([our_height + 1, sum([peers_diff, ideal_diff]) / 2])
-        # Trim history
-        if len(self._history) > MINER_TUNE_HISTORY:
-            self._history = self._history[0 - MINER_TUNE_HISTORY:]
+        our_height = self.manager.results.highest_difficulty()
+        self._diff = min([our_height + 1, self._vardiff.retarget(peers_diff)])
 
     def _cmd_sendsync(self):
         # They've mistaken us for a regular node, no a pool
@@ -140,25 +266,33 @@ class MinerServer(ProtocolBase):
         if len(rewards) == 56 and is_hex:
             self._reward_address = rewards
         LOG.info('Client connected: version="%r" address="%r"', version, self._reward_address)
+        # Miners which understand pushed jobs say so in their version string
+        if 'push' in version[1:]:
+            self._push = True
+            self.manager.subscribers.add(self)
+            return self._send('ok.push')
         self._send('ok')
 
     def _cmd_miner_fetch(self):
         if self._diff is None:
             self._tune()
             return self._send('wait')
+        # Quiet miners are retargeted down when they come back for work
+        self._tune()
         LOG.info('%r - Fetch Job', self)
-        peers = self.manager.peers
-        consensus = peers.consensus()
-        if len(consensus):
-            self._send(int(self._diff), peers.identity.address, consensus[0][0][1])
+        job = self.manager.job()
+        if job is not None:
+            self._send_frames(job.frames(int(self._diff)))
         else:
             # Send training data when there is no consensus
-            self._send(int(self._diff), peers.identity.address, os.urandom(28).encode('hex'))
+            self._send(int(self._diff), self.manager.peers.identity.address, os.urandom(28).encode('hex'))
 
     def _cmd_miner_exch(self):
-        items = None
+        # A broken frame ends the connection, only bad values are let off
+        items = (self._recv(), self._recv(), self._recv())
         try:
-            items = (self._recv(), self._recv(), self._recv())
+            if len(items[2]) > NONCE_SIZE:
+                raise ValueError('Nonce too long')
             result = MinerResult(int(items[0]), self.manager.peers.identity.address, items[1], items[2])
         except Exception as ex:
             LOG.exception("Miner %r - Rejecting Items: %r - %r", self.sockaddr, items, ex)
@@ -166,31 +300,35 @@ class MinerServer(ProtocolBase):
             return self._cmd_miner_fetch()  # wat u send, thafuq?
         if result:
             if self.manager.on_found(result, self):
-                if self._last_found is not None:
-                    mine_duration = time.time() - self._last_found
-                    self._history.append((self._diff, mine_duration))
-                self._last_found = time.time()
-            # Finally, re-calculate the diff rate etc...
-            self._tune()
+                self._vardiff.on_share(self._diff)
+                self.manager.hashrate.on_share(self, self.address, self._diff)
+        # Fetch re-calculates the diff rate etc...
         return self._cmd_miner_fetch()
 
     def _cmd_status(self):
-        self._send(str(self.manager.status()))
+        status = self.manager.status()
+        status['miner_hashrate'] = self.manager.hashrate.rate(miner=self)
+        if self.address:
+            status['address_hashrate'] = self.manager.hashrate.rate(address=self.address)
+        self._send(str(status))
 
     def run(self):
         try:
             while self.sock:
-                try:
-                    wait_read(self.sock.fileno(), timeout=10)
-                except socket.timeout:
-                    continue
+                if not self._pending():
+                    try:
+                        wait_read(self.sock.fileno(), timeout=10)
+                    except socket.timeout:
+                        continue
                 cmd_name = self._recv()
                 if not cmd_name:
                     break
                 cmd_func = getattr(self, '_cmd_' + cmd_name, None)
                 if not cmd_func:
                     raise RuntimeError('Miner %r - Unknown CMD: %r' % (self.sockaddr, cmd_name))
+                self._busy = True
                 cmd_func()
+                self._busy = False
         except Exception as ex:
             LOG.exception("Miner %r - Error running: %r", self.sockaddr, ex)
             Abuse.strike(self.sockaddr)
@@ -198,24 +336,168 @@ class MinerServer(ProtocolBase):
             self.close()
 
 
+class EventMiners(Miners):
+    """
+    Miner front-end without a greenlet per connection: sockets are watched
+    by read callbacks on the hub, frames are parsed incrementally, and a
+    short-lived greenlet only runs while a complete command is handled.
+    """
+    def __init__(self, peers, bind=None, max_conns=5000, verifier=None, results=None, reuse_port=False,
+                 vardiff=EwmaVarDiff):
+        self.clients = set()
+        super(EventMiners, self).__init__(peers, bind, max_conns, verifier, results, reuse_port, vardiff)
+
+    def _listen(self, listener):
+        # spawn=None: accept callbacks run directly on the hub
+        return StreamServer(listener, self._on_connect, spawn=None)
+
+    def connections(self):
+        return len(self.clients)
+
+    def stop(self):
+        self.results.unlisten(self._on_consensus)
+        self.server.stop()
+        for client in list(self.clients):
+            client.close()
+        if self.verifier:
+            self.verifier.stop()
+
+    def _on_connect(self, socket, address):
+        peer = IpPort(*address)
+        if Abuse.blocked(peer) or len(self.clients) >= self.max_conns:
+            LOG.debug('Miner %r - accept() blocked: abuse or full', address)
+            socket.close()
+            return
+        # The server closes its socket when this returns, keep our own
+        self.clients.add(EventMinerServer(socket.dup(), self))
+
+
+class EventMinerServer(MinerServer):
+    # Number of argument frames following each command
+    ARITY = dict(version=2, miner_fetch=0, miner_exch=3, status=0, sendsync=0)
+    # Most received data held while a command is being handled, frames and
+    # their prefixes together
+    MAX_QUEUED = MAX_FRAME
+
+    def __init__(self, sock, manager):
+        super(EventMinerServer, self).__init__(sock, manager)
+        self._frames = deque()
+        self._queued = 0
+        self._greenlet = None
+        self._watcher = get_hub().loop.io(sock.fileno(), 1)
+        self._watcher.start(self._on_readable)
+
+    def close(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+        self.manager.clients.discard(self)
+        super(EventMinerServer, self).close()
+
+    def _recv(self, datalen=10):
+        # Command arguments have already been parsed into frames
+        frame = self._frames.popleft()
+        self._queued -= 10 + len(frame)
+        return frame
+
+    def _next_frame(self):
+        """Parse the next complete frame from the receive buffer, or None"""
+        buf, pos = self._rbuf, self._rpos
+        if len(buf) - pos < 10:
+            return None
+        end = pos + 10 + frame_size(bytes(buf[pos:pos + 10]), self.MAX_FRAME)
+        if len(buf) < end:
+            return None
+        self._rpos = end
+        return bytes(buf[pos + 10:end])
+
+    def _on_readable(self):
+        try:
+            try:
+                # The watcher said it's readable, so the real socket won't block
+                chunk = self.sock._sock.recv(RECV_BUFSIZE)
+            except socket.error as ex:
+                if ex.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
+                    return
+                raise
+            if not chunk:
+                return self.close()
+            if self._rpos:
+                del self._rbuf[:self._rpos]
+                self._rpos = 0
+            self._rbuf += chunk
+            while True:
+                frame = self._next_frame()
+                if frame is None:
+                    break
+                self._frames.append(frame)
+                self._queued += 10 + len(frame)
+            # Left over is at most one partial frame, while a slow command
+            # could let whole frames pile up
+            if self._queued > self.MAX_QUEUED or len(self._rbuf) - self._rpos > self.MAX_FRAME + 10:
+                raise ValueError('Miner %r - too much data queued' % (self.sockaddr,))
+            self._dispatch()
+        except Exception as ex:
+            LOG.exception("Miner %r - Error reading: %r", self.sockaddr, ex)
+            Abuse.strike(self.sockaddr)
+            self.close()
+
+    def _dispatch(self):
+        # Commands from one miner are handled in order, one at a time
+        if self._greenlet is not None or not self._frames or not self.sock:
+            return
+        cmd_name = self._frames[0]
+        arity = self.ARITY.get(cmd_name)
+        if arity is None:
+            LOG.warning('Miner %r - Unknown CMD: %r', self.sockaddr, cmd_name)
+            Abuse.strike(self.sockaddr)
+            return self.close()
+        if len(self._frames) > arity:
+            self._recv()
+            self._busy = True
+            self._greenlet = spawn(self._run_command, getattr(self, '_cmd_' + cmd_name))
+
+    def _run_command(self, cmd_func):
+        try:
+            cmd_func()
+        except Exception as ex:
+            LOG.exception("Miner %r - Error running: %r", self.sockaddr, ex)
+            Abuse.strike(self.sockaddr)
+            self.close()
+        self._greenlet = None
+        self._busy = False
+        self._dispatch()
+
+    def run(self):
+        raise RuntimeError('EventMinerServer is driven by the hub, not run()')
+
+
 class BismuthClient(ProtocolBase):
+    # Nodes send blocks for sync in one frame
+    MAX_FRAME = 64 * MAX_FRAME
+
     def __init__(self, sock, manager):
         super(BismuthClient, self).__init__(sock, manager)
 
         toplist = manager.consensus()
         if not len(toplist):
             raise RuntimeError('Invalid state - no consensus')
-        self.blocks = [
-            (row[0].height, row[0].hash, None, row[0].stamp)
+        self.blocks = manager.store.ring([
+            manager.store.intern(row[0].height, row[0].hash, row[0].stamp)
             for row in reversed(toplist)
-        ]
+        ])
 
         assert len(self.blocks) > 0
-        self.blockheight = self.blocks[-1][0]
-        self.blockhash = self.blocks[-1][1]
+        # Follows self.blocks, None until it's needed or after a rollback
+        self._window = None
+        self.blockheight = self.blocks[-1].height
+        self.blockhash = self.blocks[-1].hash
         self.their_blockheight = 0
         self.their_blockhash = ''
         self.peers = None
+        # Handshake round trip, and when the connection was made
+        self.latency = None
+        self.connected_at = time.time()
 
     def __repr__(self):
         return "BismuthClient(%r)" % (self.sockaddr,)
@@ -223,21 +505,10 @@ class BismuthClient(ProtocolBase):
     @property
     def difficulty(self):
         if len(self.blocks):
-            newest_block = self.blocks[-1]
-            if newest_block[2] is not None:
-                latest_block_time = float(max([X[0] for X in newest_block[2]]))
-            else:
-                latest_block_time = float(self.blocks[-1][3])
-            assert latest_block_time > 0
-            latest_time = float(latest_block_time)
-            now = time.time()
-            return calc_diff(self.blocks, now, latest_time)
-
-    def _trim_blocks(self):
-        # Remove unnecessary blocks
-        # TODO: pop off end of list, by time, ensure 30 mins
-        if len(self.blocks) > 120:
-            self.blocks = self.blocks[-120:]
+            if self._window is None:
+                self._window = self.manager.difficulty_tracker.window(self.blocks)
+            assert self._window.latest > 0
+            return self._window.difficulty(time.time())
 
     def status(self):
         if not self.sock:
@@ -261,8 +532,10 @@ class BismuthClient(ProtocolBase):
 
     def connect(self):
         try:
+            started = time.time()
             self._send("version", PROTO_VERSION)
             data = self._recv()
+            self.latency = time.time() - started
             if data != "ok":
                 raise RuntimeError("Peer %r - protocol mismatch: %r %r" % (self.sockaddr, data, PROTO_VERSION))
                 return False
@@ -279,40 +552,54 @@ class BismuthClient(ProtocolBase):
     def _cmd_peers(self):
         subdata = self._recv()
         self.peers = re.findall("'([\d\.]+)', '([\d]+)'", subdata)
-        # TODO: filter peers and stuff
+        self.manager.book.discover(self.peers)
 
-    def _cmd_blocksfnd(self):
-        self._send("blockscf")
-        block_list = ast.literal_eval(self._recv())
-        block = None
+    def _add_blocks(self, block_list):
+        """
+        Follow the chain through each transaction list in `block_list`,
+        only the shared `Block` is kept of each. Other greenlets get a turn
+        between blocks, a long sync doesn't hold up the pool.
+        """
         for transaction_list in block_list:
             # TODO: verify transactions
             self.blockhash = hashlib.sha224(str(transaction_list) + self.blockhash).hexdigest()
             self.blockheight += 1
-            block = (self.blockheight, self.blockhash, transaction_list)
 
             for txn in transaction_list:
                 assert txn[0] is not None
 
+            block = self.manager.store.add(self.blockheight, self.blockhash, transaction_list)
+            evicted = self.blocks[0] if len(self.blocks) == self.blocks.maxlen else None
             self.blocks.append(block)
+            if block.seen >= self.connected_at:
+                # New to the network since we connected, not history
+                self.manager.book.announced(self.sockaddr, time.time() - block.seen)
+            if self._window is not None:
+                self._window = self.manager.difficulty_tracker.advance(self._window, block, evicted)
             if self.blockheight == self.their_blockheight:
                 self.their_blockhash = self.blockhash
+            time.sleep(0)
 
-        self._trim_blocks()
+    def _cmd_blocksfnd(self):
+        self._send("blockscf")
+        self._add_blocks(iter_list(self._recv()))
         # XXX: speed up initial sync... instead of at other ends leisure
         #      request more sync until our expected and their actual are the same
         if self.blockheight != self.their_blockheight:
             self._send("sendsync")
+        self._vote()
 
     def _cmd_blocknf(self):
         block_hash_delete = self._recv()
         # print("XXX: Asked to delete block", block_hash_delete)
-        self.blocks = filter(lambda x: x[1] != block_hash_delete, self.blocks)
+        self.blocks = self.manager.store.ring([block for block in self.blocks if block.hash != block_hash_delete])
+        self._window = None
         if block_hash_delete in (self.blockhash, self.their_blockhash):
             if len(self.blocks):
                 # print("XXX: Deleting block:", self.blocks, block_hash_delete, self.blockhash, self.their_blockhash)
-                self.blockhash = self.blocks[-1][1]
-                self.blockheight = self.blocks[-1][0]
+                self.blockhash = self.blocks[-1].hash
+                self.blockheight = self.blocks[-1].height
+        self._vote()
 
     def _cmd_sync(self):
         self._send("blockheight", self.blockheight)
@@ -326,19 +613,33 @@ class BismuthClient(ProtocolBase):
             self.their_blockhash = self._recv()
             if self.their_blockhash != self.blockhash:
                 cut = 0
-                for N, txn in enumerate(reversed(self.blocks)):
-                    if txn[1] == self.their_blockhash:
-                        self.blockheight = self.their_blockheight = txn[0]
-                        self.blockhash = txn[1]
+                for N, block in enumerate(reversed(self.blocks)):
+                    if block.hash == self.their_blockhash:
+                        self.blockheight = self.their_blockheight = block.height
+                        self.blockhash = block.hash
                         cut = N
                         break
-                if cut:
-                    self.blocks = self.blocks[:0 - cut]
+                for _ in range(cut):
+                    self.blocks.pop()
+                self._window = None
+        self._vote()
+
+    def _vote(self):
+        """
+        Update our votes in the managers consensus index, only synched
+        peers get a say
+        """
+        blocks = dict()
+        if self.sock and self.synched:
+            for block in self.blocks:
+                blocks[block.hash] = block.consensus
+        self.manager.index.update(self.sockaddr, blocks)
 
     def close(self):
         if self.sock:
             self.sock.close()
             self.sock = None
+            self.manager.index.update(self.sockaddr, dict())
 
     @property
     def synched(self):
@@ -349,7 +650,8 @@ class BismuthClient(ProtocolBase):
         sync_last = time.time()
         while self.sock:
             try:
-                wait_read(self.sock.fileno(), timeout=sync_interval)
+                if not self._pending():
+                    wait_read(self.sock.fileno(), timeout=sync_interval)
             except socket.timeout:
                 # After initial synching, send periodic sync requests
                 now = time.time()
@@ -377,20 +679,55 @@ class ResultsManager(object):
     HEIGHTS = dict()
     BLOCK = None
     HIGHEST = 0
-    LOGHANDLE = None
-    LOGFILENAME = None
+    JOURNAL = None
     HISTORY = list()
+    LISTENERS = list()
+    # Nonces accepted on BLOCK, every miner works for the same address so
+    # a nonce is only worth anything once, whoever submits it
+    SEEN = NonceIndex()
+
+    @classmethod
+    def listen(cls, callback):
+        """
+        Call `callback(consensus)` whenever the consensus block changes
+        """
+        cls.LISTENERS.append(callback)
+
+    @classmethod
+    def unlisten(cls, callback):
+        if callback in cls.LISTENERS:
+            cls.LISTENERS.remove(callback)
+
+    @classmethod
+    def open_journal(cls, path='data/journal', batch_size=512, flush_interval=0.5, max_queue=100000):
+        """
+        Start logging accepted shares, from a background writer thread
+        """
+        cls.close_journal()
+        cls.JOURNAL = JournalWriter(path, batch_size, flush_interval, max_queue)
+        if cls.BLOCK:
+            cls.JOURNAL.begin_block(cls.BLOCK.hash)
+
+    @classmethod
+    def close_journal(cls):
+        """
+        Wait for every queued share to be written
+        """
+        if cls.JOURNAL:
+            cls.JOURNAL.stop()
+        cls.JOURNAL = None
 
     @classmethod
     def reset(cls):
+        cls.close_journal()
         cls.LOCK.acquire()
         try:
             cls.HEIGHTS = dict()
             cls.BLOCK = None
             cls.HIGHEST = 0
-            cls.LOGHANDLE = None
-            cls.LOGFILENAME = None
             cls.HISTORY = list()
+            cls.LISTENERS = list()
+            cls.SEEN.reset()
         finally:
             cls.LOCK.release()
 
@@ -459,31 +796,25 @@ class ResultsManager(object):
             cls.HEIGHTS = dict()
             cls.BLOCK = consensus
             cls.HIGHEST = 0
+            cls.SEEN.reset()
+            bismuth.NEEDLES.reset(consensus.hash)
 
-            if cls.LOGHANDLE:
-                cls.LOGHANDLE.flush()
-                cls.LOGHANDLE.close()
-                done_filename = 'data/done/%s' % (os.path.basename(cls.LOGHANDLE.name),)
-                if cls.LOGFILENAME is not None and not os.path.exists(done_filename):
-                    os.rename(cls.LOGFILENAME, done_filename)
-                else:
-                    LOG.warning('Merging block logs: %r -> %r', cls.LOGHANDLE.name, done_filename)
-                    with open(done_filename, 'a') as handle_output:
-                        with open(cls.LOGFILENAME, 'r') as handle_input:
-                            while True:
-                                data = handle_input.read(4096)
-                                if not data:
-                                    break
-                                handle_output.write(data)
-                    os.unlink(cls.LOGFILENAME)
-
-            filename = 'data/audit/%s.block' % (consensus.hash,)
-            cls.LOGHANDLE = open(filename, 'a')
-            cls.LOGFILENAME = filename
+            if cls.JOURNAL:
+                cls.JOURNAL.begin_block(consensus.hash)
             LOG.warning('New consensus: %r', consensus)
         finally:
             cls.LOCK.release()
 
+        for callback in cls.LISTENERS:
+            callback(consensus)
+
+    @classmethod
+    def is_duplicate(cls, result):
+        """
+        Was the nonce already accepted on the current block
+        """
+        return cls.BLOCK is not None and result.block == cls.BLOCK.hash and result.nonce in cls.SEEN
+
     @classmethod
     def on_result(cls, result, miner):
         if not cls.BLOCK or result.block != cls.BLOCK[1]:
@@ -492,16 +823,17 @@ class ResultsManager(object):
 
         cls.LOCK.acquire()
         try:
+            # Checked again, shares can pass `is_duplicate` together
+            if not cls.SEEN.add(result.nonce):
+                return False
             if result.diff > cls.HIGHEST:
                 cls.HIGHEST = result.diff
                 cls.HEIGHTS[int(result.diff)] = result
                 LOG.warning('New highest for %s: %d', result.block, result.diff)
-            if cls.LOGHANDLE:
-                cls.LOGHANDLE.write(json.dumps([
-                    time.time(), miner.address, int(result.diff), result.nonce
-                ]) + "\n")
         finally:
             cls.LOCK.release()
+        if cls.JOURNAL:
+            cls.JOURNAL.append(result.block, miner.address, result.diff, result.nonce)
         return True
 
     @classmethod
@@ -520,12 +852,120 @@ class ResultsManager(object):
         return block_send
 
 
+class ConsensusIndex(object):
+    """
+    Votes for every block hash from the synched peers. Each peer replaces
+    its own votes as it syncs, so reading the consensus doesn't recount
+    every block of every peer.
+
+    The block hashes at each height are kept too, with a heap of the
+    heights, so `top` doesn't sort every row.
+    """
+    def __init__(self):
+        self.votes = defaultdict(int)
+        self.blocks = dict()
+        self.voters = dict()
+        self.heights = dict()
+        # Negated heights, some may have no blocks left, see `_highest`
+        self._heap = list()
+        self._rows = None
+        self._oldest = None
+
+    def update(self, voter, blocks):
+        """
+        Replace the votes of `voter` with `blocks`, a dict of block hash to
+        ConsensusBlock. An empty dict removes the voter.
+        """
+        old = self.voters.pop(voter, None)
+        if old is None:
+            if not blocks:
+                return
+            old = dict()
+        votes = self.votes
+        for block_hash in old:
+            if block_hash not in blocks:
+                votes[block_hash] -= 1
+                if not votes[block_hash]:
+                    del votes[block_hash]
+                    self._forget(self.blocks.pop(block_hash))
+        for block_hash, block in blocks.items():
+            if block_hash not in old:
+                votes[block_hash] += 1
+            if block_hash not in self.blocks:
+                self._remember(block)
+            self.blocks[block_hash] = block
+        if blocks:
+            self.voters[voter] = blocks
+        self._rows = None
+
+    def _remember(self, block):
+        hashes = self.heights.get(block.height)
+        if hashes is None:
+            hashes = self.heights[block.height] = set()
+            heapq.heappush(self._heap, -block.height)
+        hashes.add(block.hash)
+
+    def _forget(self, block):
+        hashes = self.heights[block.height]
+        hashes.discard(block.hash)
+        if not hashes:
+            del self.heights[block.height]
+            # Heights left in the heap are dropped when they reach the top,
+            # or all at once when they outnumber the live ones
+            if len(self._heap) > 2 * len(self.heights) + 64:
+                self._heap = [-height for height in self.heights]
+                heapq.heapify(self._heap)
+
+    def _highest(self):
+        heap = self._heap
+        while heap and -heap[0] not in self.heights:
+            heapq.heappop(heap)
+        if heap:
+            return -heap[0]
+
+    def rows(self):
+        """
+        (ConsensusBlock, votes, percentage of votes) rows, highest block first
+        """
+        if self._rows is None:
+            total_peers = float(len(self.voters))
+            rows = [(block, self.votes[block_hash], (self.votes[block_hash] / total_peers) * 100.0)
+                    for block_hash, block in self.blocks.items()]
+            rows.sort(key=lambda row: (row[0].height, row[1], row[0].hash), reverse=True)
+            self._rows = rows
+            self._oldest = min([row[0].stamp for row in rows]) if len(rows) else None
+        return self._rows
+
+    def oldest(self):
+        """Oldest block timestamp of all rows"""
+        self.rows()
+        return self._oldest
+
+    def top(self):
+        """
+        First of `rows()`: the highest block, the most voted for if peers
+        differ at that height
+        """
+        height = self._highest()
+        if height is None:
+            return None
+        votes = self.votes
+        block_hash = max(self.heights[height], key=lambda block_hash: (votes[block_hash], block_hash))
+        return (self.blocks[block_hash], votes[block_hash], (votes[block_hash] / float(len(self.voters))) * 100.0)
+
+
 class PeerManager(object):
-    def __init__(self, identity=None):
+    def __init__(self, identity=None, book=None):
         if identity is None:
             identity = Identity()
         self.peers = dict()
+        # Scores of the peers, which of them to be connected to
+        self.book = PeerBook() if book is None else book
         self.identity = identity
+        self.index = ConsensusIndex()
+        # Blocks reported by the peers, each kept once however many have it
+        self.store = BlockStore()
+        self.difficulty_tracker = DifficultyTracker()
 
     def status(self):
         active_peers = filter(lambda x: x.synched, self.peers)
@@ -538,11 +978,44 @@ class PeerManager(object):
             block=consensus,
         )
 
+    def top(self):
+        """
+        Highest consensus row, like `consensus()[0]` without building the list
+        """
+        row = self.index.top()
+        if row is None:
+            history = ResultsManager.history_fetch(time.time() - (60*30))
+            if not len(history):
+                return None
+            row = (history[0], 0, 100)
+        if row[2] >= 50:
+            ResultsManager.on_consensus(row[0])
+        return row
+
     def add(self, peer):
         assert isinstance(peer, IpPort)
-        if peer not in self.peers and not Abuse.blocked(peer):
+        peer = self.book.key(peer)
+        if peer not in self.peers and peer not in self.book.pending and not Abuse.blocked(peer):
+            self.book.attempt(peer)
             return spawn(self._run, peer)
 
+    def maintain(self, now=None):
+        """
+        Measure how far behind the highest block each peer is, then
+        connect to or swap peers as the book plans
+        """
+        top = self.index.top()
+        if top is not None:
+            for peer, client in self.peers.items():
+                self.book.sample_behind(peer, max(top[0].height - client.blockheight, 0))
+        connect, drop = self.book.plan(now)
+        if drop is not None and drop in self.peers:
+            LOG.info('Peer %r - Dropped for a better scoring peer', drop)
+            self.peers[drop].close()
+        for peer in connect:
+            self.add(peer)
+        self.book.save_due(now)
+
     def difficulty(self):
         values = filter(None, [peer.difficulty for peer in self.peers.values()])
         if len(values):
@@ -551,6 +1024,7 @@ class PeerManager(object):
     def stop(self):
         for peer in self.peers.values():
             peer.close()
+        self.book.save()
 
     def consensus(self):
         """
@@ -560,45 +1034,13 @@ class PeerManager(object):
           * Number of Votes
           * Percentage of votes
         """
-        total_peers = 0
-        blocks = list()
-        for peer in self.peers.values():
-            assert len(peer.blocks) > 0
-            if not peer.synched:
-                continue
-            total_peers += 1
-            blocks.extend(peer.blocks)
-        # blocks = [peer.blocks[-1] for peer in self.peers.values()
-        #           if len(peer.blocks) and peer.synched]
-
-        counts = defaultdict(int)
-        heights = dict()
-        timestamps = dict()
-        for block in blocks:
-            heights[block[1]] = block[0]
-            counts[block[1]] += 1
-            # Retrieve newest timestamp for block
-            if block[2] is not None:
-                stamp = max([float(X[0]) for X in block[2]])
-                assert stamp is not None
-                timestamps[block[1]] = stamp
-            else:
-                timestamps[block[1]] = block[3]
-
-        result = list()
-        for block_hash, num in counts.items():
-            block_height = heights[block_hash]
-            consensus_pct = (num / float(total_peers)) * 100.0
-            row = (ConsensusBlock(int(block_height), block_hash, timestamps[block_hash]), num, consensus_pct)
-            result.append(row)
-
-        results = sorted(result, lambda x, y: int(y[0].height - x[0].height))
+        results = list(self.index.rows())
         half_hour_ago = time.time() - (60*30)
         if len(results):
             # If there isn't enough data to get an accurate Difficulty rating
             # (requires 30 mins of data), then fill out with stuff from Ledger DB
             oldest_result = results[-1]
-            oldest_time = min([X[0].stamp for X in results])
+            oldest_time = self.index.oldest()
             if oldest_time < half_hour_ago:
                 merge_rows = ResultsManager.history_fetch(half_hour_ago, oldest_result[0].height)
                 for row in merge_rows:
@@ -607,7 +1049,7 @@ class PeerManager(object):
             results = [(row, 0, 100) for row in ResultsManager.history_fetch(half_hour_ago)]
 
         # Verify consensus is above 50%, and notify result manager
-        if results[0][2] >= 50:
+        if len(results) and results[0][2] >= 50:
             # LOG.warning('XXX adding new consensus peers:%r %r', total_peers, results)
             ResultsManager.on_consensus(results[0][0])
 
@@ -620,6 +1062,7 @@ class PeerManager(object):
                 fail = True
             else:
                 self.peers[peer] = client
+                self.book.connected(peer, client.latency)
         except Exception as ex:
             fail = True
             Abuse.strike(peer)
@@ -661,3 +1104,4 @@ class PeerManager(object):
                 LOG.exception("While closing peer")
             if peer in self.peers:
                 del self.peers[peer]
+            self.book.closed(peer)
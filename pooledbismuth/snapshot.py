@@ -0,0 +1,186 @@
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import logging as LOG
+
+from .common import write_json, stamp_hour
+
+
+# Address shards are named by the first characters of the address
+SHARD_CHARS = 2
+HEX = set('0123456789abcdef')
+# Addresses not starting with SHARD_CHARS hex characters
+OTHER_SHARD = '_'
+
+
+def shard_name(address):
+    prefix = address[:SHARD_CHARS]
+    if len(prefix) == SHARD_CHARS and all(char in HEX for char in prefix):
+        return prefix
+    return OTHER_SHARD
+
+
+def network_stats(block, difficulty, miners=None, now=None):
+    """
+    Consensus block, network difficulty and the pool's own hashrate, as
+    known to the pool process
+    """
+    stats = dict(
+        generated=time.time() if now is None else now,
+        height=block.height,
+        block_hash=block.hash,
+        block_stamp=block.stamp,
+        difficulty=difficulty,
+    )
+    if miners is not None:
+        stats.update(hashrate=miners.get('hashrate'), miners=miners.get('miners', miners.get('workers')))
+    return stats
+
+
+def write_network(path, block, difficulty, miners=None):
+    return write_json(os.path.join(path, 'network.json'), network_stats(block, difficulty, miners))
+
+
+class Snapshot(object):
+    """
+    Static JSON files for the dashboard, from the payout database:
+
+     - `pool.json`: pool totals, the exchange rate and the last `hours`
+       hours of blocks and shares, hour by hour
+     - `addresses/<shard>.json`: lifetime totals for every address whose
+       first `SHARD_CHARS` characters are the shard name
+
+    Address shards carry shmeckles rather than BIS, which is shmeckles
+    times the exchange rate in `pool.json`, so a new block only rewrites
+    the shards of the addresses credited since the last snapshot.
+    """
+    def __init__(self, pooldb, path, hours=24, top=20):
+        self.pooldb = pooldb
+        self.path = path
+        self.hours = hours
+        self.top = top
+
+    def _state(self):
+        try:
+            with open(os.path.join(self.path, '.state.json')) as handle:
+                return json.load(handle)
+        except (IOError, ValueError):
+            return None
+
+    def pool_stats(self, now=None):
+        if now is None:
+            now = time.time()
+        begin = stamp_hour(now) - (self.hours - 1) * 3600
+        stats = dict(generated=now, hours=self.hours)
+        latest = self.pooldb.execute("""
+            SELECT id, stamp, difficulty, pool_balance, pool_shmeckles FROM blocks ORDER BY id DESC LIMIT 1
+        """).fetchone()
+        if latest is not None:
+            height, stamp, difficulty, pool_balance, pool_shmeckles = latest
+            stats.update(height=height, stamp=float(stamp), difficulty=difficulty,
+                         pool_balance=pool_balance, pool_shmeckles=pool_shmeckles,
+                         exchange_rate=(pool_balance / float(pool_shmeckles)) if pool_shmeckles else None)
+        blocks, won, reward, first, last = self.pooldb.execute("""
+            SELECT COUNT(*), SUM(won), SUM(CASE WHEN won THEN reward ELSE 0 END), MIN(stamp), MAX(stamp)
+            FROM blocks WHERE stamp >= ?
+        """, (begin,)).fetchone()
+        stats.update(blocks=blocks, won=won or 0, reward=reward or 0.0)
+        if blocks > 1 and float(last) > float(first):
+            stats['reward_rate'] = (reward or 0.0) / (float(last) - float(first)) * 3600
+        stats['by_hour'] = [
+            dict(hour=hour, addresses=addresses, shares=shares, workcount=workcount, shmeckles=shmeckles)
+            for hour, addresses, shares, workcount, shmeckles in self.pooldb.execute("""
+                SELECT hour, COUNT(*), SUM(shares), SUM(workcount), SUM(shmeckles)
+                FROM address_hours WHERE hour >= ? GROUP BY hour ORDER BY hour
+            """, (begin,))]
+        stats['top'] = [
+            dict(address=address, shmeckles=shmeckles, workcount=workcount)
+            for address, shmeckles, workcount in self.pooldb.execute("""
+                SELECT a.address, SUM(h.shmeckles), SUM(h.workcount)
+                FROM address_hours h JOIN addresses a ON a.id = h.address_id
+                WHERE h.hour >= ? GROUP BY h.address_id ORDER BY 2 DESC, 1 LIMIT ?
+            """, (begin, self.top))]
+        return stats
+
+    def changed_shards(self, since_hour):
+        """
+        Shards with an address credited in or after the hour `since_hour`
+        """
+        return set(shard_name(row[0]) for row in self.pooldb.execute("""
+            SELECT a.address FROM address_hours h JOIN addresses a ON a.id = h.address_id
+            WHERE h.hour >= ?
+        """, (since_hour,)))
+
+    def all_shards(self):
+        return set(shard_name(row[0]) for row in self.pooldb.execute("""
+            SELECT a.address FROM address_totals t JOIN addresses a ON a.id = t.address_id
+        """))
+
+    def shard(self, name):
+        """
+        Lifetime totals for the addresses in shard `name`
+        """
+        query = """
+            SELECT a.address, t.blocks, t.shares, t.workcount, t.shmeckles
+            FROM addresses a JOIN address_totals t ON t.address_id = a.id
+        """
+        if name == OTHER_SHARD:
+            rows = [row for row in self.pooldb.execute(query) if shard_name(row[0]) == OTHER_SHARD]
+        else:
+            # Range over the unique index on address, past any ASCII after the prefix
+            rows = self.pooldb.execute(query + " WHERE a.address >= ? AND a.address < ?", (name, name + '\x7f'))
+        return dict((address, dict(blocks=blocks, shares=shares, workcount=workcount, shmeckles=shmeckles))
+                    for address, blocks, shares, workcount, shmeckles in rows)
+
+    def write(self, now=None):
+        """
+        Write `pool.json` and the address shards changed since the last
+        snapshot, returns the number of shards written
+        """
+        latest = self.pooldb.execute("SELECT id, stamp FROM blocks ORDER BY id DESC LIMIT 1").fetchone()
+        state = self._state()
+        if state is None or latest is None or latest[0] < state['height']:
+            # First snapshot, or the payout database was rebuilt
+            shards = self.all_shards()
+        else:
+            # Blocks are credited in order, a block credited again is the last one
+            shards = self.changed_shards(stamp_hour(state['stamp']))
+        written = 0
+        for name in sorted(shards):
+            if write_json(os.path.join(self.path, 'addresses', name + '.json'), self.shard(name)):
+                written += 1
+        write_json(os.path.join(self.path, 'pool.json'), self.pool_stats(now))
+        if latest is not None:
+            write_json(os.path.join(self.path, '.state.json'), dict(height=latest[0], stamp=float(latest[1])))
+        LOG.info('Snapshot %r - %d of %d changed shards written', self.path, written, len(shards))
+        return written
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Write dashboard JSON snapshots from the pool database')
+    parser.add_argument('--pool-db', dest='pool_db', default='data/pool.db', metavar='PATH',
+                        help="Pool database written by the payout engine")
+    parser.add_argument('--hours', type=int, default=24, metavar='N', help="Hours of pool statistics")
+    parser.add_argument('-v', '--verbose', action='store_const', dest="loglevel", const=LOG.INFO,
+                        default=LOG.WARNING, help="Log informational messages")
+    parser.add_argument('path', help="Directory served to the dashboard")
+    cfg = parser.parse_args()
+    LOG.basicConfig(level=cfg.loglevel)
+    return cfg
+
+
+def main():
+    cfg = parse_args()
+    pooldb = sqlite3.connect(cfg.pool_db)
+    pooldb.text_factory = str
+    written = Snapshot(pooldb, cfg.path, cfg.hours).write()
+    print("Wrote %d address shards to %s" % (written, cfg.path))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
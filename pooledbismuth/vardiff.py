@@ -0,0 +1,127 @@
+from __future__ import print_function
+import time
+from collections import defaultdict
+
+from .common import MINER_TUNE_GOAL, MINER_TUNE_HISTORY
+from .hashrate import expected_work, work_difficulty
+
+
+class LegacyVarDiff(object):
+    """
+    The original tuning: pick the diff with the best average find time under
+    the goal, nudge it, then average with the network difficulty
+    """
+    def __init__(self, goal=MINER_TUNE_GOAL, initial=40):
+        self.goal = goal
+        self.initial = initial
+        self.diff = None
+        self._history = []
+        self._last_found = None
+
+    def on_share(self, diff, now=None):
+        if now is None:
+            now = time.time()
+        if self._last_found is not None:
+            self._history.append((diff, now - self._last_found))
+            if len(self._history) > MINER_TUNE_HISTORY:
+                self._history = self._history[0 - MINER_TUNE_HISTORY:]
+        self._last_found = now
+
+    def retarget(self, network_diff, now=None):
+        if now is None:
+            now = time.time()
+        hist_time = defaultdict(int)
+        hist_count = defaultdict(int)
+        for diff, duration in self._history:
+            hist_time[diff] += duration
+            hist_count[diff] += 1.0
+        ideal_diff = self.diff if self.diff is not None else self.initial
+        best_time = 0
+        for diff, total_time in hist_time.items():
+            avg_time = total_time / hist_count[diff]
+            if avg_time > best_time and avg_time < self.goal:
+                best_time = avg_time
+                ideal_diff = diff
+        if best_time > self.goal:
+            ideal_diff -= 1
+        else:
+            if self._last_found > (now - self.goal):
+                ideal_diff += 0.5
+        self.diff = sum([network_diff, ideal_diff]) / 2
+        return self.diff
+
+
+class EwmaVarDiff(object):
+    """
+    Converges on one share every `goal` seconds per miner.
+
+    Every share is credited the expected work for its job diff. Exponentially
+    weighted averages of work and elapsed time give the miner's hashrate,
+    and the ideal diff is the one where `goal` seconds of that hashrate make
+    one share. Each share is O(1).
+
+    The diff only moves when the ideal is more than `hysteresis` away,
+    so noise in the estimate doesn't make it flap. Slow miners which go
+    quiet for longer than `2 * goal` are retargeted down as if a share had
+    arrived just now, so they don't starve waiting for one.
+    """
+    def __init__(self, goal=MINER_TUNE_GOAL, initial=40, alpha=0.25, hysteresis=0.75,
+                 min_diff=1, max_diff=200):
+        self.goal = goal
+        self.initial = initial
+        self.alpha = alpha
+        self.hysteresis = hysteresis
+        self.min_diff = min_diff
+        self.max_diff = max_diff
+        self.diff = None
+        self._work = None
+        self._time = None
+        self._last_found = None
+
+    def _average(self, work, elapsed):
+        if self._work is None:
+            return work, elapsed
+        return (self.alpha * work + (1 - self.alpha) * self._work,
+                self.alpha * elapsed + (1 - self.alpha) * self._time)
+
+    def on_share(self, diff, now=None):
+        """Record a share found at job difficulty `diff`"""
+        if now is None:
+            now = time.time()
+        if self._last_found is not None:
+            elapsed = max(now - self._last_found, 0.001)
+            self._work, self._time = self._average(expected_work(int(diff)), elapsed)
+        self._last_found = now
+
+    def rate(self, now=None):
+        """Estimated hashes per second, or None before the second share"""
+        work, elapsed = self._work, self._time
+        if self._last_found is not None and self.diff is not None:
+            quiet = (time.time() if now is None else now) - self._last_found
+            if quiet > self.goal * 2:
+                # At most this fast, or the share would have arrived already
+                work, elapsed = self._average(expected_work(self.diff), quiet)
+        if work is None:
+            return None
+        return work / elapsed
+
+    def retarget(self, network_diff=None, now=None):
+        if now is None:
+            now = time.time()
+        if self.diff is None:
+            self.diff = self.initial
+            self._last_found = now
+            return self.diff
+        rate = self.rate(now)
+        if rate is None:
+            return self.diff
+        ideal = work_difficulty(rate * self.goal)
+        if abs(ideal - self.diff) > self.hysteresis:
+            self.diff = min(max(int(round(ideal)), self.min_diff), self.max_diff)
+        return self.diff
+
+
+VARDIFF = {
+    'ewma': EwmaVarDiff,
+    'legacy': LegacyVarDiff,
+}
@@ -0,0 +1,98 @@
+from __future__ import print_function
+import socket
+import logging as LOG
+from multiprocessing import Process
+
+import gevent
+from gevent.queue import Queue, Empty
+from gevent.event import AsyncResult
+
+from .common import send_message, recv_message
+from . import bismuth
+
+
+def _worker_main(sock):
+    """
+    Worker process loop: read pickled batches, reply with pickled verdicts
+    """
+    while True:
+        try:
+            batch = recv_message(sock)
+        except EOFError:
+            break
+        send_message(sock, bismuth.verify_batch(batch))
+
+
+class BatchVerifier(object):
+    """
+    Share verification spread across a pool of worker processes.
+
+    Miner greenlets call `verify` and yield until the verdict comes back.
+    Submissions are queued, and each worker greenlet groups whatever is
+    waiting (up to `batch_size`) into one batch for its process.
+    """
+    def __init__(self, workers, batch_size=256):
+        self.batch_size = batch_size
+        self.queue = Queue()
+        self.batches = 0
+        self.verified = 0
+        self._procs = list()
+        self._greenlets = list()
+        for N in range(0, workers):
+            ours, theirs = socket.socketpair()
+            proc = Process(target=_worker_main, args=(theirs,), name='Verifier-%d' % (N,))
+            proc.daemon = True
+            proc.start()
+            theirs.close()
+            self._procs.append((proc, ours))
+            self._greenlets.append(gevent.spawn(self._run, ours))
+
+    def verify(self, result):
+        waiter = AsyncResult()
+        self.queue.put((tuple(result), waiter))
+        return waiter.get()
+
+    def status(self):
+        return dict(workers=len(self._procs), queued=self.queue.qsize(),
+                    batches=self.batches, verified=self.verified)
+
+    def _next_batch(self):
+        # Whatever queued up while the previous batch was in flight
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _run(self, sock):
+        failed = False
+        while True:
+            batch = self._next_batch()
+            results = [result for result, _ in batch]
+            verdicts = None
+            if not failed:
+                try:
+                    send_message(sock, results)
+                    verdicts = recv_message(sock)
+                except Exception:
+                    # Keep draining the queue inline, so miners don't hang
+                    LOG.exception('Verifier - worker process failed, verifying inline')
+                    failed = True
+            if verdicts is None:
+                verdicts = bismuth.verify_batch(results)
+            self.batches += 1
+            self.verified += len(batch)
+            for (_, waiter), verdict in zip(batch, verdicts):
+                waiter.set(verdict)
+
+    def stop(self):
+        gevent.killall(self._greenlets)
+        for proc, sock in self._procs:
+            sock.close()
+            proc.join(1)
+            if proc.is_alive():
+                proc.terminate()
+        self._procs = list()
+        self._greenlets = list()
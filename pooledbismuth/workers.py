@@ -0,0 +1,212 @@
+from __future__ import print_function
+import os
+import socket
+import logging as LOG
+from collections import namedtuple
+
+import gevent
+from gevent.queue import Queue
+from gevent.event import Event
+
+from .common import MinerResult, LOWEST_DIFFICULTY, send_message, recv_message
+from .pool import Miners, EventMiners, ResultsManager
+from .vardiff import EwmaVarDiff
+from .hashrate import HashrateEstimator
+from .nonces import NonceIndex
+
+
+# What the coordinator knows about the miner who found a share
+RemoteMiner = namedtuple('RemoteMiner', ('address',))
+# Rejected shares, queued for the coordinator in place of the share
+STALE = 'stale'
+DUPLICATE = 'duplicate'
+
+
+class WorkerJob(object):
+    """
+    Stands in for both the `PeerManager` and the `ResultsManager` inside a
+    miner worker process. The current job is pushed by the coordinator,
+    accepted shares are streamed back to it.
+    """
+    def __init__(self, identity, sock):
+        self.identity = identity
+        self.sock = sock
+        self.block = None
+        self.diff = None
+        self.highest = LOWEST_DIFFICULTY
+        self.shares = Queue()
+        self.listeners = list()
+        # Only this worker's shares, the coordinator checks across workers
+        self.seen = NonceIndex()
+
+    def listen(self, callback):
+        self.listeners.append(callback)
+
+    def unlisten(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def consensus(self):
+        if self.block is None:
+            return []
+        return [(self.block, 0, 100)]
+
+    def top(self):
+        if self.block is not None:
+            return (self.block, 0, 100)
+
+    def difficulty(self):
+        return self.diff
+
+    def highest_difficulty(self):
+        return self.highest
+
+    def is_duplicate(self, result):
+        return self.block is not None and result.block == self.block.hash and result.nonce in self.seen
+
+    def on_result(self, result, miner):
+        # Rejected shares are counted too, so the coordinator sees the rates
+        if not self.block or result.block != self.block.hash:
+            # If no latest consensus block - ignore, it's training data
+            self.shares.put(STALE)
+            return False
+        if not self.seen.add(result.nonce):
+            self.shares.put(DUPLICATE)
+            return False
+        self.shares.put((tuple(result), miner.address, int(miner.diff)))
+        return True
+
+    def send_shares(self):
+        # Everything since the last send goes in one (shares, stale, duplicates) message
+        while True:
+            shares = [self.shares.get()]
+            while not self.shares.empty():
+                shares.append(self.shares.get())
+            accepted = [share for share in shares if share not in (STALE, DUPLICATE)]
+            send_message(self.sock, (accepted, shares.count(STALE), shares.count(DUPLICATE)))
+
+    def receive_jobs(self):
+        while True:
+            try:
+                job = recv_message(self.sock)
+            except (EOFError, socket.error):
+                break
+            previous = self.block
+            self.block, self.diff, self.highest = job
+            if self.block != previous:
+                self.seen.reset()
+                for callback in self.listeners:
+                    callback(self.block)
+
+
+def _worker_main(sock, identity, bind, max_conns, backend, vardiff):
+    job = WorkerJob(identity, sock)
+    miners_class = EventMiners if backend == 'event' else Miners
+    miners = miners_class(job, bind, max_conns, results=job, reuse_port=True, vardiff=vardiff)
+    sender = gevent.spawn(job.send_shares)
+    try:
+        job.receive_jobs()
+    finally:
+        sender.kill()
+        miners.stop()
+
+
+class MinerWorkers(object):
+    """
+    Miner connections spread over N worker processes, which all bind the
+    miner port with SO_REUSEPORT and verify shares themselves.
+
+    This process stays the coordinator: it owns the peers, consensus and
+    block submission, pushes the current job (consensus block, network
+    difficulty, highest share) to the workers, and logs the shares they
+    accept through the `ResultsManager`.
+    """
+    def __init__(self, peers, bind, workers, max_conns=5000, backend='gevent', interval=0.5,
+                 vardiff=EwmaVarDiff):
+        self.peers = peers
+        self.interval = interval
+        self._job = None
+        self.accepted = 0
+        self.stale = 0
+        self.duplicates = 0
+        self.hashrate = HashrateEstimator()
+        self._workers = list()
+        for N in range(0, workers):
+            ours, theirs = socket.socketpair()
+            pid = os.fork()
+            if pid == 0:
+                ours.close()
+                code = 0
+                try:
+                    _worker_main(theirs, peers.identity, bind, max_conns, backend, vardiff)
+                except Exception:
+                    LOG.exception('Miner worker %d - failed', N)
+                    code = 1
+                os._exit(code)
+            theirs.close()
+            self._workers.append((pid, ours))
+        self._wake = Event()
+        self._greenlets = [gevent.spawn(self._read_shares, sock) for _, sock in self._workers]
+        self._greenlets.append(gevent.spawn(self._publish))
+        # Publish straight away when the consensus moves, rather than on the next tick
+        ResultsManager.listen(self._on_consensus)
+
+    def _on_consensus(self, consensus):
+        self._wake.set()
+
+    def _current_job(self):
+        consensus = self.peers.consensus()
+        block = consensus[0][0] if len(consensus) else None
+        return (block, self.peers.difficulty(), ResultsManager.highest_difficulty())
+
+    def _publish(self):
+        while True:
+            job = self._current_job()
+            if job != self._job:
+                self._job = job
+                for _, sock in self._workers:
+                    send_message(sock, job)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _read_shares(self, sock):
+        while True:
+            try:
+                shares = recv_message(sock)
+            except (EOFError, socket.error):
+                LOG.warning('Miner worker disconnected')
+                break
+            shares, stale, duplicates = shares
+            self.stale += stale
+            self.duplicates += duplicates
+            for result, address, diff in shares:
+                result = MinerResult(*result)
+                if ResultsManager.on_result(result, RemoteMiner(address)):
+                    self.accepted += 1
+                    self.hashrate.on_share(None, address, diff)
+                elif ResultsManager.is_duplicate(result):
+                    # Sent to more than one worker
+                    self.duplicates += 1
+                else:
+                    self.stale += 1
+
+    def status(self):
+        total = self.accepted + self.stale
+        status = dict(
+            workers=len(self._workers),
+            accepted=self.accepted,
+            stale=self.stale,
+            stale_rate=(self.stale / float(total)) if total else 0.0,
+            duplicates=self.duplicates,
+        )
+        status.update(self.hashrate.status())
+        return status
+
+    def stop(self):
+        ResultsManager.unlisten(self._on_consensus)
+        gevent.killall(self._greenlets)
+        for pid, sock in self._workers:
+            sock.close()
+        for pid, _ in self._workers:
+            os.waitpid(pid, 0)
+        self._workers = list()
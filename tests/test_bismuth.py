@@ -0,0 +1,123 @@
+from __future__ import print_function
+import os
+import random
+import hashlib
+import unittest
+from pooledbismuth import bismuth
+
+try:
+    import quickbismuth
+except ImportError:
+    quickbismuth = None
+
+
+# Set to e.g. 5000000 for the full differential run
+ROUNDS = int(os.environ.get('BISMUTH_DIFFERENTIAL_ROUNDS', 5000))
+
+
+def reference_bin_convert(string):
+    return ''.join(format(ord(x), 'b') for x in string)
+
+
+def reference_difficulty(address, nonce, db_block_hash):
+    needle = reference_bin_convert(db_block_hash)
+    input = address + nonce + db_block_hash
+    haystack = reference_bin_convert(hashlib.sha224(input).hexdigest())
+    return max([N for N in range(1, len(needle) - 1) if needle[:N] in haystack])
+
+
+def reference_verify(address, nonce, db_block_hash, diff_len):
+    diff_len = int(diff_len)
+    mining_search_bin = reference_bin_convert(db_block_hash)[0:diff_len]
+    mining_input = address + nonce + db_block_hash
+    mining_hash = hashlib.sha224(mining_input).hexdigest()
+    mining_bin = reference_bin_convert(mining_hash)
+    if mining_search_bin in mining_bin:
+        return True
+
+
+def random_hex(nbytes):
+    return '%0*x' % (nbytes * 2, random.getrandbits(nbytes * 8))
+
+
+def random_bytes(count):
+    # Low bytes and NUL too, which `byte2bin` once turned into no bits
+    return ''.join([chr(random.choice((0, 1, 2, random.randint(0, 255)))) for N in range(count)])
+
+
+class TestBismuth(unittest.TestCase):
+    def setUp(self):
+        self._quickbismuth = bismuth.quickbismuth
+        bismuth.quickbismuth = None
+
+    def tearDown(self):
+        bismuth.quickbismuth = self._quickbismuth
+
+    def test_bin_convert(self):
+        for N in range(256):
+            self.assertEqual(bismuth._bin_convert(chr(N)), reference_bin_convert(chr(N)))
+        block_hash = random_hex(28)
+        self.assertEqual(bismuth._bin_convert(block_hash), reference_bin_convert(block_hash))
+
+    def test_needle_cache(self):
+        cache = bismuth.NeedleCache(size=4)
+        block_hash = random_hex(28)
+        table = cache.get(block_hash)
+        self.assertIs(cache.get(block_hash), table)
+        self.assertEqual(table.prefix(40), reference_bin_convert(block_hash)[:40])
+        for N in range(10):
+            cache.get(random_hex(28))
+        self.assertTrue(len(cache.tables) <= 4)
+        cache.get(block_hash)
+        cache.reset(block_hash)
+        self.assertEqual(list(cache.tables.keys()), [block_hash])
+
+    def test_differential(self):
+        block_hash = random_hex(28)
+        for N in range(ROUNDS):
+            # Shares arrive in bursts for the same block, with the odd switch
+            if N % 1000 == 0:
+                block_hash = random_hex(28)
+            address = random_hex(28)
+            nonce = random_hex(16)
+            expected = reference_difficulty(address, nonce, block_hash)
+            self.assertEqual(bismuth.difficulty(address, nonce, block_hash), expected)
+            for diff_len in (expected, expected + 1, random.randint(0, 240)):
+                self.assertEqual(bool(bismuth.verify(address, nonce, block_hash, diff_len)),
+                                 bool(reference_verify(address, nonce, block_hash, diff_len)))
+
+
+@unittest.skipIf(quickbismuth is None, 'QuickBismuth not installed')
+class TestQuickBismuth(unittest.TestCase):
+    def setUp(self):
+        self._quickbismuth = bismuth.quickbismuth
+        bismuth.quickbismuth = quickbismuth
+
+    def tearDown(self):
+        bismuth.quickbismuth = self._quickbismuth
+
+    def assertSame(self, address, nonce, block_hash, diff_lens):
+        expected = reference_difficulty(address, nonce, block_hash)
+        self.assertEqual(bismuth.difficulty(address, nonce, block_hash), expected)
+        for diff_len in (expected, expected + 1) + tuple(diff_lens):
+            self.assertEqual(bool(bismuth.verify(address, nonce, block_hash, diff_len)),
+                             bool(reference_verify(address, nonce, block_hash, diff_len)))
+
+    def test_differential(self):
+        block_hash = random_hex(28)
+        for N in range(ROUNDS):
+            if N % 1000 == 0:
+                block_hash = random_hex(28)
+            self.assertSame(random_hex(28), random_hex(16), block_hash, (random.randint(0, 240),))
+
+    def test_edges(self):
+        diff_lens = (0, 1, -1, -10, 420, 1000)
+        for block_hash in ('\x00' * 56, '\x01\x00' * 28, '0' * 56, 'f' * 56):
+            self.assertSame('a' * 56, '0' * 32, block_hash, diff_lens)
+        # Miners send whatever they like as the nonce
+        for N in range(ROUNDS // 10):
+            self.assertSame(random_hex(28), random_bytes(random.randint(0, 40)), random_bytes(56), diff_lens)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+from __future__ import print_function
+import time
+import unittest
+import random
+from pooledbismuth.blockstore import BlockStore, DifficultyTracker, PEER_BLOCKS
+from pooledbismuth.common import ConsensusBlock, IpPort, calc_diff
+from pooledbismuth.peerbook import PeerBook
+from pooledbismuth.pool import BismuthClient, ConsensusIndex
+
+from test_history import testdata_1
+
+
+class FakeManager(object):
+    def __init__(self):
+        self.store = BlockStore()
+        self.index = ConsensusIndex()
+        self.difficulty_tracker = DifficultyTracker()
+        self.book = PeerBook()
+
+
+def make_peer(manager, N):
+    client = BismuthClient.__new__(BismuthClient)
+    client.sockaddr = IpPort('10.0.0.%d' % (N,), 5658)
+    client.sock = object()
+    client.manager = manager
+    client.blocks = manager.store.ring([manager.store.intern(100, 'a' * 56, 1000.0)])
+    client._window = None
+    client.connected_at = time.time()
+    client.blockheight = client.their_blockheight = 100
+    client.blockhash = client.their_blockhash = 'a' * 56
+    return client
+
+
+def transactions(stamp):
+    return [('%.2f' % (stamp,), 'w' * 56, 'p' * 56, '1.5'), ('%.2f' % (stamp + 5,), 'm' * 56, 'm' * 56, '0')]
+
+
+class TestBlockStore(unittest.TestCase):
+    def test_shared(self):
+        manager = FakeManager()
+        now = time.time() - 60
+        block_list = [transactions(now - (9 - N) * 60) for N in range(10)]
+        peers = [make_peer(manager, N) for N in range(3)]
+        for peer in peers:
+            peer.their_blockheight = 110
+            peer._add_blocks(block_list)
+        self.assertEqual(len(manager.store), 11)
+        # Every peer holds the same blocks
+        self.assertTrue(all(a is b for a, b in zip(peers[0].blocks, peers[2].blocks)))
+        block = peers[0].blocks[-1]
+        self.assertEqual((block.height, block.stamp, block.first), (110, float('%.2f' % (now + 5,)), float('%.2f' % (now,))))
+        self.assertEqual(block.consensus, ConsensusBlock(110, peers[0].blockhash, block.stamp))
+        self.assertTrue(peers[0].synched)
+        self.assertEqual(peers[0].difficulty, 37)
+        # Blocks new since connecting count towards a peer's lead time
+        self.assertLess(manager.book.get(peers[0].sockaddr).lead, 1)
+
+        peers[0]._vote()
+        self.assertIs(manager.index.blocks[block.hash], block.consensus)
+
+        # Blocks nobody holds are dropped
+        for peer in peers:
+            peer.blocks.clear()
+        del peer, block
+        self.assertEqual(len(manager.store), 0)
+
+    def test_ring(self):
+        store = BlockStore()
+        ring = store.ring()
+        for N in range(PEER_BLOCKS + 10):
+            ring.append(store.intern(N, '%056x' % (N,), 1000.0 + N))
+        self.assertEqual(len(ring), PEER_BLOCKS)
+        self.assertEqual(ring[0].height, 10)
+        self.assertEqual(len(store), PEER_BLOCKS)
+        self.assertEqual(store.add(0, 'e' * 56, []).stamp, None)
+
+
+class TestDifficultyTracker(unittest.TestCase):
+    def assertSameDifficulty(self, blocks, window):
+        first, last = blocks[0].first, blocks[-1].stamp
+        for now in [first + N * 13.7 for N in range(int((last - first) / 13.7) + 200)] + [last + 120, last + 360]:
+            self.assertEqual(window.difficulty(now), calc_diff([block.first for block in blocks], now, last))
+
+    def test_identical(self):
+        random.seed(1)
+        store = BlockStore()
+        tracker = DifficultyTracker()
+        # Blocks seen through a peer have their first timestamp too
+        blocks = [store.intern(row.height, row.hash, row.stamp, row.stamp - random.random() * 5)
+                  for row in testdata_1]
+        ring = store.ring(blocks[:10])
+        window = tracker.window(ring)
+        self.assertIs(window, tracker.window(store.ring(blocks[:10])))
+        self.assertSameDifficulty(ring, window)
+        for block in blocks[10:]:
+            # Across the end of a full ring of 12
+            evicted = ring[0] if len(ring) == 12 else None
+            ring = store.ring(list(ring)[1:] + [block] if evicted else list(ring) + [block])
+            window = tracker.advance(window, block, evicted)
+            # However the peers got there
+            self.assertIs(window, tracker.window(ring))
+            self.assertEqual(window.stamps, sorted(row.first for row in ring))
+            self.assertSameDifficulty(ring, window)
+
+    def test_peers(self):
+        manager = FakeManager()
+        now = time.time() - 60
+        peers = [make_peer(manager, N) for N in range(2)]
+        # One peer's window follows it, the other's is made afresh
+        peers[0].difficulty
+        for peer in peers:
+            peer.their_blockheight = 105
+            peer._add_blocks([transactions(now - (4 - N) * 60) for N in range(5)])
+        peers[1].difficulty
+        self.assertIs(peers[0]._window, peers[1]._window)
+        self.assertEqual(peers[0].difficulty, calc_diff([block.first for block in peers[0].blocks],
+                                                        time.time(), peers[0].blocks[-1].stamp))
+
+
+if __name__ == '__main__':
+    unittest.main()
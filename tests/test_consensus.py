@@ -0,0 +1,53 @@
+from __future__ import print_function
+import random
+import unittest
+from pooledbismuth.pool import ConsensusBlock, ConsensusIndex
+
+
+def blocks(*rows):
+    return dict((row.hash, row) for row in rows)
+
+
+A = ConsensusBlock(height=105939, hash='094c61c63e3ba6c124cdbf642d45bc19784034c278f8ee9765404188', stamp=1495404043.8)
+B = ConsensusBlock(height=105940, hash='1635fac94e4f76d2b95a62b895a71748b8442b24e43b37e03630027a', stamp=1495404063.62)
+C = ConsensusBlock(height=105940, hash='def1383def27248de80e3c945274f4d507118fb53dd9af1f1228b7f1', stamp=1495404067.49)
+
+
+class TestConsensusIndex(unittest.TestCase):
+    def test_votes(self):
+        index = ConsensusIndex()
+        self.assertEqual(index.rows(), [])
+        index.update('peer1', blocks(A, B))
+        index.update('peer2', blocks(A, B))
+        index.update('peer3', blocks(A, C))
+        rows = index.rows()
+        self.assertEqual(rows[-1], (A, 3, 100.0))
+        self.assertEqual(sorted(rows[:2]), sorted([(B, 2, (2 / 3.0) * 100), (C, 1, (1 / 3.0) * 100)]))
+        self.assertEqual(index.oldest(), A.stamp)
+
+        # Peer switches fork, then drops out
+        index.update('peer3', blocks(A, B))
+        self.assertEqual(index.top(), (B, 3, 100.0))
+        index.update('peer3', dict())
+        self.assertEqual(index.rows(), [(B, 2, 100.0), (A, 2, 100.0)])
+        self.assertNotIn(C.hash, index.votes)
+
+    def test_top(self):
+        random.seed(1)
+        index = ConsensusIndex()
+        self.assertIsNone(index.top())
+        chain = [ConsensusBlock(100 + N, '%056x' % (N,), 1000.0 + N * 60) for N in range(300)]
+        fork = [block._replace(hash='f' + block.hash[1:]) for block in chain]
+        for N in range(2000):
+            # Peers moving along the chain, some on a fork, some leaving
+            tip = 20 + N // 10 + random.randint(-3, 3)
+            source = fork if random.random() < 0.2 else chain
+            peer = 'peer%d' % (random.randint(0, 9),)
+            index.update(peer, blocks(*source[max(tip - 20, 0):tip]) if random.random() > 0.05 else dict())
+            self.assertEqual(index.top(), index.rows()[0] if index.rows() else None)
+        # Heights voted away don't pile up
+        self.assertLessEqual(len(index._heap), 2 * len(index.heights) + 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+from __future__ import print_function
+import unittest
+from pooledbismuth.hashrate import HashrateEstimator, RateWindow, expected_work, work_difficulty
+
+
+class TestHashrate(unittest.TestCase):
+    def test_expected_work(self):
+        self.assertEqual(expected_work(0), 1.0)
+        for diff in (20, 37, 48.5, 60):
+            self.assertAlmostEqual(work_difficulty(expected_work(diff)), diff)
+        # Roughly 1.5x more work per step of difficulty
+        ratio = expected_work(41) / expected_work(40)
+        self.assertTrue(1.5 < ratio < 1.6)
+
+    def test_window(self):
+        rates = RateWindow(window=60, buckets=6, now=1000)
+        for N in range(60):
+            rates.add(100, now=1000 + N)
+        self.assertAlmostEqual(rates.rate(now=1060), 100)
+        # Only the last 20 seconds of work are still in the window
+        self.assertAlmostEqual(rates.rate(now=1090), 40)
+        self.assertEqual(rates.rate(now=1200), 0)
+
+    def test_estimator(self):
+        estimator = HashrateEstimator(window=60, buckets=6)
+        for N in range(60):
+            estimator.on_share('conn1', 'addr1', 40, now=1000 + N)
+            estimator.on_share('conn2', 'addr1', 40, now=1000 + N)
+            estimator.on_share(None, 'addr2', 40, now=1000 + N)
+        work = expected_work(40)
+        self.assertAlmostEqual(estimator.rate(miner='conn1', now=1060), work)
+        self.assertAlmostEqual(estimator.rate(address='addr1', now=1060), work * 2)
+        self.assertAlmostEqual(estimator.rate(now=1060), work * 3)
+        self.assertEqual([X[0] for X in estimator.top(now=1060)], ['addr1', 'addr2'])
+        estimator.forget('conn1')
+        self.assertEqual(estimator.rate(miner='conn1', now=1060), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+import gevent
+from pooledbismuth.journal import ShareJournal, JournalWriter, JournalReader, RECORD
+
+
+BLOCK_A = '094c61c63e3ba6c124cdbf642d45bc19784034c278f8ee9765404188'
+BLOCK_B = '1635fac94e4f76d2b95a62b895a71748b8442b24e43b37e03630027a'
+ADDRESS = 'a' * 56
+
+
+class TestShareJournal(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_blocks(self):
+        journal = ShareJournal(self.path, commit_size=3, commit_interval=60)
+        journal.begin_block(BLOCK_A)
+        for N in range(5):
+            journal.append(ADDRESS, 40 + N, '%032x' % (N,), now=1000 + N)
+        # Group commit, the last 2 shares are still buffered
+        self.assertEqual(journal.count, 3)
+        journal.begin_block(BLOCK_B)
+        journal.append(None, 38, 'deadbeef', now=2000)
+        journal.begin_block(BLOCK_A)
+        journal.append(ADDRESS, 45, 'cafe', now=3000)
+        journal.close()
+
+        reader = JournalReader(self.path)
+        proofs = reader.block(BLOCK_A)
+        self.assertEqual(len(proofs), 6)
+        self.assertEqual(proofs[0], [1000, ADDRESS, 40, '%032x' % (0,)])
+        self.assertEqual(proofs[-1], [3000, ADDRESS, 45, 'cafe'])
+        self.assertEqual(reader.block(BLOCK_B), [[2000, None, 38, 'deadbeef']])
+        self.assertIsNone(reader.block('0' * 56))
+        reader.close()
+
+    def test_reopen(self):
+        journal = ShareJournal(self.path)
+        journal.begin_block(BLOCK_A)
+        journal.append(ADDRESS, 40, 'aa', now=1000)
+        journal.close()
+        # Crash in the middle of writing a record
+        with open(os.path.join(self.path, 'shares'), 'ab') as handle:
+            handle.write('x' * (RECORD.size // 2))
+
+        journal = ShareJournal(self.path)
+        self.assertEqual(journal.count, 1)
+        journal.append('b' * 56, 41, 'bb', now=1001)
+        journal.append(ADDRESS, 42, 'cc', now=1002)
+        journal.close()
+
+        reader = JournalReader(self.path)
+        self.assertEqual([X[1:] for X in reader.block(BLOCK_A)],
+                         [[ADDRESS, 40, 'aa'], ['b' * 56, 41, 'bb'], [ADDRESS, 42, 'cc']])
+        self.assertEqual(reader.addresses, [ADDRESS, 'b' * 56])
+        reader.close()
+
+    def test_writer(self):
+        writer = JournalWriter(self.path, max_queue=10)
+        writer.begin_block(BLOCK_A)
+        for N in range(100):
+            writer.append(BLOCK_A, ADDRESS, 40, '%032x' % (N,))
+        writer.begin_block(BLOCK_B)
+        # Too late for block A
+        writer.append(BLOCK_A, ADDRESS, 40, 'stale')
+        writer.append(BLOCK_B, None, 41, 'bb')
+        writer.stop()
+        status = writer.status()
+        self.assertEqual(status['written'], 101)
+        self.assertEqual(status['dropped'], 1)
+        self.assertTrue(status['high_water'] <= 10)
+
+        reader = JournalReader(self.path)
+        self.assertEqual(len(reader.block(BLOCK_A)), 100)
+        self.assertEqual(reader.block(BLOCK_B)[0][1:], [None, 41, 'bb'])
+        reader.close()
+
+    def test_writer_interval(self):
+        writer = JournalWriter(self.path, flush_interval=0.05)
+        writer.begin_block(BLOCK_A)
+        writer.append(BLOCK_A, ADDRESS, 40, 'aa')
+        # Committed by the idle writer once due, without another share
+        shares = os.path.join(self.path, 'shares')
+        for _ in range(100):
+            if os.path.exists(shares) and os.path.getsize(shares):
+                break
+            gevent.sleep(0.01)
+        self.assertEqual(os.path.getsize(shares), RECORD.size)
+        writer.stop()
+        self.assertEqual(writer.status()['written'], 1)
+
+    def test_writer_failed(self):
+        writer = JournalWriter(self.path)
+        writer.begin_block(BLOCK_A)
+        # Not a share the journal can pack
+        writer.append(BLOCK_A, ADDRESS, 'diff', 'aa')
+        writer.append(BLOCK_A, ADDRESS, 40, 'bb')
+        writer.stop()
+        self.assertEqual((writer.status()['errors'], writer.status()['written']), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
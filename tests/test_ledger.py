@@ -0,0 +1,94 @@
+from __future__ import print_function
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pooledbismuth.ledger import Ledger
+
+
+def ledger_rows(first, last, salt=''):
+    rows = list()
+    for height in range(first, last):
+        block_hash = '%s%055x' % (salt or '0', height)
+        rows.append((height, '%d' % (1000 + height,), 'w' * 56, 'p' * 56, '1.5', '0', '0.01', block_hash, ''))
+        rows.append((height, '%d' % (1000 + height,), 'm' * 56, 'm' * 56, '0', '10', '0', block_hash, '%032x' % (height,)))
+    return rows
+
+
+class TestLedger(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.ledger_path = os.path.join(self.path, 'ledger.db')
+        self.index_path = os.path.join(self.path, 'index.db')
+        self.ledgerdb = sqlite3.connect(self.ledger_path)
+        self.ledgerdb.text_factory = str
+        self.ledgerdb.execute("""
+            CREATE TABLE transactions (
+                block_height INTEGER, timestamp TEXT, address TEXT, recipient TEXT, amount TEXT,
+                reward TEXT, fee TEXT, block_hash TEXT, openfield TEXT)
+        """)
+        self.add_rows(ledger_rows(1, 21))
+
+    def tearDown(self):
+        self.ledgerdb.close()
+        shutil.rmtree(self.path)
+
+    def add_rows(self, rows):
+        self.ledgerdb.executemany("""
+            INSERT INTO transactions (block_height, timestamp, address, recipient, amount, reward, fee, block_hash, openfield)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        self.ledgerdb.commit()
+
+    def assertSame(self, plain, indexed):
+        self.assertEqual(plain.top(), indexed.top())
+        for since, until in ((0, None), (5, 12), (20, None), (30, None)):
+            self.assertEqual(list(plain.transactions(since, until, batch_size=3)),
+                             list(indexed.transactions(since, until, batch_size=3)))
+        self.assertEqual(list(plain.rewards(10)), list(indexed.rewards(10)))
+        for count in (1, 3, 100):
+            self.assertEqual(plain.last_rewards(count), indexed.last_rewards(count))
+
+    def test_queries(self):
+        ledger = Ledger(self.ledger_path)
+        self.assertEqual(ledger.top(), 20)
+        rows = list(ledger.transactions(5, 7))
+        self.assertEqual([row.block_height for row in rows], [6, 6, 7, 7])
+        self.assertEqual(rows[1].openfield, '%032x' % (6,))
+        self.assertEqual([row.block_height for row in ledger.last_rewards(3)], [18, 19, 20])
+        self.assertEqual([row.block_height for row in ledger.rewards(17)], [18, 19, 20])
+        with self.assertRaises(sqlite3.OperationalError):
+            ledger.connection().execute("DELETE FROM transactions")
+
+    def test_side_index(self):
+        plain = Ledger(self.ledger_path)
+        indexed = Ledger(self.ledger_path, self.index_path)
+        self.assertIsNotNone(indexed.index)
+        indexed.refresh()
+        self.assertSame(plain, indexed)
+        # Rows written since the last refresh are still found
+        self.add_rows(ledger_rows(21, 25))
+        self.assertSame(plain, indexed)
+        indexed.refresh()
+        self.assertSame(plain, indexed)
+
+    def test_rollback(self):
+        indexed = Ledger(self.ledger_path, self.index_path)
+        indexed.refresh()
+        self.ledgerdb.execute("DELETE FROM transactions WHERE block_height > 15")
+        self.add_rows(ledger_rows(16, 23, salt='f'))
+        indexed.refresh()
+        self.assertSame(Ledger(self.ledger_path), indexed)
+        self.assertEqual(indexed.last_rewards(1)[0].block_hash, 'f%055x' % (22,))
+
+    def test_node_index(self):
+        self.ledgerdb.execute("CREATE INDEX block_height_index ON transactions (block_height)")
+        self.ledgerdb.commit()
+        ledger = Ledger(self.ledger_path, self.index_path)
+        self.assertTrue(ledger.has_index)
+        self.assertIsNone(ledger.index)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+from __future__ import print_function
+import ast
+import unittest
+from pooledbismuth.literal import iter_list, parse_list
+
+
+class TestLiteral(unittest.TestCase):
+    def assertSame(self, text):
+        self.assertEqual(parse_list(text), ast.literal_eval(text))
+        self.assertEqual(str(parse_list(text)), str(ast.literal_eval(text)))
+
+    def test_blocks(self):
+        txns = [('1500000000.00', 'a' * 56, 'b' * 56, '1.5', 'sig+/=', 'key', '0', ''),
+                ('1500000005.25', 'c' * 56, 'c' * 56, '0', "it's", 'a "quote"', 'x\\y\n', ')]')]
+        self.assertSame(str([[txns[0]], txns, [], [('only',)]]))
+        # One block at a time
+        blocks = iter_list(str([txns, txns]))
+        self.assertEqual(next(blocks), txns)
+        self.assertEqual(list(blocks), [txns])
+
+    def test_values(self):
+        for text in ["[]", "[ ] ", "[1, -2, 3.5, -0.25, 1e10, 12L, 010, None, True, False]",
+                     "[(), ('a'), ('a',), ('a', 'b',), (1, ('x', [2])), [[]]]",
+                     "['', \"\", u'u', b'b', 'a\\'b', 'tab\\t', '\\x00\\xff']",
+                     "[ ( 'a' , 'b' ) ,( 'c',) ]", "[('a)', 'b'), ('(', ')'), ('a', 1)]"]:
+            self.assertSame(text)
+
+    def test_invalid(self):
+        for text in ["", "()", "[", "[1", "[1,,]", "[,]", "[1 2]", "['a' 'b']", "[(1]", "[[1)]", "[] []",
+                     "[x]", "[__import__('os')]", "[{}]", "[1 + 2]", "['a\nb']"]:
+            with self.assertRaises(ValueError):
+                parse_list(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+from __future__ import print_function
+import unittest
+from pooledbismuth.common import MinerResult, IpPort
+from pooledbismuth.nonces import NonceIndex
+from pooledbismuth.pool import ConsensusBlock, ResultsManager, Miners
+
+
+class FakeMiner(object):
+    address = 'm' * 56
+    sockaddr = IpPort('127.0.0.1', 5657)
+
+
+class RacingVerifier(object):
+    """Another copy of the share is accepted while this one is verified"""
+    def verify(self, result):
+        ResultsManager.on_result(result, FakeMiner())
+        return True
+
+
+class TestNonceIndex(unittest.TestCase):
+    def test_add(self):
+        index = NonceIndex(capacity=4)
+        nonces = ['%032x' % (N,) for N in range(5000)]
+        for nonce in nonces:
+            self.assertTrue(index.add(nonce))
+        # Every partition grew, and kept everything it had
+        self.assertEqual(len(index), 5000)
+        self.assertTrue(all(nonce in index for nonce in nonces))
+        self.assertFalse(any(index.add(nonce) for nonce in nonces))
+        self.assertNotIn('%032x' % (5000,), index)
+        self.assertLessEqual(index.memory(), 5000 * 8 * 3)
+
+        index.reset()
+        self.assertEqual(len(index), 0)
+        self.assertNotIn(nonces[0], index)
+        self.assertTrue(index.add(nonces[0]))
+
+    def test_results(self):
+        ResultsManager.reset()
+        block = ConsensusBlock(100, 'a' * 56, 1000.0)
+        ResultsManager.on_consensus(block, 1000.0)
+        result = MinerResult(40, 'p' * 56, block.hash, 'nonce')
+        self.assertFalse(ResultsManager.is_duplicate(result))
+        self.assertTrue(ResultsManager.on_result(result, FakeMiner()))
+        self.assertTrue(ResultsManager.is_duplicate(result))
+        self.assertTrue(ResultsManager.is_duplicate(result._replace(diff=38)))
+        self.assertFalse(ResultsManager.on_result(result, FakeMiner()))
+        # The same nonce for another block is new work
+        self.assertFalse(ResultsManager.is_duplicate(result._replace(block='b' * 56)))
+
+        ResultsManager.on_consensus(ConsensusBlock(101, 'b' * 56, 1060.0), 1060.0)
+        result = result._replace(block='b' * 56)
+        self.assertFalse(ResultsManager.is_duplicate(result))
+        self.assertTrue(ResultsManager.on_result(result, FakeMiner()))
+        ResultsManager.reset()
+
+    def test_racing_copies(self):
+        ResultsManager.reset()
+        block = ConsensusBlock(100, 'a' * 56, 1000.0)
+        ResultsManager.on_consensus(block, 1000.0)
+        miners = Miners.__new__(Miners)
+        miners.results = ResultsManager
+        miners.verifier = RacingVerifier()
+        miners.accepted = miners.stale = miners.duplicates = 0
+        self.assertFalse(miners.on_found(MinerResult(40, 'p' * 56, block.hash, 'nonce'), FakeMiner()))
+        # Counted as a duplicate, not stale work
+        self.assertEqual((miners.accepted, miners.stale, miners.duplicates), (0, 0, 1))
+        self.assertFalse(miners.on_found(MinerResult(40, 'p' * 56, 'b' * 56, 'other'), FakeMiner()))
+        self.assertEqual((miners.stale, miners.duplicates), (1, 1))
+        ResultsManager.reset()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+from __future__ import print_function
+import os
+import copy
+import random
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from gevent import monkey
+from pooledbismuth.journal import ShareJournal, JournalReader
+from pooledbismuth.ledger import Ledger
+from pooledbismuth import payout
+from pooledbismuth.payout import PayoutEngine, FIRST_HEIGHT, proof_histogram
+
+
+POOL = 'p' * 56
+MINER = 'm' * 56
+WALLET = 'w' * 56
+HASHES = ['%056x' % (N,) for N in range(1, 20)]
+
+
+def ledger_rows(first, last):
+    rows = list()
+    for height in range(first, last):
+        block_hash = HASHES[height - FIRST_HEIGHT]
+        miner = POOL if height % 3 == 0 else WALLET
+        # Blocks 20 minutes apart, spanning a few hours
+        stamp = '%d' % (1000 + height * 1200,)
+        rows.append((height, stamp, miner, miner, '0', '10', '0', block_hash, '%032x' % (height,)))
+        rows.append((height, stamp, WALLET, POOL, '1.5', '0', '0.01', block_hash, ''))
+        rows.append((height, stamp, POOL, WALLET, '0.5', '0', '0.01', block_hash, ''))
+    return rows
+
+
+class TestPayoutEngine(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        journal = ShareJournal(self.path)
+        for block_hash in HASHES:
+            journal.begin_block(block_hash)
+            journal.append(MINER, 40, 'aa')
+            journal.append(MINER, 41, 'bb')
+            journal.append(None, 40, 'cc')
+        journal.close()
+        self.journal = JournalReader(self.path)
+        self.ledger_path = os.path.join(self.path, 'ledger.db')
+        self.ledgerdb = sqlite3.connect(self.ledger_path)
+        self.ledgerdb.text_factory = str
+        self.ledgerdb.execute("""
+            CREATE TABLE transactions (
+                block_height INTEGER, timestamp TEXT, address TEXT, recipient TEXT, amount TEXT,
+                reward TEXT, fee TEXT, block_hash TEXT, openfield TEXT)
+        """)
+        self.ledgerdb.commit()
+        # No index on block_height, heights are looked up in a side index
+        self.ledger = Ledger(self.ledger_path, os.path.join(self.path, 'ledger-index.db'))
+
+    def tearDown(self):
+        self.journal.close()
+        self.ledger.close()
+        self.ledgerdb.close()
+        shutil.rmtree(self.path)
+
+    def add_ledger(self, first, last):
+        self.ledgerdb.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  ledger_rows(first, last))
+        self.ledgerdb.commit()
+
+    def engine(self, pooldb, batch_size):
+        return PayoutEngine(pooldb, self.ledger, POOL, self.journal, batch_size)
+
+    def tables(self, pooldb):
+        return [pooldb.execute("SELECT * FROM %s ORDER BY 1, 2" % (table,)).fetchall()
+                for table in ('blocks', 'workproof', 'addresses', 'checkpoint')]
+
+    def stats(self, pooldb):
+        return [[tuple(round(value, 6) for value in row)
+                 for row in pooldb.execute("SELECT * FROM %s ORDER BY 1, 2" % (table,))]
+                for table in ('address_hours', 'address_totals')]
+
+    def assertStats(self, pooldb):
+        """
+        Rolled up tables kept while crediting match rolling up from scratch
+        """
+        kept = self.stats(pooldb)
+        self.assertTrue(kept[0])
+        PayoutEngine(pooldb, self.ledger, POOL).rebuild_stats()
+        self.assertEqual(kept, self.stats(pooldb))
+
+    def test_resume(self):
+        self.add_ledger(FIRST_HEIGHT + 1, FIRST_HEIGHT + 10)
+        # Batches end in the middle of blocks
+        resumed = sqlite3.connect(':memory:')
+        self.assertEqual(self.engine(resumed, 7).run(), 27)
+        self.assertEqual(self.engine(resumed, 7).run(), 0)
+        self.add_ledger(FIRST_HEIGHT + 10, FIRST_HEIGHT + 15)
+        engine = self.engine(resumed, 7)
+        self.assertEqual(engine.run(), 15)
+        self.assertEqual(engine.height, FIRST_HEIGHT + 14)
+
+        scratch = sqlite3.connect(':memory:')
+        self.engine(scratch, 1000).run()
+        self.assertEqual(self.tables(resumed), self.tables(scratch))
+        self.assertEqual(self.stats(resumed), self.stats(scratch))
+        self.assertStats(resumed)
+        self.assertEqual(len(set(row[1] for row in self.stats(resumed)[0])), 5)
+        # Every block has shares, except the first with no previous hash
+        block = scratch.execute("SELECT pool_shmeckles FROM blocks ORDER BY id DESC").fetchone()
+        self.assertEqual(block[0], 13)
+
+    def test_backfill(self):
+        self.check_backfill(1)
+
+    # multiprocessing pools hang once pooledbismuth.pool has been imported
+    @unittest.skipIf(monkey.is_module_patched('threading'), "gevent monkey patching")
+    def test_backfill_processes(self):
+        self.check_backfill(2)
+
+    def check_backfill(self, processes):
+        self.add_ledger(FIRST_HEIGHT + 1, FIRST_HEIGHT + 10)
+        serial = sqlite3.connect(':memory:')
+        self.engine(serial, 1000).run()
+        # Part of the way serially, then chunks of 4 from there
+        parallel = sqlite3.connect(':memory:')
+        self.engine(parallel, 5).run()
+        self.add_ledger(FIRST_HEIGHT + 10, FIRST_HEIGHT + 19)
+        self.assertEqual(self.engine(serial, 1000).run(), 27)
+        progress = list()
+        engine = self.engine(parallel, 1000)
+        total = engine.backfill(self.path, processes=processes, chunk_blocks=4,
+                                progress=lambda *args: progress.append(args))
+        self.assertEqual(total, 27)
+        self.assertEqual(progress, [(1, 3, 12), (2, 3, 24), (3, 3, 27)])
+        self.assertEqual(engine.height, FIRST_HEIGHT + 18)
+        self.assertEqual(self.tables(parallel), self.tables(serial))
+        self.assertStats(parallel)
+
+    @unittest.skipIf(payout.numpy is None, "NumPy not installed")
+    def test_without_numpy(self):
+        self.add_ledger(FIRST_HEIGHT + 1, FIRST_HEIGHT + 15)
+        vectorized = sqlite3.connect(':memory:')
+        self.engine(vectorized, 10).run()
+        numpy, payout.numpy = payout.numpy, None
+        try:
+            slow = sqlite3.connect(':memory:')
+            self.engine(slow, 10).run()
+        finally:
+            payout.numpy = numpy
+        self.assertEqual(self.tables(vectorized), self.tables(slow))
+
+    def test_stats_migration(self):
+        self.add_ledger(FIRST_HEIGHT + 1, FIRST_HEIGHT + 10)
+        pooldb = sqlite3.connect(':memory:')
+        self.engine(pooldb, 1000).run()
+        expected = self.stats(pooldb)
+        # A database from before the rolled up tables
+        pooldb.execute("DROP TABLE address_hours")
+        pooldb.execute("DROP TABLE address_totals")
+        self.engine(pooldb, 1000)
+        self.assertEqual(self.stats(pooldb), expected)
+
+
+@unittest.skipIf(payout.numpy is None, "NumPy not installed")
+class TestProofHistograms(unittest.TestCase):
+    def random_proofs(self, count):
+        addresses = ['%056x' % (N,) for N in range(20)] + [None]
+        return [[1495404043.8 + N, random.choice(addresses), random.randint(37, 90), '%032x' % (N,)]
+                for N in range(count)]
+
+    def test_identical(self):
+        blocks = [self.random_proofs(count) for count in (1, 500, 0, 3000, 2)]
+        # The pool address also mining under its own name
+        blocks[1][0][1] = POOL
+        table = payout.AddressTable(['%056x' % (N,) for N in range(5)])
+        columns = [table.columns(proofs) for proofs in blocks]
+        results = payout.proof_histograms(columns, table.names, POOL)
+        self.assertEqual(len(results), len(blocks))
+        self.assertIsNone(results[2])
+        for proofs, result in zip(blocks, results):
+            if proofs:
+                self.assertEqual(result, proof_histogram(copy.deepcopy(proofs), POOL))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+from pooledbismuth.common import IpPort
+from pooledbismuth.peerbook import PeerBook, BACKOFF_BASE, BACKOFF_MAX, ROTATE_INTERVAL, STABLE_TIME
+
+
+def make_peers(count):
+    return [IpPort('10.0.0.%d' % (N,), 5658) for N in range(count)]
+
+
+class TestPeerBook(unittest.TestCase):
+    def test_backoff(self):
+        book = PeerBook()
+        peer = IpPort('10.0.0.1', '5658')
+        now = 1000.0
+        for N in range(12):
+            book.attempt(peer)
+            book.closed(peer, now)
+            self.assertEqual(book.get(peer).retry_at, now + min(BACKOFF_BASE * 2 ** N, BACKOFF_MAX))
+            self.assertEqual(book.candidates(now), [])
+        # Connections which don't last are failures too
+        book.connected(peer, 0.1, now)
+        book.closed(peer, now + STABLE_TIME - 1)
+        self.assertEqual(book.get(peer).failures, 13)
+        # Those which do reset the backoff
+        book.connected(peer, 0.1, now)
+        book.closed(peer, now + STABLE_TIME)
+        score = book.get(peer)
+        self.assertEqual((score.failures, score.retry_at, score.sessions), (0, 0, 2))
+        self.assertEqual(score.uptime, STABLE_TIME * 2 - 1)
+        self.assertEqual(book.candidates(now), [IpPort('10.0.0.1', 5658)])
+
+    def test_scores(self):
+        book = PeerBook()
+        fast, slow, behind, unknown = make_peers(4)
+        book.discover([unknown])
+        for peer in (fast, slow, behind):
+            book.connected(peer, 0.05, 1000.0)
+            book.sample_behind(peer, 0)
+        book.announced(fast, 0.0)
+        book.announced(slow, 20.0)
+        book.announced(behind, 0.5)
+        book.sample_behind(behind, 3)
+        for peer in (fast, slow, behind):
+            book.closed(peer, 1000.0 + STABLE_TIME)
+        self.assertEqual(book.candidates(), [fast, unknown, slow, behind])
+
+    def test_plan(self):
+        book = PeerBook(target=6)
+        peers = make_peers(10)
+        book.discover(peers)
+        now = book._rotated
+        connect, drop = book.plan(now)
+        self.assertEqual((len(connect), drop), (4, None))
+        for peer in connect:
+            book.attempt(peer)
+        # Connections under way count towards the target
+        connect, drop = book.plan(now)
+        self.assertEqual((len(connect), drop), (2, None))
+        for peer in connect:
+            book.attempt(peer)
+        for peer in list(book.pending):
+            book.connected(peer, 0.1, now)
+            book.announced(peer, 2.0)
+        self.assertEqual(book.plan(now + ROTATE_INTERVAL - 1), ([], None))
+        # The worst connected peer makes way for a better one
+        worst = sorted(book.sessions)[0]
+        book.sample_behind(worst, 5)
+        best = book.candidates()[0]
+        book.announced(best, 0.0)
+        self.assertEqual(book.plan(now + ROTATE_INTERVAL), ([best], worst))
+        self.assertEqual(book.plan(now + ROTATE_INTERVAL + 1), ([], None))
+
+    def test_save(self):
+        path = os.path.join(tempfile.mkdtemp(), 'scores.json')
+        try:
+            book = PeerBook(path)
+            peer = IpPort('10.0.0.1', 5658)
+            book.connected(peer, 0.25, 1000.0)
+            book.announced(peer, 1.5)
+            book.closed(peer, 1010.0)
+            book.save()
+            loaded = PeerBook(path)
+            self.assertEqual(list(loaded.scores), [peer])
+            self.assertEqual(loaded.get(peer).to_dict(), book.get(peer).to_dict())
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
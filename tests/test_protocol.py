@@ -0,0 +1,228 @@
+from __future__ import print_function
+import socket
+import unittest
+import gevent
+import gevent.socket
+from pooledbismuth.common import ProtocolBase, JobTemplate, ConsensusBlock, MAX_FRAME
+from pooledbismuth.hashrate import HashrateEstimator
+from pooledbismuth.vardiff import EwmaVarDiff
+from pooledbismuth import pool
+
+
+class FakeSocket(object):
+    """Replays received data in the given chunks, records sent data"""
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.sent = list()
+
+    def getpeername(self):
+        return ('127.0.0.1', 5657)
+
+    def recv(self, size):
+        if not self.chunks:
+            return b''
+        return self.chunks.pop(0)
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+    def close(self):
+        pass
+
+
+class StuckSocket(FakeSocket):
+    """A miner which stops reading after the version reply"""
+    def sendall(self, data):
+        if self.sent:
+            gevent.sleep(60)
+        self.sent.append(data)
+
+
+class FakePeers(object):
+    class identity(object):
+        address = 'a' * 56
+
+    def top(self):
+        return (ConsensusBlock(100, 'b' * 56, 1000.0), 1, 100)
+
+
+def make_miners():
+    miners = pool.Miners.__new__(pool.Miners)
+    miners.peers = FakePeers()
+    miners.vardiff = EwmaVarDiff
+    miners.hashrate = HashrateEstimator()
+    miners.subscribers = set()
+    miners._job = None
+    return miners
+
+
+def frames(*args):
+    return ''.join([str(len(data)).zfill(10) + data for data in args])
+
+
+class TestProtocol(unittest.TestCase):
+    def test_send_coalesced(self):
+        sock = FakeSocket([])
+        proto = ProtocolBase(sock, None)
+        proto._send('miner_exch', 40, 'abc')
+        self.assertEqual(sock.sent, [frames('miner_exch', '40', 'abc')])
+
+    def test_recv_many_frames_one_chunk(self):
+        sock = FakeSocket([frames('miner_exch', '40', 'abc', '')])
+        proto = ProtocolBase(sock, None)
+        self.assertEqual([proto._recv() for _ in range(4)], ['miner_exch', '40', 'abc', ''])
+        self.assertFalse(proto._pending())
+        self.assertRaises(socket.error, proto._recv)
+
+    def test_recv_split_frames(self):
+        data = frames('version', 'morty.1', 'x' * 5000)
+        sock = FakeSocket([data[N:N + 7] for N in range(0, len(data), 7)])
+        proto = ProtocolBase(sock, None)
+        self.assertEqual(proto._recv(), 'version')
+        self.assertEqual(proto._recv(), 'morty.1')
+        self.assertEqual(proto._recv(), 'x' * 5000)
+
+    def test_recv_invalid_length(self):
+        for prefix in ('-000000014', '+000000003', ' 000000003', '0x00000003', str(MAX_FRAME + 1).zfill(10)):
+            sock = FakeSocket([frames('abcd') + prefix + 'x' * 20])
+            proto = ProtocolBase(sock, None)
+            self.assertEqual(proto._recv(), 'abcd')
+            position = proto._rpos
+            self.assertRaises(ValueError, proto._recv)
+            # Never back over frames already read
+            self.assertTrue(proto._rpos >= position)
+        proto = ProtocolBase(FakeSocket([str(MAX_FRAME).zfill(10), 'x' * MAX_FRAME]), None)
+        self.assertEqual(len(proto._recv()), MAX_FRAME)
+
+    def test_job_template(self):
+        job = JobTemplate('a' * 56, 'b' * 56)
+        self.assertEqual(job.frames(40), frames('40', 'a' * 56, 'b' * 56))
+        self.assertIs(job.frames(40), job.frames(40))
+        self.assertEqual(job.frames(41), frames('41', 'a' * 56, 'b' * 56))
+
+
+class TestPush(unittest.TestCase):
+    def connect(self, miners, version, sock=None):
+        sock = sock or FakeSocket([frames(version, 'c' * 56)])
+        miner = pool.MinerServer(sock, miners)
+        miner._cmd_version()
+        miner._diff = 40
+        return miner
+
+    def test_negotiate(self):
+        miners = make_miners()
+        pusher = self.connect(miners, 'morty.1.push')
+        plain = self.connect(miners, 'morty.1')
+        self.assertEqual(pusher.sock.sent, [frames('ok.push')])
+        self.assertEqual(plain.sock.sent, [frames('ok')])
+        self.assertEqual(miners.subscribers, set([pusher]))
+        pusher.close()
+        self.assertEqual(miners.subscribers, set())
+
+    def test_push(self):
+        miners = make_miners()
+        miner = self.connect(miners, 'morty.1.push')
+        plain = self.connect(miners, 'morty.1')
+        job = miners.job()
+        miner.push(job)
+        plain.push(job)
+        self.assertEqual(miner.sock.sent[1:], [frames('miner_job', '40', 'a' * 56, 'b' * 56)])
+        self.assertEqual(plain.sock.sent[1:], [])
+        # Miners in the middle of a command get the job with their reply
+        miner._busy = True
+        miner.push(job)
+        self.assertEqual(len(miner.sock.sent), 2)
+
+    def test_exch_broken_frame(self):
+        miners = make_miners()
+        found = list()
+
+        def on_found(result, miner):
+            # Would be run over and over again
+            found.append(result)
+            raise RuntimeError('Stop')
+        miners.on_found = on_found
+        sock = FakeSocket([frames('morty.1', 'c' * 56)])
+        miner = self.connect(miners, 'morty.1', sock)
+        # The nonce length points back at the command
+        miner._rbuf, miner._rpos = bytearray(frames('miner_exch', '40', 'b' * 56) + '-000000108'), 0
+        miner.run()
+        self.assertIsNone(miner.sock)
+        self.assertEqual((found, sock.sent), ([], [frames('ok')]))
+
+    def test_push_timeout(self):
+        miners = make_miners()
+        stuck = self.connect(miners, 'morty.1.push', StuckSocket([frames('morty.1.push', 'c' * 56)]))
+        miner = self.connect(miners, 'morty.1.push')
+        timeout, pool.PUSH_TIMEOUT = pool.PUSH_TIMEOUT, 0.05
+        try:
+            miners.push_jobs()
+            gevent.sleep(0.01)
+            # Not held up by the stuck miner
+            self.assertEqual(len(miner.sock.sent), 2)
+            gevent.sleep(0.1)
+        finally:
+            pool.PUSH_TIMEOUT = timeout
+        self.assertIsNone(stuck.sock)
+        self.assertEqual(miners.subscribers, set([miner]))
+
+
+class TestEventMiner(unittest.TestCase):
+    def setUp(self):
+        self.miners = make_miners()
+        self.miners.clients = set()
+        self.clients = list()
+
+    def tearDown(self):
+        for client, miner in self.clients:
+            miner.close()
+            client.close()
+
+    def connect(self):
+        listener = gevent.socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        client = gevent.socket.create_connection(listener.getsockname())
+        sock, _ = listener.accept()
+        listener.close()
+        miner = pool.EventMinerServer(sock, self.miners)
+        self.miners.clients.add(miner)
+        self.clients.append((client, miner))
+        return client, miner
+
+    def wait_closed(self, miner):
+        with gevent.Timeout(2, False):
+            while miner.sock is not None:
+                gevent.sleep(0.01)
+        return miner.sock is None
+
+    def test_version(self):
+        client, miner = self.connect()
+        client.sendall(frames('version', 'morty.1', 'c' * 56))
+        self.assertEqual(client.recv(100), frames('ok'))
+        self.assertEqual((miner.address, miner._queued), ('c' * 56, 0))
+
+    def test_invalid_length(self):
+        for prefix in ('-000000010', str(MAX_FRAME + 1).zfill(10)):
+            client, miner = self.connect()
+            client.sendall(prefix)
+            self.assertTrue(self.wait_closed(miner))
+            self.assertEqual(self.miners.clients, set())
+
+    def test_queued(self):
+        client, miner = self.connect()
+        miner.MAX_QUEUED = 1000
+        # Commands wait while one is being handled
+        miner._greenlet = gevent.spawn(gevent.sleep, 10)
+        try:
+            client.sendall(frames('status') * 20)
+            gevent.sleep(0.05)
+            self.assertEqual(len(miner._frames), 20)
+            client.sendall(frames('status') * 60)
+            self.assertTrue(self.wait_closed(miner))
+        finally:
+            miner._greenlet.kill()
+
+
+if __name__ == '__main__':
+    unittest.main()
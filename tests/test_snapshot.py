@@ -0,0 +1,105 @@
+from __future__ import print_function
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pooledbismuth.common import ConsensusBlock, write_json
+from pooledbismuth.payout import SCHEMA
+from pooledbismuth.snapshot import Snapshot, write_network, shard_name
+
+
+ADDRESSES = ['ab' + 'a' * 54, 'ab' + 'b' * 54, 'cd' + 'c' * 54, 'not an address']
+HOUR = 3600 * 1000
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.pooldb = sqlite3.connect(':memory:')
+        self.pooldb.text_factory = str
+        self.pooldb.executescript(SCHEMA)
+        self.pooldb.executemany("INSERT INTO addresses (id, address) VALUES (?, ?)",
+                                [(N + 1, address) for N, address in enumerate(ADDRESSES)])
+        for N in range(4):
+            self.credit(100 + N, HOUR + N * 900, [1, 3, 4])
+        self.snapshot = Snapshot(self.pooldb, self.path, hours=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def credit(self, height, stamp, address_ids):
+        """
+        A won block, with one shmeckle for each address, rolled up
+        """
+        self.pooldb.execute("REPLACE INTO blocks VALUES (?, ?, 1, 10, '', '10', '', 50, 10, 10, 10, ?, ?)",
+                            (height, stamp, height * 10.0, height))
+        for address_id in address_ids:
+            self.pooldb.execute("INSERT OR IGNORE INTO address_hours (address_id, hour) VALUES (?, ?)",
+                                (address_id, stamp // 3600 * 3600))
+            self.pooldb.execute("""
+                UPDATE address_hours SET blocks = blocks + 1, shares = shares + 2, workcount = workcount + 3,
+                                         shmeckles = shmeckles + 1
+                WHERE address_id = ? AND hour = ?
+            """, (address_id, stamp // 3600 * 3600))
+            self.pooldb.execute("INSERT OR IGNORE INTO address_totals (address_id) VALUES (?)", (address_id,))
+            self.pooldb.execute("""
+                UPDATE address_totals SET blocks = blocks + 1, shares = shares + 2, workcount = workcount + 3,
+                                          shmeckles = shmeckles + 1
+                WHERE address_id = ?
+            """, (address_id,))
+
+    def load(self, *names):
+        with open(os.path.join(self.path, *names)) as handle:
+            return json.load(handle)
+
+    def test_shards(self):
+        self.assertEqual(shard_name(ADDRESSES[0]), 'ab')
+        self.assertEqual(shard_name(ADDRESSES[3]), '_')
+        self.assertEqual(self.snapshot.write(now=HOUR + 3600), 3)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.path, 'addresses'))), ['_.json', 'ab.json', 'cd.json'])
+        self.assertEqual(self.load('addresses', 'ab.json'),
+                         {ADDRESSES[0]: dict(blocks=4, shares=8, workcount=12, shmeckles=4)})
+        self.assertEqual(list(self.load('addresses', '_.json')), [ADDRESSES[3]])
+        self.assertEqual(self.snapshot.write(now=HOUR + 3600), 0)
+
+        # Only the shards of addresses credited since are written
+        self.credit(104, HOUR + 4800, [2])
+        self.assertEqual(self.snapshot.write(now=HOUR + 4800), 1)
+        self.assertEqual(sorted(self.load('addresses', 'ab.json')), ADDRESSES[:2])
+        self.assertEqual(self.snapshot.changed_shards(HOUR + 3600), set(['ab']))
+        self.assertFalse([name for name in os.listdir(os.path.join(self.path, 'addresses'))
+                          if name.startswith('.tmp-')])
+
+    def test_pool_stats(self):
+        self.credit(104, HOUR + 4800, [2])
+        self.snapshot.write(now=HOUR + 4800)
+        stats = self.load('pool.json')
+        self.assertEqual(stats['height'], 104)
+        self.assertEqual(stats['exchange_rate'], 10.0)
+        self.assertEqual(stats['blocks'], 5)
+        self.assertEqual(stats['reward'], 50.0)
+        self.assertEqual([row['hour'] for row in stats['by_hour']], [HOUR, HOUR + 3600])
+        self.assertEqual([row['addresses'] for row in stats['by_hour']], [3, 1])
+        self.assertEqual(stats['top'][0], dict(address=ADDRESSES[0], shmeckles=4, workcount=12))
+
+        # The window moves on with time
+        stats = self.snapshot.pool_stats(now=HOUR + 7200)
+        self.assertEqual(stats['blocks'], 1)
+        self.assertEqual(len(stats['by_hour']), 1)
+
+    def test_write_json(self):
+        path = os.path.join(self.path, 'test.json')
+        self.assertTrue(write_json(path, dict(a=1)))
+        self.assertFalse(write_json(path, dict(a=1)))
+        self.assertTrue(write_json(path, dict(a=2)))
+        self.assertEqual(self.load('test.json'), dict(a=2))
+        self.assertEqual(os.listdir(self.path), ['test.json'])
+        write_network(self.path, ConsensusBlock(5, 'f' * 56, 1000.0), 110, dict(hashrate=12.5, miners=3))
+        network = self.load('network.json')
+        self.assertEqual((network['height'], network['difficulty'], network['hashrate']), (5, 110, 12.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
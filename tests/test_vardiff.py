@@ -0,0 +1,37 @@
+from __future__ import print_function
+import unittest
+from pooledbismuth.hashrate import expected_work
+from pooledbismuth.vardiff import EwmaVarDiff
+
+
+class TestEwmaVarDiff(unittest.TestCase):
+    def mine(self, vardiff, rate, now, shares):
+        # Shares arrive exactly when expected for the miner's hashrate
+        for _ in range(shares):
+            now += expected_work(vardiff.diff) / rate
+            vardiff.on_share(vardiff.diff, now)
+            vardiff.retarget(40, now)
+        return now
+
+    def test_converges(self):
+        vardiff = EwmaVarDiff(goal=10, initial=40)
+        now = 1000.0
+        self.assertEqual(vardiff.retarget(40, now), 40)
+        # One million hashes/sec, one share every 10 seconds at 48.2
+        now = self.mine(vardiff, 1e6, now, 20)
+        self.assertEqual(vardiff.diff, 48)
+        now = self.mine(vardiff, 1e6, now, 20)
+        self.assertEqual(vardiff.diff, 48)
+
+    def test_quiet_miner(self):
+        vardiff = EwmaVarDiff(goal=10, initial=40)
+        now = 1000.0
+        vardiff.retarget(40, now)
+        now = self.mine(vardiff, 1e6, now, 20)
+        # Hashrate drops, with no shares it still gets easier work
+        self.assertEqual(vardiff.retarget(40, now + 15), 48)
+        self.assertTrue(vardiff.retarget(40, now + 600) < 48)
+
+
+if __name__ == '__main__':
+    unittest.main()
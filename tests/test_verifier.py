@@ -0,0 +1,64 @@
+from __future__ import print_function
+import random
+import unittest
+import gevent
+from pooledbismuth import bismuth
+from pooledbismuth.common import MinerResult
+from pooledbismuth.verifier import BatchVerifier
+
+
+def random_hex(nbytes):
+    return '%0*x' % (nbytes * 2, random.getrandbits(nbytes * 8))
+
+
+def make_shares(count):
+    """
+    Shares for one block, half at the difficulty they reach and half
+    claiming more than that
+    """
+    block_hash = random_hex(28)
+    shares = list()
+    for N in range(count):
+        address, nonce = random_hex(28), random_hex(16)
+        diff = bismuth.difficulty(address, nonce, block_hash) + N % 2
+        shares.append(MinerResult(diff, address, block_hash, nonce))
+    return shares
+
+
+class TestBatchVerifier(unittest.TestCase):
+    def setUp(self):
+        self.verifier = BatchVerifier(2, batch_size=16)
+
+    def tearDown(self):
+        self.verifier.stop()
+
+    def verify_all(self, shares):
+        greenlets = [gevent.spawn(self.verifier.verify, result) for result in shares]
+        gevent.joinall(greenlets, raise_error=True)
+        return [greenlet.value for greenlet in greenlets]
+
+    def expected(self, shares):
+        return [bool(bismuth.verify(result.address, result.nonce, result.block, result.diff))
+                for result in shares]
+
+    def test_verify(self):
+        shares = make_shares(100)
+        expected = self.expected(shares)
+        self.assertEqual(set(expected), set([True, False]))
+        self.assertEqual(self.verify_all(shares), expected)
+        status = self.verifier.status()
+        self.assertEqual((status['verified'], status['queued']), (100, 0))
+        # Shares queued up together go in the same batch
+        self.assertTrue(status['batches'] < 100)
+
+    def test_failed(self):
+        for proc, _ in self.verifier._procs:
+            proc.terminate()
+            proc.join(1)
+        # Verified inline once the workers are gone
+        shares = make_shares(20)
+        self.assertEqual(self.verify_all(shares), self.expected(shares))
+
+
+if __name__ == '__main__':
+    unittest.main()
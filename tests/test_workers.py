@@ -0,0 +1,66 @@
+from __future__ import print_function
+import socket
+import unittest
+import gevent
+from pooledbismuth.common import ConsensusBlock, MinerResult, send_message, recv_message
+from pooledbismuth.workers import WorkerJob
+
+
+class FakeMiner(object):
+    address = 'm' * 56
+    diff = 40.5
+
+
+class TestWorkerJob(unittest.TestCase):
+    def setUp(self):
+        self.ours, self.theirs = socket.socketpair()
+        self.job = WorkerJob(None, self.theirs)
+
+    def tearDown(self):
+        self.ours.close()
+        self.theirs.close()
+
+    def result(self, nonce, block=None):
+        return MinerResult(40, 'p' * 56, block or self.job.block.hash, nonce)
+
+    def test_jobs(self):
+        blocks = [ConsensusBlock(100, 'a' * 56, 1000.0), ConsensusBlock(101, 'b' * 56, 1060.0)]
+        changes = list()
+        self.job.listen(changes.append)
+        send_message(self.ours, (blocks[0], 38.5, 37))
+        send_message(self.ours, (blocks[0], 39.0, 41))
+        self.ours.close()
+        self.job.receive_jobs()
+        # Only a new block is a new job
+        self.assertEqual(changes, blocks[:1])
+        self.assertEqual((self.job.difficulty(), self.job.highest_difficulty()), (39.0, 41))
+        self.assertEqual(self.job.top(), (blocks[0], 0, 100))
+        self.assertTrue(self.job.on_result(self.result('n1'), FakeMiner()))
+        self.assertTrue(self.job.is_duplicate(self.result('n1')))
+
+        self.ours, self.theirs = socket.socketpair()
+        self.job.sock = self.theirs
+        send_message(self.ours, (blocks[1], 39.0, 37))
+        self.ours.close()
+        self.job.receive_jobs()
+        self.assertEqual(changes, blocks)
+        self.assertFalse(self.job.is_duplicate(self.result('n1')))
+
+    def test_shares(self):
+        self.assertFalse(self.job.on_result(MinerResult(40, 'p' * 56, 'a' * 56, 'n0'), FakeMiner()))
+        self.job.block = ConsensusBlock(100, 'a' * 56, 1000.0)
+        self.assertTrue(self.job.on_result(self.result('n1'), FakeMiner()))
+        self.assertFalse(self.job.on_result(self.result('n1'), FakeMiner()))
+        self.assertFalse(self.job.on_result(self.result('n2', 'c' * 56), FakeMiner()))
+        self.assertTrue(self.job.on_result(self.result('n2'), FakeMiner()))
+        sender = gevent.spawn(self.job.send_shares)
+        try:
+            accepted, stale, duplicates = recv_message(self.ours)
+        finally:
+            sender.kill()
+        self.assertEqual(accepted, [(tuple(self.result('n1')), 'm' * 56, 40), (tuple(self.result('n2')), 'm' * 56, 40)])
+        self.assertEqual((stale, duplicates), (2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
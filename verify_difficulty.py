@@ -1,23 +1,15 @@
 #!/usr/bin/env python
 from __future__ import print_function
-import sqlite3
 from pooledbismuth import bismuth
+from pooledbismuth.ledger import open_ledger
 
-ledgerdb = sqlite3.connect("../Bismuth/static/ledger.db")  # open to select the last tx to create a new hash from
-ledgerdb.text_factory = str
-ledgercon = ledgerdb.cursor()
-ledgercon.execute("""
-    SELECT timestamp, block_height, block_hash, address, openfield, fee, reward FROM transactions
-    WHERE block_height > 90000 AND address = recipient AND fee = 0
-    ORDER BY block_height ASC
-""")  # , (myid.public_key_hashed,))
-result = ledgercon.fetchall()
+ledger = open_ledger("../Bismuth/static/ledger.db", "data/ledger-index.db")
 
 
 def calc_diff(block_history, time_drop, db_timestamp_last):
     halfhour_ago = db_timestamp_last - (60 * 30)
     while len(block_history):
-        hist_stamp = float(block_history[0][0])
+        hist_stamp = float(block_history[0].timestamp)
         if hist_stamp <= halfhour_ago:
             block_history.pop(0)
             continue
@@ -37,8 +29,10 @@ def calc_diff(block_history, time_drop, db_timestamp_last):
 block_history = list()
 prev_hash = None
 prev_timestamp = None
-for row in result:
-    timestamp, block_height, block_hash, address, nonce, fee, reward = row
+for row in ledger.rewards(90000):
+    if row.address != row.recipient or float(row.fee) != 0:
+        continue
+    timestamp, block_hash, address, nonce = row.timestamp, row.block_hash, row.address, row.openfield
     timestamp = float(timestamp)
     if prev_hash is not None:
         diff = calc_diff(block_history, timestamp, prev_timestamp)
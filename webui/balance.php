@@ -15,10 +15,15 @@ if( empty($address_id) ) {
 
 $block = $db->query('SELECT * FROM blocks ORDER BY id DESC LIMIT 1')->fetch(PDO::FETCH_ASSOC);
 
-$stmt = $db->prepare('SELECT COUNT(block_id) as total_blocks, SUM(shmeckles) as total_shmeckles, workcount FROM workproof WHERE address_id = ? GROUP BY address_id');
+$stmt = $db->prepare('SELECT blocks AS total_blocks, shmeckles AS total_shmeckles, workcount FROM address_totals WHERE address_id = ?');
 $stmt->execute(array($address_id));
 $stats = $stmt->fetch(PDO::FETCH_ASSOC);
 unset($stmt);
+
+$stmt = $db->prepare('SELECT SUM(blocks) AS blocks, SUM(shmeckles) AS shmeckles FROM address_hours WHERE address_id = ? AND hour >= ?');
+$stmt->execute(array($address_id, (intval(time() / 3600) - 23) * 3600));
+$recent = $stmt->fetch(PDO::FETCH_ASSOC);
+unset($stmt);
 ?>
 <pre>
 Address: <?= $address ?>
@@ -29,4 +34,6 @@ Shmeckles: <?= $stats['total_shmeckles'] ?> (<?= round($stats['total_shmeckles']
 
 BIS: <?= ($stats['total_shmeckles'] / $block['pool_shmeckles']) * $block['pool_balance'] ?>
 
+Last 24 Hours: <?= intval($recent['blocks']) ?> blocks, <?= round($recent['shmeckles'], 3) ?> shmeckles
+
 </pre>
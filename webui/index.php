@@ -2,8 +2,6 @@
 require_once '.common.php';
 
 $workproof = array();
-$address_ids = array();
-$block_ids = array();
 $addresses = array();
 
 $input_hours = min(max(intval(param('hours')), 1), 12);
@@ -25,23 +23,19 @@ foreach( $block_list AS $block ) {
 	if( $block['won'] ) {
 		$reward_total += $block['reward'];
 	}
-	$block_ids []= intval($block['id']);
 }
 
-$sql = sprintf("SELECT * FROM workproof WHERE block_id IN (%s)", implode(',', $block_ids));
-$proof_list = $db->query($sql)->fetchAll();
-foreach( $proof_list AS $proof ) {
-	$address_ids []= $proof['address_id'];
+$sql = "SELECT w.*, a.address FROM blocks b
+        JOIN workproof w ON w.block_id = b.id
+        JOIN addresses a ON a.id = w.address_id
+        WHERE b.stamp >= $stamp_begin";
+foreach( $db->query($sql)->fetchAll() AS $proof ) {
+	$addresses[$proof['address_id']] = $proof['address'];
 	if( ! isset($workproof[$proof['block_id']]) ) {
 		$workproof[$proof['block_id']] = array();
 	}
 	$workproof[$proof['block_id']][$proof['address_id']] = $proof;
 }
-
-$sql = sprintf("SELECT id, address FROM addresses WHERE id IN (%s)", implode(',', $address_ids));
-foreach( $db->query($sql)->fetchAll() AS $row ) {
-	$addresses[$row['id']] = $row['address'];
-}
 ?>
 
 <html>